@@ -1,7 +1,10 @@
-import random
+import numpy as np
 import sys
 sys.path.insert(1,'../')
-import src.utils as ut # type: ignore
+from src.graph_state import GraphState # type: ignore
+from src.random_streams import RandomStream # type: ignore
+import src.chain_loop as cl # type: ignore
+import src.batch_swaps as bs # type: ignore
 
 
 class CM:
@@ -13,46 +16,56 @@ class CM:
 
         self.has_converged = False
         self.spacing = -1
-        if len(set(degrees.values())) == 1:
+        self.burn_in = -1
+        # whether the swaps preserve the JLM
+        self.preserves_jlm = False
+        # fraction of the draws out of space (see MCMC_LA)
+        self.oos_rate = 0.
+        self.initialize(edges, degrees, node_labels)
+        # isolated nodes do not count
+        if len(np.unique(self.degrees[self.degrees > 0])) == 1:
             raise ValueError("Regular graph! Degree assortativity undefined.")
-        self.degrees = degrees
-        self.node_labels = node_labels
-        self.initialize(edges)
     
     def MCMC_step(self,
-                  A: dict[tuple[int, int], int], 
-                  edge_list: list[tuple[int, int]],
+                  state: GraphState,
+                  stream: RandomStream,
                   swapped: list[int]) -> float:
         '''
         Performs a step in the Markov chain using MCMC-MH (Algorithm 1).
         
         INPUT
         ======
-        A (dict): The weight of each edge. Changed inplace.
-        edge_list (list): List of edges in A. Changed inplace.
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
         
         OUTPUT
         ======
         swaps (list): Four nodes swapped if a swap is accepted. Empty otherwise.
         '''
         # Choose two edges uniformly at random
-        p1 = random.randrange(self.m)
-        p2 = random.randrange(self.m - 1)
-        if p1 == p2:
-            p2 = self.m - 1
+        # and either swap orientation 50% at random
+        p1, p2, coin, acc = stream.next()
+        return self.MCMC_move(state, p1, p2, coin, acc, swapped)
 
-        u, v = edge_list[p1]
-        # Pick either swap orientation 50% at random
-        if random.uniform(0, 1) < 0.5:
-            x, y = edge_list[p2]
+    def MCMC_move(self,
+                  state: GraphState,
+                  p1: int,
+                  p2: int,
+                  coin: bool,
+                  acc: float,
+                  swapped: list[int]) -> float:
+        '''
+        Performs the step of the Markov chain defined by
+        the random draws p1, p2, coin, and acc (see draw_block).
+        '''
+        u = state.src_view[p1]
+        v = state.dst_view[p1]
+        if coin:
+            x = state.src_view[p2]
+            y = state.dst_view[p2]
         else:
-            y, x = edge_list[p2]
-
-        w_uv = A[u, v]
-        w_xy = A[x, y]
-        
-        w_ux = A.get((u,x), 0)
-        w_vy = A.get((v,y), 0)
+            y = state.src_view[p2]
+            x = state.dst_view[p2]
 
         if v == x or u == y:
             # line 7 Algorithm 1: swap would leave the multigraph unchanged
@@ -60,6 +73,11 @@ class CM:
             return -1
         # if we are here, it means that the swap is valid
         # and it leads to a different multigraph
+        A = state.table
+        w_uv = A.get(u, v)
+        w_xy = A.get(x, y)
+        w_ux = A.get(u, x)
+        w_vy = A.get(v, y)
         num_loops = 0
         if u == v:
             num_loops += 1
@@ -83,58 +101,115 @@ class CM:
             p = (w_ux + 1) * (w_vy + 1) / (w_uv * w_xy)
 
         P = min(p, 1.0)
-        # If we proceed with the swap we update A, swaps and edge_list
-        if random.uniform(0, 1) < P:
+        # If we proceed with the swap we update the state and swaps
+        if acc < P:
             swapped[0] = u
             swapped[1] = v
             swapped[2] = x
             swapped[3] = y
-            
-            # if (u == v and A[u, v] == 2) or (u !) 
-            
-            A[u, v] -= 1
-            A[v, u] -= 1
-            if A[u, v] == 0:
-                del A[u, v]
-                if u != v:
-                    del A[v, u]
-            A[x, y] -= 1
-            A[y, x] -= 1   
-            if A[x, y] == 0:
-                del A[x, y]
-                if x != y:
-                    del A[y, x]
-            A[u, x] = A.get((u,x), 0) + 1
-            A[x, u] = A.get((x,u), 0) + 1
-            A[v, y] = A.get((v,y), 0) + 1
-            A[y, v] = A.get((y,v), 0) + 1
-
-            edge_list[p1] = u, x
-            edge_list[p2] = v, y
+            state.apply_swap(p1, p2, u, v, x, y)
             return P
         swapped[0] = -1    
         return P
+
+    def MCMC_batch(self,
+                   state: GraphState,
+                   stream: RandomStream,
+                   size: int):
+        '''
+        Performs size steps in the Markov chain at once.
+        The outcome is the same as calling MCMC_step size times.
+        
+        INPUT
+        ======
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
+        size (int): number of steps.
+        
+        OUTPUT
+        ======
+        P (np.ndarray): value returned by MCMC_step at each step.
+        swaps (np.ndarray): array of shape (size, 4) with the four nodes
+                            swapped at each step, -1 if no swap was accepted.
+        '''
+        p1, p2, coin, acc = stream.take(size)
+        u, v, x, y = bs.orient_edges(state, p1, p2, coin)
+        inert = (v == x) | (u == y)
+        inert, conflict = bs.split_batch(self.n, p1, p2, u, v, x, y, inert)
+        P = np.zeros(size)
+        swaps = np.full((size, 4), -1, np.int64)
+        P[inert] = -1
+        free = np.flatnonzero(~(inert | conflict))
+        P[free], accept = bs.perform_swaps(state, p1[free], p2[free], u[free], v[free],
+                                           x[free], y[free], acc[free])
+        accept = free[accept]
+        swaps[accept] = np.stack([u[accept], v[accept], x[accept], y[accept]], 1)
+        # conflicting steps are performed in order
+        swapped = [-1, -1, -1, -1]
+        conflict = np.flatnonzero(conflict)
+        moves = zip(conflict.tolist(), p1[conflict].tolist(), p2[conflict].tolist(),
+                    coin[conflict].tolist(), acc[conflict].tolist())
+        for i, e1, e2, c, a in moves:
+            P[i] = self.MCMC_move(state, e1, e2, c, a, swapped)
+            if swapped[0] != -1:
+                swaps[i] = swapped
+                swapped[0] = -1
+        return P, swaps
+
+    def step_many(self,
+                  state: GraphState,
+                  stream: RandomStream,
+                  n: int,
+                  count_mode: str='all',
+                  callback=None,
+                  every: int=0,
+                  batch_size: int=0,
+                  instruments: cl.StepInstruments=None,
+                  audit_every: int=-1,
+                  counters: dict=None) -> dict:
+        '''
+        Performs iterations of the Markov chain until n of them
+        are counted, and returns the counters (see chain_loop.step_many).
+        '''
+        return cl.step_many(self, state, stream, n, count_mode, callback,
+                            every, batch_size, instruments, audit_every,
+                            counters)
+
+    def draw_block(self,
+                   rng: np.random.Generator,
+                   size: int):
+        '''
+        Random draws of size steps: ids of the two edges, orientation
+        of the second edge, and uniform value for the acceptance test.
+        '''
+        p1 = rng.integers(self.m, size=size)
+        p2 = rng.integers(self.m - 1, size=size)
+        p2[p2 == p1] = self.m - 1
+        coin = rng.random(size) < 0.5
+        acc = rng.random(size)
+        return p1, p2, coin, acc
     
     def initialize(self, 
-                   edges: list[tuple[int,int]]):
+                   edges: list[tuple[int,int]],
+                   degrees: dict[int,int],
+                   node_labels: dict[int,int]):
         '''
-        edges (list): list of edges.
-        degrees (dict): for each node, its degree.
+        edges (list or np.ndarray): list of edges, or array of shape (m, 2).
+        degrees (dict or np.ndarray): for each node, its degree.
+        node_labels (dict or np.ndarray): for each node, its label.
         '''
-        n = len(self.degrees)
-        
-        self.A = dict()
-        ut.convert_edgelist_to_dictionary(edges, self.A)
-        
-        self.edge_list = [(u, v) for u, v in edges]
-        self.m = len(edges)
+        self.state = GraphState.from_edges(edges, node_labels, degrees)
+        self.degrees = self.state.degrees
+        self.node_labels = self.state.labels
+        self.n = self.state.n
+        self.m = self.state.m
 
         S1 = 2 * self.m
         S2 = 0
         S3 = 0
-        for i in range(n):
-            S2 += (self.degrees[i])**2
-            S3 += (self.degrees[i])**3
+        for d in self.degrees.tolist():
+            S2 += d**2
+            S3 += d**3
 
         self.r_denominator = S1 * S3 - (S2**2)
         self.S2 = S2
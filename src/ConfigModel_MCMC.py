@@ -1,11 +1,17 @@
 import numpy as np
-from collections import defaultdict
 from tqdm.contrib.concurrent import process_map
 import time
-import random
+import os
 import sys
 sys.path.insert(1,'../')
 import src.utils as ut # type: ignore
+import src.random_streams as rs # type: ignore
+import src.shared_state as ss # type: ignore
+import src.sample_store as sst # type: ignore
+import src.checkpoint as ck # type: ignore
+import src.graph_stats as gs # type: ignore
+import src.online_stats as ost # type: ignore
+import src.chain_loop as cl # type: ignore
 
 
 def get_graph_parallel_chains(sampler,
@@ -16,7 +22,13 @@ def get_graph_parallel_chains(sampler,
                               swaps: int=-1,
                               max_workers: int=4,
                               actual_swaps: bool=False,
-                              seed: int=0):
+                              seed: int=0,
+                              batch_size: int=0,
+                              audit_every: int=-1,
+                              codec: str=None,
+                              encoding: str='full',
+                              checkpoint: dict=None,
+                              statistics: list=None):
         '''
         INPUT
         ======
@@ -26,23 +38,364 @@ def get_graph_parallel_chains(sampler,
         samp_name (str): name of the sampler to use to sample the graph.
         count (int): number of graphs to sample from the Configuration model.
         swaps (int): number of swaps before returning the current state.
+                     If negative, sampler.burn_in is used, or |E|log(|E|)
+                     if the sampler does not set it.
         max_workers (int): number of concurrent threads.
         actual_swaps (bool): if True, an iteration is counted only if the
                              transition to the next state was accepted.
-        seed (int): for reproducibility.
+        seed (int): for reproducibility. The i-th graph is sampled with
+                    the i-th child of SeedSequence(seed).
+        batch_size (int): if positive, the steps are performed in batches
+                          of this size with MCMC_batch. The sampled graphs
+                          do not depend on it.
+        audit_every (int): if non-negative, the degree sequence and the JLM
+                           of each chain are checked at the end of the chain,
+                           and every audit_every steps if positive.
+        codec (str): if given, the graphs are written to a single container
+                     (see create_sample_store) compressed with codec
+                     ('none', 'zlib', or 'lzma'), instead of one TSV file each.
+        encoding (str): how the graphs are stored in the container: 'full',
+                        'diff' (slots that differ from the original graph),
+                        or 'log' (slots written by the chain).
+        checkpoint (dict): if given, arguments of the Checkpointer of each
+                           chain ('every', 'seconds', and 'resume', see
+                           checkpoint.Checkpointer). With resume, the chains
+                           continue from their latest checkpoint, and the
+                           graphs already written are not sampled again.
+        statistics (list): if given, statistics of the sampled graphs (names
+                           or functions, see graph_stats.get_statistics).
+                           No graph is written: each worker computes the
+                           statistics on its graph and the rows are saved
+                           in a single table (see save_statistics).
         
         OUTPUT
         ======
-        List of graphs sampled from the state space.
+        Rows of the table of statistics, sorted by graph id, if statistics
+        is given.
         '''
         if swaps < 0:
-            swaps = sampler.m * np.log(sampler.m)
-        inputs = []
-        for i in range(count):
-            inputs.append([sampler, seed + i, swaps, out_dir, graph_name, samp_name])
-        if actual_swaps:
-            return process_map(sample_graph_exact_swaps, inputs, max_workers=max_workers)
-        return process_map(sample_graph, inputs, max_workers=max_workers)
+            swaps = sampler.burn_in if sampler.burn_in > 0 else sampler.m * np.log(sampler.m)
+        resume = checkpoint is not None and checkpoint['resume']
+        store = None
+        if codec is not None and statistics is None:
+            store = create_sample_store(sampler, out_dir, graph_name, samp_name, count,
+                                        swaps, seed, actual_swaps, codec, encoding,
+                                        exist_ok=resume)
+        run_name = f'{graph_name}__sampler_{samp_name}__swaps_{swaps}__seed_{seed}__actualswaps_{actual_swaps}'
+        if statistics is not None:
+            statistics = gs.get_statistics(statistics)
+        # the workers attach to the sampler published once in shared memory
+        with ss.SharedSampler(sampler) as shared:
+            inputs = []
+            for i in range(count):
+                checkpointer = ck.chain_checkpointer(checkpoint, out_dir, run_name, i)
+                inputs.append([shared, seed, i, swaps, out_dir, graph_name, samp_name, batch_size, audit_every,
+                               store, checkpointer, statistics])
+            if actual_swaps:
+                rows = process_map(sample_graph_exact_swaps, inputs, max_workers=max_workers)
+            else:
+                rows = process_map(sample_graph, inputs, max_workers=max_workers)
+        if statistics is not None:
+            save_statistics(rows, out_dir, run_name)
+            return rows
+
+
+def get_graph_thinned_chains(sampler,
+                             out_dir: str,
+                             graph_name: str,
+                             samp_name: str,
+                             count: int=1,
+                             swaps: int=-1,
+                             spacing: int=-1,
+                             num_chains: int=1,
+                             max_workers: int=4,
+                             actual_swaps: bool=False,
+                             seed: int=0,
+                             batch_size: int=0,
+                             audit_every: int=-1,
+                             codec: str=None,
+                             encoding: str='full',
+                             checkpoint: dict=None,
+                             statistics: list=None):
+        '''
+        Samples count graphs from num_chains long chains. Each chain is
+        burned in once with swaps steps, and then emits a graph every
+        spacing steps, until it has emitted its share of the count graphs.
+
+        INPUT
+        ======
+        sampler: which algorithm use to move in the Markov graph.
+        out_dir (str): where the graphs should be stored.
+        graph_name (str): name of the observed graph.
+        samp_name (str): name of the sampler to use to sample the graph.
+        count (int): number of graphs to sample.
+        swaps (int): number of burn-in steps of each chain (see
+                     get_graph_parallel_chains if negative).
+        spacing (int): number of steps between two graphs emitted by a chain.
+                       If not positive, sampler.spacing is used, or the
+                       number of edges if the sampler does not set it.
+        num_chains (int): number of chains. The count graphs are split
+                          evenly among them.
+        max_workers (int): number of concurrent processes.
+        actual_swaps (bool): if True, an iteration is counted only if the
+                             transition to the next state was accepted.
+        seed (int): for reproducibility. The j-th chain runs with
+                    the j-th child of SeedSequence(seed).
+        batch_size (int): if positive, the steps are performed in batches
+                          of this size with MCMC_batch. The sampled graphs
+                          do not depend on it.
+        audit_every (int): if non-negative, the degree sequence and the JLM
+                           of each chain are checked after each graph,
+                           and every audit_every steps if positive.
+        codec (str): if given, the graphs are written to a single container
+                     (see get_graph_parallel_chains).
+        encoding (str): how the graphs are stored in the container. With
+                        'diff' and 'log', each graph is stored against the
+                        previous graph of its chain (the first against
+                        the original graph).
+        checkpoint (dict): arguments of the Checkpointer of each chain
+                           (see get_graph_parallel_chains). A checkpoint is
+                           also saved after each graph.
+        statistics (list): if given, statistics of the sampled graphs, saved
+                           in a single table instead of the graphs (see
+                           get_graph_parallel_chains). The table has a column
+                           with the id of the chain of each graph.
+
+        OUTPUT
+        ======
+        Rows of the table of statistics, sorted by graph id, if statistics
+        is given.
+        '''
+        if swaps < 0:
+            swaps = sampler.burn_in if sampler.burn_in > 0 else sampler.m * np.log(sampler.m)
+        if spacing <= 0:
+            spacing = sampler.spacing if sampler.spacing > 0 else sampler.m
+        num_chains = max(1, min(num_chains, count))
+        resume = checkpoint is not None and checkpoint['resume']
+        store = None
+        if codec is not None and statistics is None:
+            store = create_sample_store(sampler, out_dir, graph_name, samp_name, count,
+                                        swaps, seed, actual_swaps, codec, encoding,
+                                        exist_ok=resume, num_chains=num_chains, spacing=spacing)
+        run_name = (f'{graph_name}__sampler_{samp_name}__swaps_{swaps}__seed_{seed}__actualswaps_{actual_swaps}'
+                    f'__num_chains_{num_chains}__spacing_{spacing}__count_{count}')
+        if statistics is not None:
+            statistics = gs.get_statistics(statistics)
+        with ss.SharedSampler(sampler) as shared:
+            inputs = []
+            for j, ids in enumerate(np.array_split(np.arange(count), num_chains)):
+                checkpointer = ck.chain_checkpointer(checkpoint, out_dir, run_name, j)
+                inputs.append([shared, seed, j, ids.tolist(), swaps, spacing, out_dir, graph_name,
+                               samp_name, actual_swaps, batch_size, audit_every, store, checkpointer,
+                               statistics])
+            outputs = process_map(sample_graphs_thinned, inputs, max_workers=max_workers)
+        if statistics is not None:
+            rows = sorted((row for rows in outputs for row in rows), key=lambda row: row['sample'])
+            save_statistics(rows, out_dir, run_name)
+            return rows
+
+
+def save_statistics(rows: list[dict], out_dir: str, run_name: str):
+    '''
+    Saves the statistics of the graphs sampled in a run
+    (see graph_stats.save_table).
+    '''
+    gs.save_table(f'{out_dir}/statistics__{run_name}.tsv', rows)
+
+
+def create_sample_store(sampler,
+                        out_dir: str,
+                        graph_name: str,
+                        samp_name: str,
+                        count: int,
+                        swaps: int,
+                        seed: int,
+                        actual_swaps: bool,
+                        codec: str,
+                        encoding: str='full',
+                        exist_ok: bool=False,
+                        **meta) -> str:
+    '''
+    Creates the container of the count graphs sampled in a run
+    (see sample_store) and returns its path. The graph with id i is
+    the i-th sample of the container. If exist_ok, an existing
+    container is kept (e.g., to resume the run).
+    '''
+    fpath = f'{out_dir}/{graph_name}__sampler_{samp_name}__swaps_{swaps}__seed_{seed}__actualswaps_{actual_swaps}.samples'
+    if exist_ok and os.path.exists(fpath):
+        return fpath
+    base = np.stack([sampler.state.src, sampler.state.dst], 1)
+    sst.create_store(fpath, count, sampler.m, codec, encoding, base, graph_name=graph_name,
+                     sampler=samp_name, actual_swaps=actual_swaps, **meta)
+    return fpath
+
+
+def start_store_log(store: str, sampler, state):
+    '''
+    Starts logging the slots written in state if the graphs are stored
+    in a container with the 'log' encoding. Logging stops when the log
+    gets larger than a graph.
+    '''
+    if store is not None and sst.store_encoding(store) == 'log':
+        state.start_log(sst.log_limit(sampler.m))
+
+
+def resume_chain(checkpointer, state, stream):
+    '''
+    Restores state and stream from the latest checkpoint of a chain
+    (see checkpoint.Checkpointer), if any.
+
+    OUTPUT
+    ======
+    meta (dict): values saved with the checkpoint, None if the chain
+                 starts from scratch. meta['finished'] is True if the
+                 chain is over, and then state and stream are unchanged.
+    counters (dict): counters of step_many at the checkpoint.
+    '''
+    ckpt = checkpointer.load() if checkpointer is not None else None
+    if ckpt is None:
+        return None, None
+    if ckpt['meta'].get('finished'):
+        return ckpt['meta'], None
+    counters = checkpointer.restore(ckpt, state, stream)
+    if state.log is not None:
+        # the slots written before the checkpoint are not logged
+        state.log.full = True
+    return ckpt['meta'], counters
+
+
+def run_chain(sampler,
+              state,
+              stream,
+              n: int,
+              count_mode: str,
+              batch_size: int,
+              audit_every: int,
+              checkpointer,
+              counters: dict,
+              runtime,
+              **meta) -> dict:
+    '''
+    Runs sampler.step_many on the chain, saving its checkpoints
+    when they are due (see checkpoint.Checkpointer) with the runtime (s)
+    of the chain, returned by runtime(), and meta.
+    '''
+    callback = None
+    every = 0
+    if checkpointer is not None and checkpointer.enabled():
+        def save(counters):
+            if checkpointer.due(counters['steps']):
+                checkpointer.save(state, stream, counters, runtime=runtime(), **meta)
+        callback = save
+        every = checkpointer.poll_every()
+    return sampler.step_many(state, stream, n, count_mode=count_mode, callback=callback,
+                             every=every, batch_size=batch_size, audit_every=audit_every,
+                             counters=counters)
+
+
+def sample_graphs_thinned(inp):
+    '''
+    Burns in a chain and writes a graph every spacing steps.
+    The file of each graph reports the steps performed and the time
+    elapsed since the beginning of the chain.
+
+    INPUT
+    ======
+    sampler (object): sampler to use to sample the graphs, or its SharedSampler.
+    seed (int): for reproducibility.
+    chain (int): id of the chain in the run.
+    ids (list): ids of the graphs emitted by the chain.
+    swaps (int): number of burn-in steps.
+    spacing (int): number of steps between two graphs.
+    actual_swaps (bool): if True, only accepted steps are counted.
+    batch_size (int): number of steps performed with each call to MCMC_batch.
+                      If 0, the steps are performed one by one.
+    audit_every (int): how often the degree sequence and the JLM are checked
+                       (see chain_loop.step_many).
+    store (str): path of the container of the graphs, None to write
+                 one TSV file per graph.
+    checkpointer (Checkpointer): checkpoints of the chain, or None.
+    statistics (dict): if given, statistics computed on each graph
+                       instead of writing it (see graph_stats.get_statistics).
+                       If they need the triangles, the triangles are
+                       tracked (see graph_state.TriangleCounter) after
+                       the first graph, so the burn-in is not tracked.
+
+    OUTPUT
+    ======
+    Rows with the statistics of the graphs, if statistics is given.
+    '''
+    sampler = ss.get_sampler(inp[0])
+    seed = inp[1]
+    chain = inp[2]
+    ids = inp[3]
+    swaps = inp[4]
+    spacing = inp[5]
+    out_dir = inp[6]
+    graph_name = inp[7]
+    sampl_name = inp[8]
+    actual_swaps = inp[9]
+    batch_size = inp[10]
+    audit_every = inp[11]
+    store = inp[12]
+    checkpointer = inp[13]
+    statistics = inp[14]
+
+    # out of space iterations are not counted
+    count_mode = 'accepted' if actual_swaps else 'valid'
+    stream = rs.RandomStream(rs.chain_generator(seed, chain), sampler.draw_block)
+    state = sampler.state.copy()
+    start_store_log(store, sampler, state)
+    # graph the next one is stored against
+    parent = -1
+    ref = (sampler.state.src, sampler.state.dst)
+    # position in ids of the next graph, and counters of its steps
+    first = 0
+    runtime = 0.
+    rows = []
+    meta, counters = resume_chain(checkpointer, state, stream)
+    if meta is not None:
+        if meta.get('finished'):
+            return meta.get('statistics')
+        first = meta['next']
+        runtime = meta['runtime']
+        rows = meta.get('statistics') or []
+        # the graph is stored in full
+        ref = None
+    track = statistics is not None and any(name in gs.TRIANGLE_STATISTICS for name in statistics)
+    start = time.time()
+    for k in range(first, len(ids)):
+        idx = ids[k]
+        run_chain(sampler, state, stream, swaps if k == 0 else spacing, count_mode, batch_size,
+                  audit_every, checkpointer, counters, lambda: runtime + time.time() - start,
+                  next=k, statistics=rows)
+        counters = None
+        done = swaps + k * spacing
+        end = runtime + time.time() - start
+        if statistics is not None:
+            row = {'sample': idx, 'chain': chain, 'seed': seed, 'swaps': done, 'runtime': end}
+            row.update(gs.evaluate(statistics, sampler, state))
+            rows.append(row)
+            if track and state.triangles is None:
+                # updated with each swap between two graphs
+                # instead of recounted on each graph
+                state.start_triangles()
+        elif store is not None:
+            sst.write_sample(store, idx, state.src, state.dst, seed, done, end, chain,
+                             parent, ref, state.log)
+            parent = idx
+            ref = (state.src.copy(), state.dst.copy())
+            if state.log is not None:
+                state.log.clear()
+        else:
+            fpath = f'{out_dir}/{graph_name}__sampler_{sampl_name}__swaps_{done}__runtime_{end}__seed_{seed}__sample_{idx}__actualswaps_{actual_swaps}__chain_{chain}.tsv'
+            ut.dump_edge_list(fpath, state.edge_list())
+        if checkpointer is not None and checkpointer.enabled():
+            checkpointer.save(state, stream, None, runtime=end, next=k + 1, statistics=rows)
+    if checkpointer is not None and checkpointer.enabled():
+        checkpointer.finish(statistics=rows)
+    if statistics is not None:
+        return rows
 
 
 def sample_graph_exact_swaps(inp):
@@ -52,78 +405,129 @@ def sample_graph_exact_swaps(inp):
     
     INPUT
     ======
-    sampler (object): sampler to use to sample the graph.
+    sampler (object): sampler to use to sample the graph, or its SharedSampler.
     seed (int): for reproducibility.
+    idx (int): id of the graph in the run.
     swaps (int): number of swaps before returning the current state.
+    batch_size (int): number of steps performed with each call to MCMC_batch.
+                      If 0, the steps are performed one by one.
+    audit_every (int): how often the degree sequence and the JLM are checked
+                       (see chain_loop.step_many).
+    store (str): path of the container of the graphs, None to write
+                 one TSV file per graph.
+    checkpointer (Checkpointer): checkpoints of the chain, or None.
+    statistics (dict): if given, statistics computed on the graph
+                       instead of writing it (see graph_stats.get_statistics).
+
+    OUTPUT
+    ======
+    Row with the statistics of the graph, if statistics is given.
     '''
-    sampler = inp[0]
+    sampler = ss.get_sampler(inp[0])
     seed = inp[1]
-    swaps = inp[2]
-    out_dir = inp[3]
-    graph_name = inp[4]
-    sampl_name = inp[5]
+    idx = inp[2]
+    swaps = inp[3]
+    out_dir = inp[4]
+    graph_name = inp[5]
+    sampl_name = inp[6]
+    batch_size = inp[7]
+    audit_every = inp[8]
+    store = inp[9]
+    checkpointer = inp[10]
+    statistics = inp[11]
     
-    random.seed(seed)
-    swapped = [-1, -1, -1, -1]
-    actual_swaps = 0
-
-    A = ut.copy_weight_dict(sampler.A)
-    edges = ut.copy_edge_list(sampler.edge_list)
+    stream = rs.RandomStream(rs.chain_generator(seed, idx), sampler.draw_block)
+    state = sampler.state.copy()
+    start_store_log(store, sampler, state)
+    runtime = 0.
+    meta, counters = resume_chain(checkpointer, state, stream)
+    if meta is not None:
+        if meta.get('finished'):
+            return meta.get('statistics')
+        runtime = meta['runtime']
     start = time.time()
-    while actual_swaps < swaps:
-        sampler.MCMC_step(A, edges, swapped)
-        if swapped[0] != -1:
-            actual_swaps += 1
-            swapped[0] = -1
-    end = time.time() - start
+    run_chain(sampler, state, stream, swaps, 'accepted', batch_size, audit_every,
+              checkpointer, counters, lambda: runtime + time.time() - start)
+    end = runtime + time.time() - start
     
-    
-    fpath = f'{out_dir}/{graph_name}__sampler_{sampl_name}__swaps_{swaps}__runtime_{end}__seed_{seed}__actualswaps_True.tsv'
-    ut.dump_edge_list(fpath, edges)
+    row = None
+    if statistics is not None:
+        row = {'sample': idx, 'seed': seed, 'swaps': swaps, 'runtime': end}
+        row.update(gs.evaluate(statistics, sampler, state))
+    elif store is not None:
+        sst.write_sample(store, idx, state.src, state.dst, seed, swaps, end,
+                         ref=(sampler.state.src, sampler.state.dst), log=state.log)
+    else:
+        fpath = f'{out_dir}/{graph_name}__sampler_{sampl_name}__swaps_{swaps}__runtime_{end}__seed_{seed}__sample_{idx}__actualswaps_True.tsv'
+        ut.dump_edge_list(fpath, state.edge_list())
+    if checkpointer is not None and checkpointer.enabled():
+        checkpointer.finish(statistics=row)
+    return row
 
 
 def sample_graph(inp):
     '''
     INPUT
     ======
-    sampler (object): sampler to use to sample the graph.
+    sampler (object): sampler to use to sample the graph, or its SharedSampler.
     seed (int): for reproducibility.
+    idx (int): id of the graph in the run.
     swaps (int): number of swaps before returning the current state.
+    batch_size (int): number of steps performed with each call to MCMC_batch.
+                      If 0, the steps are performed one by one.
+    audit_every (int): how often the degree sequence and the JLM are checked
+                       (see chain_loop.step_many).
+    store (str): path of the container of the graphs, None to write
+                 one TSV file per graph.
+    checkpointer (Checkpointer): checkpoints of the chain, or None.
+    statistics (dict): if given, statistics computed on the graph
+                       instead of writing it (see graph_stats.get_statistics).
+
+    OUTPUT
+    ======
+    Row with the statistics of the graph, if statistics is given.
     '''
-    sampler = inp[0]
+    sampler = ss.get_sampler(inp[0])
     seed = inp[1]
-    swaps = inp[2]
-    out_dir = inp[3]
-    graph_name = inp[4]
-    sampl_name = inp[5]
+    idx = inp[2]
+    swaps = inp[3]
+    out_dir = inp[4]
+    graph_name = inp[5]
+    sampl_name = inp[6]
+    batch_size = inp[7]
+    audit_every = inp[8]
+    store = inp[9]
+    checkpointer = inp[10]
+    statistics = inp[11]
     
-    random.seed(seed)
-    swapped = [-1, -1, -1, -1]
-    
-    A = ut.copy_weight_dict(sampler.A)
-    edges = ut.copy_edge_list(sampler.edge_list)
+    stream = rs.RandomStream(rs.chain_generator(seed, idx), sampler.draw_block)
+    state = sampler.state.copy()
+    start_store_log(store, sampler, state)
+    runtime = 0.
+    meta, counters = resume_chain(checkpointer, state, stream)
+    if meta is not None:
+        if meta.get('finished'):
+            return meta.get('statistics')
+        runtime = meta['runtime']
     start = time.time()
-    it = 0
-    while it < swaps:
-        P = sampler.MCMC_step(A, edges, swapped)
-        if P != -2:
-            it += 1
-    end = time.time() - start
-    # SANITY CHECK        
-    # deg_seq_g = ut.compute_degree_sequence_from_A(sampler.A)
-    # jlm_g1 = ut.compute_JLM_from_A(sampler.A, sampler.node_labels)
-    # same_degs = ut.check_degree_sequences(sampler.degrees, deg_seq_g)
-    # print(f'SAME DEGREE SEQUENCE={same_degs}')
-    
-    # deg_seq_g = ut.compute_degree_sequence_from_list(edges)
-    # jlm_g2 = ut.compute_JLM_from_list(edges, sampler.node_labels)
-    # same_degs = ut.check_degree_sequences(sampler.degrees, deg_seq_g)
-    # same_jlm = ut.check_JLM(jlm_g1, jlm_g2)
-    # print(f'SAME DEGREE SEQUENCE 2={same_degs}')
-    # print(f'SAME JLM 2={same_jlm}')
+    # out of space iterations are not counted
+    run_chain(sampler, state, stream, swaps, 'valid', batch_size, audit_every,
+              checkpointer, counters, lambda: runtime + time.time() - start)
+    end = runtime + time.time() - start
     
-    fpath = f'{out_dir}/{graph_name}__sampler_{sampl_name}__swaps_{swaps}__runtime_{end}__seed_{seed}__actualswaps_False.tsv'
-    ut.dump_edge_list(fpath, edges)
+    row = None
+    if statistics is not None:
+        row = {'sample': idx, 'seed': seed, 'swaps': swaps, 'runtime': end}
+        row.update(gs.evaluate(statistics, sampler, state))
+    elif store is not None:
+        sst.write_sample(store, idx, state.src, state.dst, seed, swaps, end,
+                         ref=(sampler.state.src, sampler.state.dst), log=state.log)
+    else:
+        fpath = f'{out_dir}/{graph_name}__sampler_{sampl_name}__swaps_{swaps}__runtime_{end}__seed_{seed}__sample_{idx}__actualswaps_False.tsv'
+        ut.dump_edge_list(fpath, state.edge_list())
+    if checkpointer is not None and checkpointer.enabled():
+        checkpointer.finish(statistics=row)
+    return row
 
 
 def progress_chain(inp):
@@ -138,8 +542,54 @@ def progress_chain(inp):
     increment (int): running time will be saved every increment steps in the Markov graph.
     seed (int): for reproducibility.
     idx (int): id of the chain.
-    sampler (object): sampler to use to move in the state space.
+    sampler (object): sampler to use to move in the state space, or its SharedSampler.
     sampler_name (str): name of the sampler.
+    checkpointer (Checkpointer): checkpoints of the chain, or None.
+                                 They are saved at the first measurement
+                                 after they are due, and at the end of
+                                 the chain, so that a later run with a
+                                 larger num_swaps_needed can extend it.
+    node_mixing (bool): if True, the same-label and cross-label neighbors
+                        of each node are updated with each accepted swap
+                        (see graph_state.NodeMixing) and sampled at each
+                        measurement.
+    triangles (bool): if True, the triangles are updated with each
+                      accepted swap (see graph_state.TriangleCounter)
+                      and recorded at the beginning of the chain and at
+                      each measurement.
+    keep_traces (bool): if False, the values of the measurements are not
+                        kept (assortativities, times, and triangle_trace
+                        are empty), only their online estimators.
+    monitor (list): queue of the reports, queue of the decisions of the
+                    chain, and number of measurements per block, or None.
+                    If given, after each block the chain reports the
+                    moments of the values it measured in the block (see
+                    online_stats.RunningMoments) and waits for the
+                    decision of the parent on whether it stops before
+                    num_swaps_needed (see run_convergence.monitor_chains).
+    time_every (int): one step every time_every is timed, and the time
+                      of the accepted, rejected, and out of space steps
+                      is estimated from them (see chain_loop.StepInstruments).
+                      1 times every step. The elapsed time of the
+                      measurements and of the chain is measured.
+
+    OUTPUT
+    ======
+    assortativities (list): iteration and degree assortativity of each measurement.
+    times (list): iteration and elapsed time (ns) of each measurement,
+                  without the time waiting for the monitor.
+    probs (dict): number of accepted and rejected iterations by bin of the
+                  transition probability (see StepInstruments.probs).
+    all_stats (dict): statistics of the chain, with the estimates of
+                      the online estimators (see online_stats) of the
+                      degree assortativity (and of the triangles and the
+                      transitivity with triangles) at the measurements,
+                      including the one at the beginning of the chain.
+    mixing (dict): with node_mixing, number of measurements and sums of
+                   the same-label and cross-label neighbors of each node
+                   over them (see NodeMixing.sums), None otherwise.
+    triangle_trace (list): with triangles, iteration, number of triangles,
+                           and transitivity of each record, None otherwise.
     '''
     num_swaps_needed = inp[0]
     last_r = inp[1]
@@ -147,67 +597,174 @@ def progress_chain(inp):
     increment = inp[3]
     seed = inp[4]
     idx = inp[5]
-    sampler = inp[6]
+    sampler = ss.get_sampler(inp[6])
     sampler_name = inp[7]
+    checkpointer = inp[8]
+    node_mixing = inp[9]
+    triangles = inp[10]
+    keep_traces = inp[11]
+    monitor = inp[12]
+    time_every = inp[13]
     
-    random.seed(idx+seed)
-    counter = 0
+    stream = rs.RandomStream(rs.chain_generator(seed, idx), sampler.draw_block)
     # degree assortativity values
     assortativities = []
-    # Manhattan distance values
-    probs = dict()
-    probs['Accepted'] = defaultdict(int)
-    probs['Rejected'] = defaultdict(int)
-    step_times = defaultdict(int)
+    # histograms of the transition probabilities and sampled step times
+    instruments = cl.StepInstruments(time_every=time_every, seed=(seed, idx))
     times = []
-    actual_moves = 0
-    swaps = 0
-    swapped = [-1, -1, -1, -1]
+    # measured time (ns) of the chain before its checkpoint
+    elapsed_before = 0
+    triangle_trace = []
     
-    last_A = ut.copy_weight_dict(sampler.A)
-    last_edge_list = ut.copy_edge_list(sampler.edge_list)
-    
-    elapsed = 0
-    while swaps < num_swaps_needed:
-        step_start = time.time_ns()
-        P = sampler.MCMC_step(last_A, last_edge_list, swapped)
-        step_end = time.time_ns() - step_start
-        elapsed += step_end
-        # A swap was performed
-        if swapped[0] != -1:
-            actual_moves += 1
-            num = sampler.degrees[swapped[0]] * sampler.degrees[swapped[2]]
-            num += sampler.degrees[swapped[1]] * sampler.degrees[swapped[3]]
-            num -= sampler.degrees[swapped[0]] * sampler.degrees[swapped[1]]
-            num -= sampler.degrees[swapped[2]] * sampler.degrees[swapped[3]]
-            delta_r = 2 * num * 2 * sampler.m / denominator
-            swapped[0] = -1
-            step_times['Accepted (ns)'] += step_end
-            probs['Accepted'][str(P)] += 1
-            last_r += delta_r
-            swaps += 1
-        else:
-            if P == -2:
-               step_times['OOS (ns)'] += step_end
-            else:
-                step_times['Rejected (ns)'] += step_end
-                swaps += 1
-            probs['Rejected'][str(P)] += 1
-
-        if counter % increment == 0:
-            times.append([swaps, elapsed])
-            assortativities.append([swaps, last_r])
-        counter += 1
+    last_state = sampler.state.copy()
+
+    counters = None
+    ckpt = checkpointer.load() if checkpointer is not None else None
+    # a longer chain cannot be cut back, and older checkpoints have no instruments
+    if (ckpt is not None and ckpt['meta']['counters']['counted'] <= num_swaps_needed
+            and 'instruments' in ckpt['meta']):
+        counters = checkpointer.restore(ckpt, last_state, stream)
+        times = [list(x) for x in zip(ckpt['trace_counted'].tolist(), ckpt['trace_time'].tolist())]
+        assortativities = [list(x) for x in zip(ckpt['trace_counted'].tolist(), ckpt['trace_r'].tolist())]
+        instruments = cl.StepInstruments.from_state(ckpt['meta']['instruments'])
+        # the sampling of the timed steps can change between runs
+        instruments.time_every = time_every
+        elapsed_before = ckpt['meta'].get('elapsed', times[-1][1] if times else 0)
+        if 'triangle_counted' in ckpt:
+            triangle_trace = [list(x) for x in zip(ckpt['triangle_counted'].tolist(),
+                                                   ckpt['triangle_total'].tolist(),
+                                                   ckpt['triangle_transitivity'].tolist())]
+    counter = last_state.start_triangles() if triangles else None
+    if counter is not None and not triangle_trace and keep_traces:
+        triangle_trace.append([0 if counters is None else counters['counted'],
+                               counter.total, counter.transitivity()])
+    # streaming estimators of the autocorrelation of the traced values
+    online = {'Assortativity': ost.OnlineAutocorrelation()}
+    if counter is not None:
+        online['Triangles'] = ost.OnlineAutocorrelation()
+        online['Transitivity'] = ost.OnlineAutocorrelation()
+    if counters is None:
+        online['Assortativity'].update(last_r)
+        if counter is not None:
+            online['Triangles'].update(counter.total)
+            online['Transitivity'].update(counter.transitivity())
+    else:
+        for name, est in ckpt['meta'].get('online', dict()).items():
+            if name in online:
+                online[name] = ost.OnlineAutocorrelation.from_state(est)
+    mixing = last_state.start_mixing() if node_mixing else None
+    # the sums start from the checkpoint if it has them
+    if mixing is not None and counters is not None and 'mixing_same_sum' in ckpt:
+        mixing.load_sums({'num_samples': ckpt['meta']['mixing_samples'],
+                          'same_sum': ckpt['mixing_same_sum'],
+                          'cross_sum': ckpt['mixing_cross_sum'],
+                          'same_sq_sum': ckpt['mixing_same_sq_sum']})
+
+    def save(counters):
+        arrays = {'trace_counted': np.array([it for it, _ in times], np.int64),
+                  'trace_time': np.array([t for _, t in times], np.int64),
+                  'trace_r': np.array([r for _, r in assortativities], np.float64)}
+        meta = dict()
+        if mixing is not None:
+            arrays['mixing_same_sum'] = mixing.same_sum
+            arrays['mixing_cross_sum'] = mixing.cross_sum
+            arrays['mixing_same_sq_sum'] = mixing.same_sq_sum
+            meta['mixing_samples'] = mixing.num_samples
+        if counter is not None:
+            arrays['triangle_counted'] = np.array([it for it, _, _ in triangle_trace], np.int64)
+            arrays['triangle_total'] = np.array([t for _, t, _ in triangle_trace], np.int64)
+            arrays['triangle_transitivity'] = np.array([c for _, _, c in triangle_trace], np.float64)
+        meta['online'] = {name: est.get_state() for name, est in online.items()}
+        meta['elapsed'] = elapsed()
+        checkpointer.save(last_state, stream, counters, arrays, instruments=instruments.get_state(), **meta)
+
+    checkpoints = checkpointer is not None and checkpointer.enabled()
+
+    # moments of the values measured in the current block of the monitor
+    moments = {name: ost.RunningMoments() for name in online}
+
+    # the time waiting for the decisions of the monitor is not counted
+    clock = {'start': time.perf_counter_ns(), 'before': elapsed_before}
+
+    def elapsed():
+        return clock['before'] + time.perf_counter_ns() - clock['start']
+
+    def record(counters):
+        r = last_r + counters['delta_r']
+        values = {'Assortativity': r}
+        if counter is not None:
+            transitivity = counter.transitivity()
+            values['Triangles'] = counter.total
+            values['Transitivity'] = transitivity
+        for name, value in values.items():
+            online[name].update(value)
+            if monitor is not None:
+                moments[name].update(value)
+        if keep_traces:
+            times.append([counters['counted'], elapsed()])
+            assortativities.append([counters['counted'], r])
+            if counter is not None:
+                triangle_trace.append([counters['counted'], counter.total, transitivity])
+        if mixing is not None:
+            mixing.sample()
+        if checkpoints and checkpointer.due(counters['steps']):
+            save(counters)
+
+    if monitor is None:
+        counters = sampler.step_many(last_state, stream, num_swaps_needed, count_mode='valid',
+                                     callback=record, every=increment,
+                                     instruments=instruments, counters=counters)
+    else:
+        reports, decisions, block = monitor
+        target = 0
+        while True:
+            target = min(target + block * increment, num_swaps_needed)
+            counters = sampler.step_many(last_state, stream, target, count_mode='valid',
+                                         callback=record, every=increment,
+                                         instruments=instruments, counters=counters)
+            last = counters['counted'] >= num_swaps_needed
+            reports.put((idx, last, counters['counted'],
+                         {name: m.get_state() for name, m in moments.items()}))
+            for name in moments:
+                moments[name] = ost.RunningMoments()
+            # the chains that reach num_swaps_needed do not wait
+            if last:
+                break
+            wait_start = time.perf_counter_ns()
+            stop = decisions.get()
+            clock['before'] -= time.perf_counter_ns() - wait_start
+            if stop:
+                break
+    if checkpoints:
+        save(counters)
+    # estimated from the timed steps (see StepInstruments.times)
+    step_times = instruments.times(counters)
+    actual_moves = counters['accepted']
                     
     all_stats = dict()
-    all_stats['Time (ns)'] = elapsed
-    all_stats['Acceptance Ratio'] = actual_moves / num_swaps_needed
-    all_stats['Number of Swaps'] = num_swaps_needed
+    all_stats['Time (ns)'] = elapsed()
+    # the monitor can stop the chain before num_swaps_needed
+    all_stats['Acceptance Ratio'] = actual_moves / counters['counted']
+    all_stats['Number of Swaps'] = counters['counted']
     all_stats['Num Edges'] = sampler.m
     all_stats['Chain'] = idx
     all_stats['Total Time Accepted (ns)'] = step_times['Accepted (ns)']
     all_stats['Total Time Rejected (ns)'] = step_times['Rejected (ns)']
-    all_stats['Total Time OOS (ns)'] = step_times.get('OOS (ns)', 0)
+    all_stats['Total Time OOS (ns)'] = step_times['OOS (ns)']
+    all_stats['Num Accepted'] = counters['accepted']
+    all_stats['Num Rejected'] = counters['rejected']
+    # rejected steps whose swap would leave the multigraph unchanged
+    all_stats['Num Unchanged'] = instruments.unchanged
+    all_stats['Num OOS'] = counters['oos']
+    # 0 if the step times are not measured
+    all_stats['Timed Steps'] = sum(instruments.timed.values())
+    # draws that would be out of space are never made
+    all_stats['OOS Rate'] = sampler.oos_rate
     all_stats['Method'] = sampler_name
+    for name, est in online.items():
+        for key, value in est.summary().items():
+            all_stats[f'{name} {key}'] = value
 
-    return assortativities, times, probs, all_stats
+    return (assortativities, times, instruments.probs(), all_stats,
+            mixing.sums() if mixing is not None else None,
+            triangle_trace if counter is not None else None)
@@ -1,7 +1,10 @@
-import random
+import numpy as np
 import sys
 sys.path.insert(1,'../')
-import src.utils as ut # type: ignore
+from src.graph_state import GraphState # type: ignore
+from src.random_streams import RandomStream # type: ignore
+import src.chain_loop as cl # type: ignore
+import src.batch_swaps as bs # type: ignore
 
 
 class MCMC_LA:
@@ -13,51 +16,58 @@ class MCMC_LA:
 
         self.has_converged = False
         self.spacing = -1
-        if len(set(degrees.values())) == 1:
+        self.burn_in = -1
+        # whether the swaps preserve the JLM
+        self.preserves_jlm = True
+        self.initialize(edges, degrees, node_labels)
+        # isolated nodes do not count
+        if len(np.unique(self.degrees[self.degrees > 0])) == 1:
             raise ValueError("Regular graph! Degree assortativity undefined.")
-        self.degrees = degrees
-        self.node_labels = node_labels
-        self.initialize(edges)
     
     def MCMC_step(self,
-                  A: dict[tuple[int, int], int], 
-                  edge_list: list[tuple[int, int]],
+                  state: GraphState,
+                  stream: RandomStream,
                   swapped: list[int]) -> float:
         '''
         Performs a step in the Markov chain using MCMC-MH (Algorithm 1).
         
         INPUT
         ======
-        A (dict): The weight of each edge. Changed inplace.
-        edge_list (list): List of edges in A. Changed inplace.
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
         
         OUTPUT
         ======
         swaps (list): Four nodes swapped if a swap is accepted. Empty otherwise.
         '''
-        # Choose two edges uniformly at random
-        p1 = random.randrange(self.m)
-        p2 = random.randrange(self.m - 1)
-        if p1 == p2:
-            p2 = self.m - 1
+        # Choose two edges uniformly at random among the pairs
+        # whose swap preserves the JLM (see draw_block)
+        # and either swap orientation 50% at random
+        p1, p2, coin, acc = stream.next()
+        return self.MCMC_move(state, p1, p2, coin, acc, swapped)
 
-        u, v = edge_list[p1]
-        # Pick either swap orientation 50% at random
-        if random.uniform(0, 1) < 0.5:
-            x, y = edge_list[p2]
+    def MCMC_move(self,
+                  state: GraphState,
+                  p1: int,
+                  p2: int,
+                  coin: bool,
+                  acc: float,
+                  swapped: list[int]) -> float:
+        '''
+        Performs the step of the Markov chain defined by
+        the random draws p1, p2, coin, and acc (see draw_block).
+        The swap of p1 and p2 must preserve the JLM. Each edge slot
+        keeps the labels of its endpoints, in the same order.
+        '''
+        u = state.src_view[p1]
+        v = state.dst_view[p1]
+        if coin:
+            x = state.src_view[p2]
+            y = state.dst_view[p2]
         else:
-            y, x = edge_list[p2]
-
-        w_uv = A[u, v]
-        w_xy = A[x, y]
+            y = state.src_view[p2]
+            x = state.dst_view[p2]
         
-        w_ux = A.get((u,x), 0)
-        w_vy = A.get((v,y), 0)
-        
-        if self.node_labels[u] != self.node_labels[y] and self.node_labels[v] != self.node_labels[x]:
-            # line 6 Algorithm 1: swap would change the JLM
-            swapped[0] = -1
-            return -2
         if v == x or u == y:
             # assert sorted([sorted([u, v]), sorted([x, y])]) == sorted([sorted([u, x]), sorted([v, y])])
             # line 7 Algorithm 1: swap would leave the multigraph unchanged
@@ -65,6 +75,11 @@ class MCMC_LA:
             return -1
         # if we are here, it means that the swap is valid
         # and it leads to a different multigraph
+        A = state.table
+        w_uv = A.get(u, v)
+        w_xy = A.get(x, y)
+        w_ux = A.get(u, x)
+        w_vy = A.get(v, y)
         num_loops = 0
         if u == v:
             num_loops += 1
@@ -88,58 +103,196 @@ class MCMC_LA:
             p = (w_ux + 1) * (w_vy + 1) / (w_uv * w_xy)
 
         P = min(p, 1.0)
-        # If we proceed with the swap we update A, swaps and edge_list
-        if random.uniform(0, 1) < P:
+        # If we proceed with the swap we update the state and swaps
+        if acc < P:
             swapped[0] = u
             swapped[1] = v
             swapped[2] = x
             swapped[3] = y
-            
-            # if (u == v and A[u, v] == 2) or (u !) 
-            
-            A[u, v] -= 1
-            A[v, u] -= 1
-            if A[u, v] == 0:
-                del A[u, v]
-                if u != v:
-                    del A[v, u]
-            A[x, y] -= 1
-            A[y, x] -= 1   
-            if A[x, y] == 0:
-                del A[x, y]
-                if x != y:
-                    del A[y, x]
-            A[u, x] = A.get((u,x), 0) + 1
-            A[x, u] = A.get((x,u), 0) + 1
-            A[v, y] = A.get((v,y), 0) + 1
-            A[y, v] = A.get((y,v), 0) + 1
-
-            edge_list[p1] = u, x
-            edge_list[p2] = v, y
+            labels = state.label_view
+            if labels[v] == labels[x]:
+                # p1 becomes (u, x) and p2 becomes (v, y)
+                state.apply_swap(p1, p2, u, v, x, y, not coin)
+            else:
+                # p1 becomes (y, v) and p2 becomes (x, u)
+                state.apply_swap(p1, p2, y, x, v, u, not coin)
             return P
         swapped[0] = -1    
         return P
+
+    def MCMC_batch(self,
+                   state: GraphState,
+                   stream: RandomStream,
+                   size: int):
+        '''
+        Performs size steps in the Markov chain at once.
+        The outcome is the same as calling MCMC_step size times.
+        
+        INPUT
+        ======
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
+        size (int): number of steps.
+        
+        OUTPUT
+        ======
+        P (np.ndarray): value returned by MCMC_step at each step.
+        swaps (np.ndarray): array of shape (size, 4) with the four nodes
+                            swapped at each step, -1 if no swap was accepted.
+        '''
+        p1, p2, coin, acc = stream.take(size)
+        u, v, x, y = bs.orient_edges(state, p1, p2, coin)
+        inert = (v == x) | (u == y)
+        inert, conflict = bs.split_batch(self.n, p1, p2, u, v, x, y, inert)
+        P = np.zeros(size)
+        swaps = np.full((size, 4), -1, np.int64)
+        P[inert] = -1
+        free = np.flatnonzero(~(inert | conflict))
+        u, v, x, y = u[free], v[free], x[free], y[free]
+        # same edge slots as MCMC_move
+        keep = state.labels[v] == state.labels[x]
+        a1 = np.where(keep, u, y)
+        b1 = np.where(keep, x, v)
+        a2 = np.where(keep, v, x)
+        b2 = np.where(keep, y, u)
+        flip = ~coin[free]
+        stored = (a1, b1, np.where(flip, b2, a2), np.where(flip, a2, b2))
+        P[free], accept = bs.perform_swaps(state, p1[free], p2[free], u, v, x, y,
+                                           acc[free], stored)
+        swaps[free[accept]] = np.stack([u[accept], v[accept], x[accept], y[accept]], 1)
+        # conflicting steps are performed in order
+        swapped = [-1, -1, -1, -1]
+        conflict = np.flatnonzero(conflict)
+        moves = zip(conflict.tolist(), p1[conflict].tolist(), p2[conflict].tolist(),
+                    coin[conflict].tolist(), acc[conflict].tolist())
+        for i, e1, e2, c, a in moves:
+            P[i] = self.MCMC_move(state, e1, e2, c, a, swapped)
+            if swapped[0] != -1:
+                swaps[i] = swapped
+                swapped[0] = -1
+        return P, swaps
+
+    def step_many(self,
+                  state: GraphState,
+                  stream: RandomStream,
+                  n: int,
+                  count_mode: str='all',
+                  callback=None,
+                  every: int=0,
+                  batch_size: int=0,
+                  instruments: cl.StepInstruments=None,
+                  audit_every: int=-1,
+                  counters: dict=None) -> dict:
+        '''
+        Performs iterations of the Markov chain until n of them
+        are counted, and returns the counters (see chain_loop.step_many).
+        '''
+        return cl.step_many(self, state, stream, n, count_mode, callback,
+                            every, batch_size, instruments, audit_every,
+                            counters)
+
+    def draw_block(self,
+                   rng: np.random.Generator,
+                   size: int):
+        '''
+        Random draws of size steps: ids of the two edges, orientation
+        of the second edge, and uniform value for the acceptance test.
+        The draws are uniform among the ones whose swap preserves the JLM,
+        i.e., the draws of Algorithm 1 conditioned on not being out of space.
+        '''
+        L = len(self.pair_counts)
+        draws = []
+        left = size
+        while left > 0:
+            # label pair (a, b) of the first edge, as stored
+            c = np.searchsorted(self.pair_cdf, rng.random(left) * self.pair_cdf[-1], side='right')
+            a, b = np.divmod(c, L)
+            p1 = self.oriented[self.offsets[c] + rng.integers(0, self.pair_counts.ravel()[c])] // 2
+            # second edge, oriented as (x, y) with label y = a or label x = b
+            t = rng.integers(0, self.compatible.ravel()[c])
+            ends = t < self.label_counts[a]
+            pos = np.where(ends, self.offsets[a * L] + t,
+                           self.offsets[b * L] + t - self.label_counts[a])
+            # skip the oriented edges with label y = a, already counted
+            skip = ~ends & (pos >= self.offsets[b * L + a])
+            pos[skip] += self.oriented_counts[b[skip], a[skip]]
+            o2 = self.oriented[pos] ^ ends
+            p2 = o2 // 2
+            coin = o2 % 2 == 0
+            # the two edges must be distinct
+            ok = p1 != p2
+            draws.append((p1[ok], p2[ok], coin[ok]))
+            left -= np.count_nonzero(ok)
+        p1, p2, coin = [np.concatenate(col) for col in zip(*draws)]
+        acc = rng.random(size)
+        return p1, p2, coin, acc
+
+    def build_pair_index(self):
+        '''
+        Index of the edges by the labels of their endpoints.
+        An edge (s, d) is seen in two orientations: 2 * eid is (s, d)
+        and 2 * eid + 1 is (d, s). oriented lists the oriented edges
+        sorted by the labels of their endpoints, with the stored
+        orientation first; offsets[a * L + b] is the position of the
+        first oriented edge with labels (a, b).
+        MCMC_move preserves the labels of each edge slot, so the index
+        does not change during the chain.
+        '''
+        _, lab = np.unique(self.node_labels, return_inverse=True)
+        L = int(lab.max()) + 1
+        m = self.m
+        ids = np.arange(2 * m)
+        src_lab = lab[self.state.src[ids // 2]]
+        dst_lab = lab[self.state.dst[ids // 2]]
+        first = np.where(ids % 2 == 0, src_lab, dst_lab)
+        second = np.where(ids % 2 == 0, dst_lab, src_lab)
+        pair = first * L + second
+        self.oriented = np.lexsort((ids % 2, pair))
+        counts = np.bincount(pair, minlength=L * L)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        # number of oriented edges with labels (a, b); symmetric
+        self.oriented_counts = counts.reshape(L, L)
+        # number of edges stored with labels (a, b)
+        self.pair_counts = np.bincount(pair[::2], minlength=L * L).reshape(L, L)
+        # number of oriented edges with second label a
+        self.label_counts = self.oriented_counts.sum(axis=0)
+        # oriented edges (x, y) compatible with an edge (u, v) with labels
+        # (a, b): label y = a or label x = b
+        self.compatible = (self.label_counts[:, None] + self.label_counts[None, :]
+                           - self.oriented_counts.T)
+        weights = (self.pair_counts * self.compatible).ravel().astype(np.float64)
+        self.pair_cdf = np.cumsum(weights)
+        # an edge is compatible with itself in the opposite orientation,
+        # and in the same orientation if its endpoints have the same label
+        same = self.compatible - 1 - np.eye(L, dtype=np.int64)
+        valid = int((self.pair_counts * same).sum())
+        if valid == 0:
+            raise ValueError("No swap preserves the JLM.")
+        # fraction of the draws of Algorithm 1 that are out of space
+        self.oos_rate = 1 - valid / (2 * m * (m - 1))
     
     def initialize(self, 
-                   edges: list[tuple[int,int]]):
+                   edges: list[tuple[int,int]],
+                   degrees: dict[int,int],
+                   node_labels: dict[int,int]):
         '''
-        edges (list): list of edges.
-        degrees (dict): for each node, its degree.
+        edges (list or np.ndarray): list of edges, or array of shape (m, 2).
+        degrees (dict or np.ndarray): for each node, its degree.
+        node_labels (dict or np.ndarray): for each node, its label.
         '''
-        n = len(self.degrees)
-        
-        self.A = dict()
-        ut.convert_edgelist_to_dictionary(edges, self.A)
-        
-        self.edge_list = [(u, v) for u, v in edges]
-        self.m = len(edges)
+        self.state = GraphState.from_edges(edges, node_labels, degrees)
+        self.degrees = self.state.degrees
+        self.node_labels = self.state.labels
+        self.n = self.state.n
+        self.m = self.state.m
 
         S1 = 2 * self.m
         S2 = 0
         S3 = 0
-        for i in range(n):
-            S2 += (self.degrees[i])**2
-            S3 += (self.degrees[i])**3
+        for d in self.degrees.tolist():
+            S2 += d**2
+            S3 += d**3
 
         self.r_denominator = S1 * S3 - (S2**2)
         self.S2 = S2
+        self.build_pair_index()
@@ -1,31 +1,35 @@
-from collections import defaultdict
-import random
+import numpy as np
 import sys
 sys.path.insert(1,'../')
-import src.utils as ut # type: ignore
+from src.graph_state import GraphState # type: ignore
+from src.random_streams import RandomStream # type: ignore
+import src.chain_loop as cl # type: ignore
 
 
-def get_compatible_edges_per_label(edges, node_labels: dict[int, int]):
+def get_compatible_edges_per_label(src_labels: np.ndarray, dst_labels: np.ndarray):
     '''
-    For each combination of node labels, the 
-    list of compatible edges.
+    For each node label, the ids of the compatible edges, i.e., 
+    the edges with at least one endpoint with that label.
+    
+    INPUT
+    ======
+    src_labels, dst_labels (np.ndarray): labels of the endpoints of each edge.
     
     OUTPUT
     ======
-    lab_match_dict (dict): for each label, the list of ids of the 
-                           compatible edges.
-    lab_match_m (dict): for each label, the number of compatible edges. 
+    lab_match_offsets (np.ndarray): the edges compatible with label l are
+                                    lab_match_eids[lab_match_offsets[l]:lab_match_offsets[l+1]].
+    lab_match_eids (np.ndarray): ids of the compatible edges, grouped by label
+                                 and sorted by id.
     '''
-    lab_match_eids = defaultdict(list)
-    lab_match_m = dict()
-    for i, e in enumerate(edges):
-        u, v = e[0], e[1]
-        lab_match_eids[node_labels[u]].append(i)
-        if node_labels[v] != node_labels[u]:
-            lab_match_eids[node_labels[v]].append(i)
-    for k in lab_match_eids:
-        lab_match_m[k] = len(lab_match_eids[k])
-    return lab_match_eids, lab_match_m
+    eids = np.arange(len(src_labels))
+    other = dst_labels != src_labels
+    labs = np.concatenate([src_labels, dst_labels[other]])
+    eids = np.concatenate([eids, eids[other]])
+    order = np.lexsort((eids, labs))
+    counts = np.bincount(labs)
+    lab_match_offsets = np.concatenate([[0], np.cumsum(counts)])
+    return lab_match_offsets, eids[order]
 
 
 class MCMC_LW:
@@ -37,45 +41,45 @@ class MCMC_LW:
 
         self.has_converged = False
         self.spacing = -1
-        if len(set(degrees.values())) == 1:
+        self.burn_in = -1
+        # whether the swaps preserve the JLM
+        self.preserves_jlm = True
+        # fraction of the draws out of space (see MCMC_LA)
+        self.oos_rate = 0.
+        self.initialize(edges, degrees, node_labels)
+        # isolated nodes do not count
+        if len(np.unique(self.degrees[self.degrees > 0])) == 1:
             raise ValueError("Regular graph! Degree assortativity undefined.")
-        self.degrees = degrees
-        self.node_labels = node_labels
-        self.initialize(edges)
 
     # @profile
     def MCMC_step(self,
-                  A: dict[tuple[int, int], int], 
-                  edge_list: list[tuple[int, int]],
+                  state: GraphState,
+                  stream: RandomStream,
                   swapped: list[int]) -> float:
         '''
         Performs a LSO.
         
         INPUT
         ======
-        A (dict): The weight of each edge. Changed inplace.
-        edge_list (list): List of edges in A. Changed inplace.
-        labels (list): list of node labels.
-        lab_match_eids (dict): for each node label, list of matching edge ids.
-        lab_match_m (dict): for each label, number of matching edges.
-        node_labels (dict): For each node, its label.
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
         
         OUTPUT
         ======
         swaps (list): Four nodes swapped if a swap is accepted. Empty otherwise.
         '''
-        # flip fair coin
-        l = random.choice(self.labels)
-        m = self.lab_match_m[l]
-        # sample two edges
-        p1 = random.randrange(m)
-        p2 = random.randrange(m - 1)
-        if p1 == p2:
-            p2 = m - 1
-        eid1 = self.lab_match_eids[l][p1]
-        eid2 = self.lab_match_eids[l][p2]
-        u, w = edge_list[eid1]
-        v, z = edge_list[eid2]
+        # pick a label and sample two edges compatible with it
+        l, m, eid1, eid2, coin, acc = stream.next()
+        u = state.src_view[eid1]
+        w = state.dst_view[eid1]
+        v = state.src_view[eid2]
+        z = state.dst_view[eid2]
+        A = state.table
+        labels = state.label_view
+        lu = labels[u]
+        lw = labels[w]
+        lv = labels[v]
+        lz = labels[z]
         # print(f'Label {l}, p1={p1}, p2={p2}, u,w={u,w}, v,z={v,z}')
         # num loops and uniques 
         self_loops = 0
@@ -107,16 +111,16 @@ class MCMC_LW:
                 swapped[1] = u
                 swapped[2] = v
                 swapped[3] = v
-                xi = (A.get((u, v), 0) + 2) * (A.get((u, v), 0) + 1) / (A[u, u] * A[v, v])
+                xi = (A.get(u, v) + 2) * (A.get(u, v) + 1) / (A.get(u, u) * A.get(v, v))
             # Case 2B
-            elif self_loops == 0 and self.node_labels[u] == self.node_labels[w]:
+            elif self_loops == 0 and lu == lw:
                 # print(f'edges are the same multiedge {u,w}={v,z}')
                 # u and w must have the same label
                 swapped[0] = u
                 swapped[1] = w
                 swapped[2] = u
                 swapped[3] = w
-                xi = (A.get((u, u), 0) + 1) * (A.get((w, w), 0) + 1) / (A[u, w] * (A[u, w] - 1))
+                xi = (A.get(u, u) + 1) * (A.get(w, w) + 1) / (A.get(u, w) * (A.get(u, w) - 1))
             # Cases 2C and 2D     
             else:
                 swapped[0] = -1
@@ -127,7 +131,7 @@ class MCMC_LW:
                 if u == w:
                     # print(f'self loop {u,w} and separate edge {v,z}')
                     # we need this to ensure label consistency
-                    if self.node_labels[v] == self.node_labels[z] or self.node_labels[u] == self.node_labels[v]:
+                    if lv == lz or lu == lv:
                         swapped[0] = u
                         swapped[1] = u
                         swapped[2] = v
@@ -137,11 +141,11 @@ class MCMC_LW:
                         swapped[1] = u
                         swapped[2] = z
                         swapped[3] = v
-                    xi = (A.get((u, v), 0) + 1) * (A.get((u, z), 0) + 1) / (A[u, u] * A[v, z])
+                    xi = (A.get(u, v) + 1) * (A.get(u, z) + 1) / (A.get(u, u) * A.get(v, z))
                 else:
                     # print(f'self loop {v,z} and separate edge {u,w}')
                     # we need this to ensure label consistency
-                    if self.node_labels[u] == self.node_labels[w] or self.node_labels[v] == self.node_labels[w]:
+                    if lu == lw or lv == lw:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = v
@@ -151,80 +155,77 @@ class MCMC_LW:
                         swapped[1] = u
                         swapped[2] = v
                         swapped[3] = v
-                    xi = (A.get((u, v), 0) + 1) * (A.get((v, w), 0) + 1) / (A[u, w] * A[v, v])
+                    xi = (A.get(u, v) + 1) * (A.get(v, w) + 1) / (A.get(u, w) * A.get(v, v))
             else: # line 19
-                nl = len(set([self.node_labels[u], 
-                              self.node_labels[w],
-                              self.node_labels[v],
-                              self.node_labels[z]]))
+                nl = len({lu, lw, lv, lz})
                 if u == v:
                     # print(f'wedge centered on {u}={v}')
-                    if nl == 1 or self.node_labels[u] == self.node_labels[w]:
+                    if nl == 1 or lu == lw:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = u
                         swapped[3] = z
-                        xi = (A.get((u, u), 0) + 1) * (A.get((w, z), 0) + 1) / (A[u, w] * A[u, z])
-                    elif self.node_labels[v] == self.node_labels[z]:
+                        xi = (A.get(u, u) + 1) * (A.get(w, z) + 1) / (A.get(u, w) * A.get(u, z))
+                    elif lv == lz:
                         swapped[0] = w
                         swapped[1] = u
                         swapped[2] = z
                         swapped[3] = u
-                        xi = (A.get((u, u), 0) + 1) * (A.get((w, z), 0) + 1) / (A[u, w] * A[u, z])
+                        xi = (A.get(u, u) + 1) * (A.get(w, z) + 1) / (A.get(u, w) * A.get(u, z))
                     # Case 3D
                     else:
                         swapped[0] = -1
                         return -1
                 elif u == z:
                     # print(f'wedge centered on {u}={z}')
-                    if nl == 1 or self.node_labels[u] == self.node_labels[w]:
+                    if nl == 1 or lu == lw:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = u
                         swapped[3] = v
-                        xi = (A.get((u, u), 0) + 1) * (A.get((w, v), 0) + 1) / (A[u, w] * A[u, v])
-                    elif self.node_labels[v] == self.node_labels[z]:
+                        xi = (A.get(u, u) + 1) * (A.get(w, v) + 1) / (A.get(u, w) * A.get(u, v))
+                    elif lv == lz:
                         swapped[0] = w
                         swapped[1] = u
                         swapped[2] = v
                         swapped[3] = u
-                        xi = (A.get((u, u), 0) + 1) * (A.get((w, v), 0) + 1) / (A[u, w] * A[u, v])
+                        xi = (A.get(u, u) + 1) * (A.get(w, v) + 1) / (A.get(u, w) * A.get(u, v))
                     # Case 3D
                     else:
                         swapped[0] = -1
                         return -1
                 elif w == v:
                     # print(f'wedge centered on {w}={v}')
-                    if nl == 1 or self.node_labels[v] == self.node_labels[z]:
+                    if nl == 1 or lv == lz:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = z
                         swapped[3] = w
-                        xi = (A.get((w, w), 0) + 1) * (A.get((u, z), 0) + 1) / (A[u, w] * A[w, z])
-                    elif self.node_labels[u] == self.node_labels[w]:
+                        xi = (A.get(w, w) + 1) * (A.get(u, z) + 1) / (A.get(u, w) * A.get(w, z))
+                    elif lu == lw:
                         swapped[0] = w 
                         swapped[1] = u
                         swapped[2] = w
                         swapped[3] = z
-                        xi = (A.get((w, w), 0) + 1) * (A.get((u, z), 0) + 1) / (A[u, w] * A[w, z])
+                        xi = (A.get(w, w) + 1) * (A.get(u, z) + 1) / (A.get(u, w) * A.get(w, z))
                     # Case 3D
                     else:
                         swapped[0] = -1
                         return -1
                 elif w == z:
                     # print(f'wedge centered on {w}={z}')
-                    if nl == 1 or self.node_labels[v] == self.node_labels[z]:
+                    if nl == 1 or lv == lz:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = v
                         swapped[3] = w
-                        xi = (A.get((w, w), 0) + 1) * (A.get((u, v), 0) + 1) / (A[u, w] * A[w, v])
-                    elif self.node_labels[u] == self.node_labels[w]:
+                        xi = (A.get(w, w) + 1) * (A.get(u, v) + 1) / (A.get(u, w) * A.get(w, v))
+                    elif lu == lw:
                         swapped[0] = w
                         swapped[1] = u
                         swapped[2] = w
                         swapped[3] = v
-                        xi = (A.get((w, w), 0) + 1) * (A.get((u, v), 0) + 1) / (A[u, w] * A[w, v])
+                        xi = (A.get(w, w) + 1) * (A.get(u, v) + 1) / (A.get(u, w) * A.get(w, v))
                     # Case 3D
                     else:
                         swapped[0] = -1
@@ -234,69 +235,66 @@ class MCMC_LW:
                     swapped[0] = -1
                     return -1
         else:
-            nl = len(set([self.node_labels[u], 
-                          self.node_labels[w],
-                          self.node_labels[v],
-                          self.node_labels[z]]))
-            cond = self.node_labels[u] != self.node_labels[w] and self.node_labels[v] != self.node_labels[z]
+            nl = len({lu, lw, lv, lz})
+            cond = lu != lw and lv != lz
             # Case 4A
             if nl == 3 and cond:
-                if self.node_labels[u] == self.node_labels[v]:
+                if lu == lv:
                     swapped[0] = w
                     swapped[1] = u
                     swapped[2] = v
                     swapped[3] = z
-                    xi = (A.get((u, z), 0) + 1) * (A.get((v, w), 0) + 1) / (A[u, w] * A[z, v])
-                elif self.node_labels[w] == self.node_labels[z]:
+                    xi = (A.get(u, z) + 1) * (A.get(v, w) + 1) / (A.get(u, w) * A.get(z, v))
+                elif lw == lz:
                     swapped[0] = u
                     swapped[1] = w
                     swapped[2] = z
                     swapped[3] = v
-                    xi = (A.get((u, z), 0) + 1) * (A.get((v, w), 0) + 1) / (A[u, w] * A[z, v])
-                elif self.node_labels[u] == self.node_labels[z]:
+                    xi = (A.get(u, z) + 1) * (A.get(v, w) + 1) / (A.get(u, w) * A.get(z, v))
+                elif lu == lz:
                     swapped[0] = w
                     swapped[1] = u
                     swapped[2] = z
                     swapped[3] = v
-                    xi = (A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (A[u, w] * A[z, v])
+                    xi = (A.get(u, v) + 1) * (A.get(z, w) + 1) / (A.get(u, w) * A.get(z, v))
                 else:
                     swapped[0] = u
                     swapped[1] = w
                     swapped[2] = v
                     swapped[3] = z
-                    xi = (A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (A[u, w] * A[z, v])
+                    xi = (A.get(u, v) + 1) * (A.get(z, w) + 1) / (A.get(u, w) * A.get(z, v))
             # Case 4B
             elif nl == 2 and cond:
-                l2 = self.node_labels[u]
+                l2 = lu
                 if l2 == l:
-                    l2 = self.node_labels[w]
-                m2 = self.lab_match_m[l2]
-                xi_d_1 = (A[u, w] * A[v, z]) / (m * (m - 1))  
-                xi_d_2 = (A[u, w] * A[v, z]) / (m2 * (m2 - 1))
+                    l2 = lw
+                m2 = int(self.lab_match_m[l2])
+                xi_d_1 = (A.get(u, w) * A.get(v, z)) / (m * (m - 1))  
+                xi_d_2 = (A.get(u, w) * A.get(v, z)) / (m2 * (m2 - 1))
                 xi_d = xi_d_1 + xi_d_2
-                if self.node_labels[u] == self.node_labels[v]:
+                if lu == lv:
                     swapped[0] = u
                     swapped[1] = w
                     swapped[2] = z
                     swapped[3] = v
-                    xi_n_1 = ((A.get((u, z), 0) + 1) * (A.get((v, w), 0) + 1) / (m * (m - 1)))
-                    xi_n_2 = ((A.get((u, z), 0) + 1) * (A.get((v, w), 0) + 1) / (m2 * (m2 - 1)))
+                    xi_n_1 = ((A.get(u, z) + 1) * (A.get(v, w) + 1) / (m * (m - 1)))
+                    xi_n_2 = ((A.get(u, z) + 1) * (A.get(v, w) + 1) / (m2 * (m2 - 1)))
                     xi_n = xi_n_1 + xi_n_2
                     xi = xi_n / xi_d
                 else:
-                    # node_labels[u] == node_labels[z]
+                    # lu == lz
                     swapped[0] = u
                     swapped[1] = w
                     swapped[2] = v
                     swapped[3] = z
-                    xi_n_1 = ((A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (m * (m - 1)))
-                    xi_n_2 = ((A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (m2 * (m2 - 1)))
+                    xi_n_1 = ((A.get(u, v) + 1) * (A.get(z, w) + 1) / (m * (m - 1)))
+                    xi_n_2 = ((A.get(u, v) + 1) * (A.get(z, w) + 1) / (m2 * (m2 - 1)))
                     xi_n = xi_n_1 + xi_n_2
                     xi = xi_n / xi_d
             # Case 4C
             else:
-                if random.uniform(0, 1) < .5:
-                    if self.node_labels[w] == self.node_labels[z]:
+                if coin:
+                    if lw == lz:
                         swapped[0] = u
                         swapped[1] = w
                         swapped[2] = z
@@ -306,69 +304,123 @@ class MCMC_LW:
                         swapped[1] = u
                         swapped[2] = v
                         swapped[3] = z
-                    xi = (A.get((u, z), 0) + 1) * (A.get((v, w), 0) + 1) / (A[u, w] * A[z, v])
-                elif self.node_labels[w] == self.node_labels[v]:
+                    xi = (A.get(u, z) + 1) * (A.get(v, w) + 1) / (A.get(u, w) * A.get(z, v))
+                elif lw == lv:
                     swapped[0] = u
                     swapped[1] = w
                     swapped[2] = v
                     swapped[3] = z
-                    xi = (A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (A[u, w] * A[z, v])
+                    xi = (A.get(u, v) + 1) * (A.get(z, w) + 1) / (A.get(u, w) * A.get(z, v))
                 else:
                     swapped[0] = w
                     swapped[1] = u
                     swapped[2] = z
                     swapped[3] = v
-                    xi = (A.get((u, v), 0) + 1) * (A.get((z, w), 0) + 1) / (A[u, w] * A[z, v])
+                    xi = (A.get(u, v) + 1) * (A.get(z, w) + 1) / (A.get(u, w) * A.get(z, v))
         P = min(xi, 1.0)
-        # If we proceed with the swap we update A, swaps and edge_list
-        if random.uniform(0, 1) < P:
-            A[swapped[0], swapped[1]] -= 1
-            A[swapped[1], swapped[0]] -= 1
-            if A[swapped[0], swapped[1]] == 0:
-                del A[swapped[0], swapped[1]]
-                if swapped[0] != swapped[1]:
-                    del A[swapped[1], swapped[0]]
-            A[swapped[2], swapped[3]] -= 1
-            A[swapped[3], swapped[2]] -= 1   
-            if A[swapped[2], swapped[3]] == 0:
-                del A[swapped[2], swapped[3]]
-                if swapped[2] != swapped[3]:
-                    del A[swapped[3], swapped[2]]
-            A[swapped[0], swapped[2]] = A.get((swapped[0], swapped[2]), 0) + 1
-            A[swapped[2], swapped[0]] = A.get((swapped[2], swapped[0]), 0) + 1
-            A[swapped[1], swapped[3]] = A.get((swapped[1], swapped[3]), 0) + 1
-            A[swapped[3], swapped[1]] = A.get((swapped[3], swapped[1]), 0) + 1
-
-            edge_list[eid1] = swapped[0], swapped[2]
-            edge_list[eid2] = swapped[1], swapped[3]
+        # If we proceed with the swap we update the state
+        if acc < P:
+            state.apply_swap(eid1, eid2, swapped[0], swapped[1], swapped[2], swapped[3])
             
             return P
         swapped[0] = -1
         return P
 
+    def MCMC_batch(self,
+                   state: GraphState,
+                   stream: RandomStream,
+                   size: int):
+        '''
+        Performs size steps in the Markov chain, one by one.
+        Same interface as MCMC_batch in MCMC_LA.
+        
+        INPUT
+        ======
+        state (GraphState): current multigraph. Changed inplace.
+        stream (RandomStream): random draws of the chain.
+        size (int): number of steps.
+        
+        OUTPUT
+        ======
+        P (np.ndarray): value returned by MCMC_step at each step.
+        swaps (np.ndarray): array of shape (size, 4) with the four nodes
+                            swapped at each step, -1 if no swap was accepted.
+        '''
+        P = np.zeros(size)
+        swaps = np.full((size, 4), -1, np.int64)
+        swapped = [-1, -1, -1, -1]
+        for i in range(size):
+            P[i] = self.MCMC_step(state, stream, swapped)
+            if swapped[0] != -1:
+                swaps[i] = swapped
+                swapped[0] = -1
+        return P, swaps
+
+    def step_many(self,
+                  state: GraphState,
+                  stream: RandomStream,
+                  n: int,
+                  count_mode: str='all',
+                  callback=None,
+                  every: int=0,
+                  batch_size: int=0,
+                  instruments: cl.StepInstruments=None,
+                  audit_every: int=-1,
+                  counters: dict=None) -> dict:
+        '''
+        Performs iterations of the Markov chain until n of them
+        are counted, and returns the counters (see chain_loop.step_many).
+        '''
+        return cl.step_many(self, state, stream, n, count_mode, callback,
+                            every, batch_size, instruments, audit_every,
+                            counters)
+
+    def draw_block(self,
+                   rng: np.random.Generator,
+                   size: int):
+        '''
+        Random draws of size steps: label, number of edges compatible with
+        the label, ids of two distinct edges compatible with the label,
+        coin for Case 4C, and uniform value for the acceptance test.
+        '''
+        l = self.labels[rng.integers(len(self.labels), size=size)]
+        m = self.lab_match_m[l]
+        p1 = rng.integers(0, m)
+        p2 = rng.integers(0, m - 1)
+        same = p2 == p1
+        p2[same] = m[same] - 1
+        start = self.lab_match_offsets[l]
+        eid1 = self.lab_match_eids[start + p1]
+        eid2 = self.lab_match_eids[start + p2]
+        coin = rng.random(size) < .5
+        acc = rng.random(size)
+        return l, m, eid1, eid2, coin, acc
+
     def initialize(self, 
-                   edges: list[tuple[int,int]]):
+                   edges: list[tuple[int,int]],
+                   degrees: dict[int,int],
+                   node_labels: dict[int,int]):
         '''
-        edges (list): list of edges.
-        degrees (dict): for each node, its degree.
-        node_labels (dict): for each node, its label.
+        edges (list or np.ndarray): list of edges, or array of shape (m, 2).
+        degrees (dict or np.ndarray): for each node, its degree.
+        node_labels (dict or np.ndarray): for each node, its label.
         '''
-        self.n = len(self.degrees)
-        self.m = len(edges)
-        self.A = dict()
-        ut.convert_edgelist_to_dictionary(edges, self.A)
-        self.edge_list = [(u, v) for u, v in edges]
-        self.lab_match_eids, self.lab_match_m = get_compatible_edges_per_label(self.edge_list, self.node_labels)
-        self.labels = []
-        for l in self.lab_match_m:
-            if self.lab_match_m[l] > 1:
-                self.labels.append(l)
+        self.state = GraphState.from_edges(edges, node_labels, degrees)
+        self.degrees = self.state.degrees
+        self.node_labels = self.state.labels
+        self.n = self.state.n
+        self.m = self.state.m
+        self.lab_match_offsets, self.lab_match_eids = get_compatible_edges_per_label(
+            self.node_labels[self.state.src], self.node_labels[self.state.dst])
+        self.lab_match_m = np.diff(self.lab_match_offsets)
+        # labels with at least two compatible edges
+        self.labels = np.flatnonzero(self.lab_match_m > 1)
 
         S1 = 2 * self.m
         S2 = 0
         S3 = 0
-        for i in range(self.n):
-            S2 += (self.degrees[i])**2
-            S3 += (self.degrees[i])**3
+        for d in self.degrees.tolist():
+            S2 += d**2
+            S3 += d**3
         self.r_denominator = S1 * S3 - (S2**2)
         self.S2 = S2
@@ -1,3 +1,4 @@
+import numpy as np
 from networkx.utils import dict_to_numpy_array
 
 
@@ -247,7 +248,14 @@ def attribute_ac(M):
     Parameters
     ----------
     M : numpy.ndarray
-        2D ndarray representing the attribute mixing matrix.
+        2D ndarray representing the attribute mixing matrix, or ndarray
+        of shape (S, L, L) with the mixing matrices of S samples.
+
+    Returns
+    -------
+    r: float or numpy.ndarray
+       Assortativity for M, or array of shape (S,) with the
+       assortativity for each mixing matrix.
 
     Notes
     -----
@@ -260,9 +268,130 @@ def attribute_ac(M):
     .. [1] M. E. J. Newman, Mixing patterns in networks,
        Physical Review E, 67 026126, 2003
     """
-    if M.sum() != 1.0:
-        M = M / M.sum()
-    s = (M @ M).sum()
-    t = M.trace()
+    M = np.asarray(M, dtype=np.float64)
+    total = M.sum(axis=(-2, -1), keepdims=True)
+    M = M / np.where(total != 1.0, total, 1.0)
+    s = (M @ M).sum(axis=(-2, -1))
+    t = np.trace(M, axis1=-2, axis2=-1)
     r = (t - s) / (1 - s)
-    return float(r)
+    if r.ndim == 0:
+        return float(r)
+    return r
+
+
+def label_index(labels):
+    """Returns the index of the label of each node among the distinct labels.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+       Label of each node.
+
+    Returns
+    -------
+    (lab, num_labels): 2-tuple
+       Index of the label of each node, in increasing order of label,
+       and number of distinct labels.
+    """
+    _, lab = np.unique(labels, return_inverse=True)
+    return lab.astype(np.int64), int(lab.max()) + 1 if len(lab) else 0
+
+
+def joint_label_matrix(src, dst, lab, num_labels, weights=None):
+    """Returns the joint label matrix (JLM) of a multigraph given as an edge array.
+
+    Entry (a, b) counts the edges between a node with label a and a node
+    with label b: an edge between different labels is counted in (a, b)
+    and (b, a), an edge between equal labels (including a self-loop)
+    once in (a, a). The pairs of labels are packed in one integer and
+    counted with a single bincount.
+
+    Parameters
+    ----------
+    src, dst : numpy.ndarray
+       Endpoints of the edges, of shape (m,), or (S, m) for a stack of
+       S samples with m edges each.
+
+    lab : numpy.ndarray
+       Label of each node, as an integer in [0, num_labels).
+
+    num_labels : int
+       Number of labels.
+
+    weights : numpy.ndarray (optional)
+       Multiplicity of each edge, with the shape of src. Default 1.
+
+    Returns
+    -------
+    jlm: numpy array
+       Array of shape (num_labels, num_labels), or (S, num_labels, num_labels).
+    """
+    lab = np.asarray(lab, dtype=np.int64)
+    a = lab[np.asarray(src)]
+    b = lab[np.asarray(dst)]
+    L = num_labels
+    batch = a.shape[:-1]
+    num_samples = int(np.prod(batch, dtype=np.int64))
+    # one block of L * L counts per sample
+    offset = (np.arange(num_samples, dtype=np.int64) * (L * L)).reshape(batch + (1,))
+    cross = (a != b).ravel()
+    keys = np.concatenate([(offset + a * L + b).ravel(),
+                           (offset + b * L + a).ravel()[cross]])
+    if weights is not None:
+        weights = np.broadcast_to(weights, a.shape).ravel()
+        weights = np.concatenate([weights, weights[cross]])
+    jlm = np.bincount(keys, weights=weights, minlength=num_samples * L * L)
+    if weights is not None and np.issubdtype(weights.dtype, np.integer):
+        jlm = np.rint(jlm).astype(np.int64)
+    return jlm.reshape(batch + (L, L))
+
+
+def mixing_matrix_from_edges(src, dst, lab, num_labels, normalized=True):
+    """Returns the mixing matrix of a multigraph given as an edge array.
+
+    Same matrix as attribute_mixing_matrix, with the edges produced by
+    the modified node_attribute_xy: each edge in both directions, and a
+    self-loop twice. It is the JLM with a doubled diagonal. Labels
+    without edges have empty rows, which do not change attribute_ac.
+
+    Parameters
+    ----------
+    src, dst, lab, num_labels : see joint_label_matrix.
+
+    normalized : bool (default=True)
+       Return counts if False or probabilities if True.
+
+    Returns
+    -------
+    m: numpy array
+       Array of shape (num_labels, num_labels), or (S, num_labels, num_labels).
+    """
+    M = joint_label_matrix(src, dst, lab, num_labels)
+    diag = np.arange(num_labels)
+    M[..., diag, diag] *= 2
+    if normalized:
+        M = M / M.sum(axis=(-2, -1), keepdims=True)
+    return M
+
+
+def edge_attribute_assortativity(src, dst, labels):
+    """Compute assortativity for node labels of a multigraph given as an edge array.
+
+    Same value as attribute_assortativity_coefficient on the multigraph,
+    without building it.
+
+    Parameters
+    ----------
+    src, dst : numpy.ndarray
+       Endpoints of the edges, of shape (m,), or (S, m) for a stack of samples.
+
+    labels : numpy.ndarray
+       Label of each node.
+
+    Returns
+    -------
+    r: float or numpy.ndarray
+       Assortativity, or array of shape (S,) with the assortativity of each sample.
+    """
+    lab, num_labels = label_index(labels)
+    return attribute_ac(mixing_matrix_from_edges(src, dst, lab, num_labels, normalized=False))
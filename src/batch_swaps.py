@@ -0,0 +1,148 @@
+import numpy as np
+import sys
+sys.path.insert(1,'../')
+from src.graph_state import GraphState, pack_pairs # type: ignore
+
+
+def orient_edges(state: GraphState,
+                 p1: np.ndarray,
+                 p2: np.ndarray,
+                 coin: np.ndarray):
+    '''
+    Endpoints (u, v) of edge p1 and (x, y) of edge p2, where
+    the second edge is flipped when coin is False.
+    '''
+    u = state.src[p1].astype(np.int64)
+    v = state.dst[p1].astype(np.int64)
+    x = np.where(coin, state.src[p2], state.dst[p2]).astype(np.int64)
+    y = np.where(coin, state.dst[p2], state.src[p2]).astype(np.int64)
+    return u, v, x, y
+
+
+def shared_items(items: np.ndarray) -> np.ndarray:
+    '''
+    items (np.ndarray): array of shape (K, r) with non-negative values;
+                        row i lists the items touched by the i-th proposal.
+
+    OUTPUT
+    ======
+    Mask of the rows sharing at least one item with another row.
+    '''
+    K = len(items)
+    # sort (item, row) pairs and look for items owned by different rows
+    packed = np.sort((items * K + np.arange(K)[:, None]).ravel())
+    item = packed // K
+    row = packed % K
+    starts = np.flatnonzero(np.diff(item, prepend=-1))
+    shared = np.minimum.reduceat(row, starts) != np.maximum.reduceat(row, starts)
+    out = np.zeros(K, bool)
+    out[row[np.repeat(shared, np.diff(starts, append=len(item)))]] = True
+    return out
+
+
+def split_batch(n: int,
+                p1: np.ndarray,
+                p2: np.ndarray,
+                u: np.ndarray,
+                v: np.ndarray,
+                x: np.ndarray,
+                y: np.ndarray,
+                inert: np.ndarray):
+    '''
+    Splits a batch of proposals (u, v), (x, y) -> (u, x), (v, y)
+    in three groups.
+    A step reads and writes only its two edges and the weights of the
+    pairs (u, v), (x, y), (u, x), (v, y). Inert proposals (out of space
+    or no-op) do not read any weight, so if their edges are not chosen
+    by any other proposal they can be resolved on the state at the
+    beginning of the batch.
+    A proposal that shares an edge with another one may see different
+    endpoints when it is performed, but they are always among the nodes
+    of the proposals sharing edges. Any other proposal is free if none
+    of its pairs is used by another proposal or has both endpoints among
+    those nodes. Free proposals commute with all the other proposals in
+    the batch, so they can be evaluated on the state at the beginning of
+    the batch and applied together. Conflicting proposals must be
+    performed one by one, in order.
+
+    OUTPUT
+    ======
+    inert (np.ndarray): mask of the inert proposals.
+    conflict (np.ndarray): mask of the conflicting proposals.
+    '''
+    busy = shared_items(np.stack([p1, p2], 1))
+    inert = inert & ~busy
+    active = ~(inert | busy)
+    pairs = np.stack([pack_pairs(n, u, v)[0],
+                      pack_pairs(n, x, y)[0],
+                      pack_pairs(n, u, x)[0],
+                      pack_pairs(n, v, y)[0]], 1)
+    conflict = busy.copy()
+    conflict[active] = shared_items(pairs[active])
+    if busy.any():
+        mark = np.zeros(n, bool)
+        for z in (u, v, x, y):
+            mark[z[busy]] = True
+        iu, iv, ix, iy = mark[u], mark[v], mark[x], mark[y]
+        conflict |= active & ((iu & iv) | (ix & iy) | (iu & ix) | (iv & iy))
+    return inert, conflict
+
+
+def perform_swaps(state: GraphState,
+                  p1: np.ndarray,
+                  p2: np.ndarray,
+                  u: np.ndarray,
+                  v: np.ndarray,
+                  x: np.ndarray,
+                  y: np.ndarray,
+                  acc: np.ndarray,
+                  stored: tuple=None):
+    '''
+    Vectorized acceptance test of Algorithm 1 for swaps
+    (u, v), (x, y) -> (u, x), (v, y) that change the multigraph
+    and do not share any node pair or edge.
+    Accepted swaps are applied to state. By default, edge p1 becomes
+    (u, x) and edge p2 becomes (v, y); stored = (a1, b1, a2, b2) stores
+    them as (a1, b1) and (a2, b2) instead.
+
+    OUTPUT
+    ======
+    P (np.ndarray): acceptance probability of each swap.
+    accept (np.ndarray): mask of the accepted swaps.
+    '''
+    table = state.table
+    k = len(p1)
+    src = np.concatenate([u, x, u, v])
+    dst = np.concatenate([v, y, x, y])
+    keys, _ = pack_pairs(table.n, src, dst)
+    slots = table.locate(keys)
+    w_uv, w_xy, w_ux, w_vy = np.where(slots >= 0, table.counts[slots], 0).reshape(4, k)
+    num_loops = (u == v).astype(np.int64) + (x == y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # line 15 Algorithm 1
+        p = (w_ux + 1) * (w_vy + 1) / (w_uv * w_xy)
+        # from a wedge to a self-loop on the middle node
+        # and an edge between the other two nodes
+        p = np.where((v == y) | (u == x), 2 * p, p)
+        # line 13 Algorithm 1
+        p = np.where((v == y) & (u == x),
+                     4 * (w_ux + 1) * (w_vy + 1) / (w_uv * (w_uv - 1)), p)
+        # line 11 Algorithm 1
+        p = np.where(num_loops == 2,
+                     (w_ux + 2) * (w_ux + 1) / (4 * w_uv * w_xy), p)
+        # line 9 Algorithm 1
+        p = np.where(num_loops == 1,
+                     (w_ux + 1) * (w_vy + 1) / (2 * w_uv * w_xy), p)
+    P = np.minimum(p, 1.0)
+    accept = acc < P
+    # remove (u, v) and (x, y), add (u, x) and (v, y)
+    sel = np.tile(accept, 4)
+    deltas = np.repeat([-1, -1, 1, 1], k)[sel]
+    deltas = np.where(src[sel] == dst[sel], 2 * deltas, deltas)
+    table.update(keys[sel], slots[sel], deltas)
+    if stored is None:
+        stored = (u, x, v, y)
+    a1, b1, a2, b2 = stored
+    state.set_edges(p1[accept], a1[accept], b1[accept])
+    state.set_edges(p2[accept], a2[accept], b2[accept])
+    return P, accept
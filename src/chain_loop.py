@@ -0,0 +1,354 @@
+import numpy as np
+import time
+
+
+# how the iterations of step_many are counted
+COUNT_MODES = ('all', 'valid', 'accepted')
+# outcomes of an iteration timed by StepInstruments
+OUTCOMES = ('Accepted', 'Rejected', 'OOS')
+# number of iterations between two flushes of the buffers of StepInstruments
+FLUSH_EVERY = 1 << 16
+
+
+class StepInstruments:
+    '''
+    Low-overhead instrumentation of the iterations of a chain:
+    - histograms of the probability P returned by MCMC_step in the
+      accepted and in the rejected iterations, with num_bins bins of
+      width 1 / num_bins on [0, 1) and one bin for P = 1, and the number
+      of rejected iterations that would leave the multigraph unchanged
+      (P = -1) or are out of space (P = -2). The values are buffered and
+      added to the histograms with one bincount;
+    - the time (ns) of one iteration every time_every on average (none
+      if 0), by outcome, from which the time of all the iterations is
+      estimated. The gaps between the timed iterations are geometric,
+      drawn with their own generator (seeded with seed, e.g., per chain)
+      so that the draws of the chain do not depend on them. A fixed gap
+      would time the same iterations of each block of draws of the
+      RandomStream, e.g., the ones drawing a block.
+    '''
+
+    def __init__(self, num_bins: int=1000, time_every: int=1024, seed=0):
+        self.num_bins = num_bins
+        self.time_every = time_every
+        self.rng = np.random.default_rng(seed)
+        # iteration of the chain timed next
+        self.next_timed = -1
+        self.accepted = np.zeros(num_bins + 1, np.int64)
+        self.rejected = np.zeros(num_bins + 1, np.int64)
+        self.unchanged = 0
+        self.oos = 0
+        # values not added to the histograms yet
+        self.accepted_buffer = []
+        self.rejected_buffer = []
+        # number and total time of the timed iterations by outcome
+        self.timed = dict.fromkeys(OUTCOMES, 0)
+        self.time_sum = dict.fromkeys(OUTCOMES, 0)
+
+    def next_gap(self) -> int:
+        '''
+        Number of iterations until the next timed one.
+        '''
+        return int(self.rng.geometric(1 / self.time_every))
+
+    def _bins(self, P: np.ndarray) -> np.ndarray:
+        # the tolerance keeps the ends of the bins (e.g., P = 0.29) in their bin
+        idx = np.minimum((P * self.num_bins + 1e-6).astype(np.int64), self.num_bins)
+        return np.bincount(idx, minlength=self.num_bins + 1)
+
+    def add(self, P: np.ndarray, accepted: np.ndarray):
+        '''
+        Adds the values P returned by a batch of iterations, with mask
+        of the accepted ones.
+        '''
+        P = np.asarray(P, np.float64)
+        self.accepted += self._bins(P[accepted])
+        P = P[~accepted]
+        self.unchanged += int(np.count_nonzero(P == -1))
+        self.oos += int(np.count_nonzero(P == -2))
+        self.rejected += self._bins(P[P >= 0])
+
+    def flush(self):
+        '''
+        Adds the buffered values to the histograms.
+        '''
+        if self.accepted_buffer:
+            self.accepted += self._bins(np.array(self.accepted_buffer))
+            self.accepted_buffer.clear()
+        if self.rejected_buffer:
+            P = np.array(self.rejected_buffer, np.float64)
+            self.rejected_buffer.clear()
+            self.unchanged += int(np.count_nonzero(P == -1))
+            self.oos += int(np.count_nonzero(P == -2))
+            self.rejected += self._bins(P[P >= 0])
+
+    def probs(self) -> dict:
+        '''
+        Number of accepted and rejected iterations by bin of P, keyed by
+        the lower end of the bin ('1.0' for P = 1) and by '-1' and '-2'
+        for the sentinels, as the acceptance output of progress_chain.
+        '''
+        self.flush()
+        probs = {'Accepted': dict(), 'Rejected': dict()}
+        for key, hist in (('Accepted', self.accepted), ('Rejected', self.rejected)):
+            for i in np.flatnonzero(hist).tolist():
+                probs[key][str(i / self.num_bins)] = int(hist[i])
+        if self.unchanged:
+            probs['Rejected']['-1'] = self.unchanged
+        if self.oos:
+            probs['Rejected']['-2'] = self.oos
+        return probs
+
+    def times(self, counters: dict) -> dict:
+        '''
+        Estimated time (ns) of the accepted, rejected, and out of space
+        iterations counted in counters: their number times the mean time
+        of the timed ones (of all the timed iterations if none of an
+        outcome was timed). Exact with time_every = 1.
+        '''
+        counts = {'Accepted': counters['accepted'], 'Rejected': counters['rejected'],
+                  'OOS': counters['oos']}
+        num_timed = sum(self.timed.values())
+        mean = sum(self.time_sum.values()) / num_timed if num_timed else 0
+        times = dict()
+        for outcome in OUTCOMES:
+            if self.timed[outcome]:
+                times[f'{outcome} (ns)'] = int(round(self.time_sum[outcome] / self.timed[outcome] * counts[outcome]))
+            else:
+                times[f'{outcome} (ns)'] = int(round(mean * counts[outcome]))
+        return times
+
+    def get_state(self) -> dict:
+        '''
+        State of the instruments as JSON-serializable values (e.g., for a checkpoint).
+        '''
+        self.flush()
+        return {'num_bins': self.num_bins, 'time_every': self.time_every,
+                'accepted': self.accepted.tolist(), 'rejected': self.rejected.tolist(),
+                'unchanged': self.unchanged, 'oos': self.oos,
+                'timed': dict(self.timed), 'time_sum': dict(self.time_sum),
+                'rng': self.rng.bit_generator.state, 'next_timed': self.next_timed}
+
+    @classmethod
+    def from_state(cls, d: dict):
+        '''
+        Instruments with the state returned by get_state.
+        '''
+        inst = cls(d['num_bins'], d['time_every'])
+        inst.accepted = np.array(d['accepted'], np.int64)
+        inst.rejected = np.array(d['rejected'], np.int64)
+        inst.unchanged = d['unchanged']
+        inst.oos = d['oos']
+        inst.timed.update(d['timed'])
+        inst.time_sum.update(d['time_sum'])
+        # the timed iterations continue from the same gaps
+        inst.rng.bit_generator.state = d['rng']
+        inst.next_timed = d['next_timed']
+        return inst
+
+
+def swap_assortativity_delta(sampler, num: int) -> float:
+    '''
+    Change of the degree assortativity (Eq (2) paper Dutta et al. 2023)
+    after swaps whose degree products sum to num.
+    '''
+    return 2 * num * 2 * sampler.m / sampler.r_denominator
+
+
+def step_many(sampler,
+              state,
+              stream,
+              n: int,
+              count_mode: str='all',
+              callback=None,
+              every: int=0,
+              batch_size: int=0,
+              instruments: StepInstruments=None,
+              audit_every: int=-1,
+              counters: dict=None) -> dict:
+    '''
+    Performs iterations of the Markov chain of sampler until n of them
+    are counted.
+
+    INPUT
+    ======
+    sampler (object): sampler to use to move in the state space.
+    state (GraphState): current multigraph. Changed inplace.
+    stream (RandomStream): random draws of the chain.
+    n (int): number of iterations to count.
+    count_mode (str): 'all' counts every iteration, 'valid' the iterations
+                      that are not out of space, and 'accepted' the
+                      iterations where a swap was accepted.
+    callback (function): if given, called with the counters every
+                         every iterations (including the ones not counted).
+    every (int): number of iterations between two calls to callback.
+    batch_size (int): if positive, the iterations are performed in batches
+                      with MCMC_batch. The chain does not depend on it.
+                      A batch has at most as many iterations as are left
+                      to count, so it never performs iterations after the
+                      n-th counted one. When some iterations are not
+                      counted ('valid' with out of space draws, and
+                      'accepted' with a low acceptance rate), the batches
+                      shrink to a few iterations near n.
+    instruments (StepInstruments): if given, updated with the values
+                                   returned by MCMC_step and the time of
+                                   a sample of the iterations. Timing
+                                   forces the iterations to be performed
+                                   one by one.
+    audit_every (int): if non-negative, the degree sequence and, if the
+                       sampler preserves it, the JLM of state are tracked
+                       (see InvariantAudit) and checked
+                       at the end, and every audit_every iterations if
+                       positive. An AssertionError is raised if they changed.
+    counters (dict): if given, the counters returned by a previous call
+                     on the same chain (e.g., read from a checkpoint).
+                     The iterations continue from them, and n includes
+                     the iterations already counted.
+
+    OUTPUT
+    ======
+    counters (dict): number of iterations performed ('steps'), counted,
+                     accepted, rejected (including the ones leaving the
+                     multigraph unchanged), and out of space ('oos'),
+                     change of the sum of the degree products of the
+                     edges ('degree_products'), and change of degree
+                     assortativity ('delta_r').
+    '''
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f'Unknown count mode {count_mode}.')
+    if counters is None:
+        counters = {'steps': 0, 'counted': 0, 'accepted': 0, 'rejected': 0, 'oos': 0,
+                    'degree_products': 0, 'delta_r': 0.}
+    else:
+        counters = dict(counters)
+    if audit_every >= 0 and state.audit is None:
+        state.start_audit(sampler.preserves_jlm)
+    if batch_size > 0 and (instruments is None or instruments.time_every <= 0):
+        _batch_loop(sampler, state, stream, n, count_mode, callback, every,
+                    batch_size, instruments, audit_every, counters)
+    else:
+        _step_loop(sampler, state, stream, n, count_mode, callback, every,
+                   instruments, audit_every, counters)
+    if audit_every >= 0:
+        state.audit.check()
+    return counters
+
+
+def _step_loop(sampler, state, stream, n, count_mode, callback, every,
+               instruments, audit_every, counters):
+    degrees = sampler.degrees.tolist()
+    swapped = [-1, -1, -1, -1]
+    steps = counters['steps']
+    counted = counters['counted']
+    accepted = counters['accepted']
+    oos = counters['oos']
+    num = counters['degree_products']
+    if instruments is not None:
+        add_accepted = instruments.accepted_buffer.append
+        add_rejected = instruments.rejected_buffer.append
+        timed = instruments.timed
+        time_sum = instruments.time_sum
+    next_timed = -1
+    if instruments is not None and instruments.time_every > 0:
+        next_timed = instruments.next_timed
+        if next_timed < steps:
+            next_timed = steps + instruments.next_gap() - 1
+    while counted < n:
+        if steps == next_timed:
+            next_timed += instruments.next_gap()
+            step_start = time.perf_counter_ns()
+            P = sampler.MCMC_step(state, stream, swapped)
+            step_time = time.perf_counter_ns() - step_start
+        else:
+            P = sampler.MCMC_step(state, stream, swapped)
+            step_time = -1
+        steps += 1
+        if swapped[0] != -1:
+            accepted += 1
+            num += degrees[swapped[0]] * degrees[swapped[2]]
+            num += degrees[swapped[1]] * degrees[swapped[3]]
+            num -= degrees[swapped[0]] * degrees[swapped[1]]
+            num -= degrees[swapped[2]] * degrees[swapped[3]]
+            swapped[0] = -1
+            counted += 1
+            outcome = 'Accepted'
+            if instruments is not None:
+                add_accepted(P)
+        else:
+            if P == -2:
+                oos += 1
+                if count_mode == 'all':
+                    counted += 1
+                outcome = 'OOS'
+            else:
+                if count_mode != 'accepted':
+                    counted += 1
+                outcome = 'Rejected'
+            if instruments is not None:
+                add_rejected(P)
+        if step_time >= 0:
+            timed[outcome] += 1
+            time_sum[outcome] += step_time
+        if every and steps % every == 0:
+            _update(sampler, counters, steps, counted, accepted, oos, num)
+            callback(counters)
+        if audit_every > 0 and steps % audit_every == 0:
+            state.audit.check()
+        if instruments is not None and steps % FLUSH_EVERY == 0:
+            instruments.flush()
+    if instruments is not None:
+        instruments.next_timed = next_timed
+    _update(sampler, counters, steps, counted, accepted, oos, num)
+
+
+def _batch_loop(sampler, state, stream, n, count_mode, callback, every,
+                batch_size, instruments, audit_every, counters):
+    degrees = sampler.degrees
+    steps = counters['steps']
+    counted = counters['counted']
+    accepted = counters['accepted']
+    oos = counters['oos']
+    num = counters['degree_products']
+    while counted < n:
+        # a batch never counts more iterations than needed, so the
+        # iterations after the n-th counted one are never performed
+        size = min(batch_size, int(np.ceil(n - counted)))
+        if every:
+            size = min(size, every - steps % every)
+        if audit_every > 0:
+            size = min(size, audit_every - steps % audit_every)
+        P, swaps = sampler.MCMC_batch(state, stream, size)
+        acc = swaps[:, 0] != -1
+        out = P == -2
+        if count_mode == 'all':
+            count = np.ones(size, bool)
+        elif count_mode == 'valid':
+            count = ~out
+        else:
+            count = acc
+        cum = np.cumsum(count)
+        steps += size
+        counted += int(cum[-1])
+        accepted += int(np.count_nonzero(acc))
+        oos += int(np.count_nonzero(out))
+        s = swaps[acc]
+        d = [degrees[s[:, i]] for i in range(4)]
+        num += int((d[0] * d[2] + d[1] * d[3] - d[0] * d[1] - d[2] * d[3]).sum())
+        if instruments is not None:
+            instruments.add(P, acc)
+        if every and steps % every == 0:
+            _update(sampler, counters, steps, counted, accepted, oos, num)
+            callback(counters)
+        if audit_every > 0 and steps % audit_every == 0:
+            state.audit.check()
+    _update(sampler, counters, steps, counted, accepted, oos, num)
+
+
+def _update(sampler, counters, steps, counted, accepted, oos, num):
+    counters['steps'] = steps
+    counters['counted'] = counted
+    counters['accepted'] = accepted
+    counters['rejected'] = steps - accepted - oos
+    counters['oos'] = oos
+    counters['degree_products'] = num
+    counters['delta_r'] = swap_assortativity_delta(sampler, num)
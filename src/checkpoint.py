@@ -0,0 +1,152 @@
+import numpy as np
+import json
+import os
+import time
+
+
+# subdirectory of the output directory with the checkpoints
+CKPT_DIR = 'checkpoints'
+# steps between two checks of the time elapsed since the last checkpoint
+POLL_STEPS = 1 << 16
+
+
+def checkpoint_path(out_dir: str, run_name: str, idx: int) -> str:
+    '''
+    Path of the checkpoint of chain idx of a run.
+    '''
+    return f'{out_dir}/{CKPT_DIR}/{run_name}__chain_{idx}.npz'
+
+
+class Checkpointer:
+    '''
+    Checkpoints of a Markov chain, saved to path every every steps or
+    every seconds seconds (whichever comes first; never if both are not
+    positive). A checkpoint stores the edge slots of the state, the
+    position of its random stream, the counters of step_many, and the
+    arrays and the JSON-serializable values passed by the chain
+    (e.g., the trace so far). The multiplicities are rebuilt from the
+    edge slots when the chain is restored, so the chain continues as if
+    it never stopped. Checkpoints are replaced atomically.
+    If resume is False, existing checkpoints are ignored and overwritten.
+    '''
+
+    def __init__(self,
+                 path: str,
+                 every: int=0,
+                 seconds: float=0.,
+                 resume: bool=False):
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.resume = resume
+        self.last_steps = 0
+        self.last_time = time.time()
+
+    def enabled(self) -> bool:
+        return self.every > 0 or self.seconds > 0
+
+    def poll_every(self) -> int:
+        '''
+        Steps between two calls to due.
+        '''
+        if self.every > 0:
+            return min(self.every, POLL_STEPS) if self.seconds > 0 else self.every
+        return POLL_STEPS
+
+    def due(self, steps: int) -> bool:
+        '''
+        If a checkpoint should be saved after steps steps of the chain.
+        '''
+        if self.every > 0 and steps - self.last_steps >= self.every:
+            return True
+        return self.seconds > 0 and time.time() - self.last_time >= self.seconds
+
+    def save(self,
+             state,
+             stream,
+             counters: dict,
+             arrays: dict=None,
+             **meta):
+        '''
+        Saves a checkpoint of the chain with the given state and stream.
+        counters is None between two calls to step_many.
+        '''
+        meta = dict(meta)
+        meta.update({'m': state.m, 'stream': stream.get_state(), 'counters': counters})
+        arrays = dict(arrays or {})
+        arrays.update({'src': state.src, 'dst': state.dst})
+        self._write(arrays, meta)
+        self.last_steps = counters['steps'] if counters is not None else 0
+        self.last_time = time.time()
+
+    def finish(self, **meta):
+        '''
+        Replaces the checkpoint with a marker of a finished chain,
+        without its state.
+        '''
+        meta = dict(meta)
+        meta['finished'] = True
+        self._write(dict(), meta)
+
+    def _write(self, arrays: dict, meta: dict):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as out_f:
+            np.savez(out_f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, self.path)
+
+    def load(self) -> dict:
+        '''
+        Latest checkpoint as a dictionary with the arrays and the values
+        passed to save ('meta'), or None if there is none or resume
+        is False.
+        '''
+        if not self.resume or not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as data:
+            ckpt = {name: data[name] for name in data.files if name != 'meta'}
+            ckpt['meta'] = json.loads(str(data['meta']))
+        return ckpt
+
+    def restore(self, ckpt: dict, state, stream) -> dict:
+        '''
+        Restores state and stream from a checkpoint of load
+        and returns its counters.
+        '''
+        meta = ckpt['meta']
+        if meta['m'] != state.m:
+            raise ValueError(f'{self.path} is a checkpoint of another graph.')
+        state.load_edges(ckpt['src'], ckpt['dst'])
+        stream.set_state(meta['stream'])
+        counters = meta['counters']
+        self.last_steps = counters['steps'] if counters is not None else 0
+        self.last_time = time.time()
+        return counters
+
+
+def checkpoint_options(args: dict) -> dict:
+    '''
+    Arguments of the Checkpointers of a run from the command line
+    arguments (see loaders.read_arguments), or None if the chains
+    are not checkpointed.
+    '''
+    resume = args['resume'] == 'True'
+    if args['checkpoint_every'] <= 0 and args['checkpoint_seconds'] <= 0 and not resume:
+        return None
+    return {'every': args['checkpoint_every'],
+            'seconds': args['checkpoint_seconds'],
+            'resume': resume}
+
+
+def chain_checkpointer(checkpoint: dict,
+                       out_dir: str,
+                       run_name: str,
+                       idx: int) -> Checkpointer:
+    '''
+    Checkpointer of chain idx of a run, or None if checkpoint is None.
+    checkpoint (dict): arguments of Checkpointer other than path
+                       ('every', 'seconds', and 'resume').
+    '''
+    if checkpoint is None:
+        return None
+    return Checkpointer(checkpoint_path(out_dir, run_name, idx), **checkpoint)
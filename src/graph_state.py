@@ -0,0 +1,850 @@
+import numpy as np
+from scipy import sparse
+
+
+# Fibonacci hashing constant (2^64 / golden ratio)
+HASH_MUL = 0x9E3779B97F4A7C15
+# marks a never-used slot of the hash table
+EMPTY = -1
+# the vectorized probing loops finish the last keys one by one
+PROBE_TAIL = 16
+
+
+class MultiplicityTable:
+    '''
+    Open-addressing hash table (linear probing) with the entries
+    of the adjacency matrix of a multigraph.
+    Each unordered node pair is stored once, under the packed key
+    min(u, v) * n + max(u, v). As in convert_edgelist_to_dictionary,
+    a self-loop contributes 2 to the diagonal entry.
+    Pairs whose weight drops to zero keep their slot until the
+    next rebuild.
+    '''
+
+    def __init__(self,
+                 n: int,
+                 capacity: int=16):
+        self.n = n
+        self.bits = max(4, int(capacity - 1).bit_length())
+        self.keys = np.full(1 << self.bits, EMPTY, np.int64)
+        self.counts = np.zeros(1 << self.bits, np.int32)
+        # number of occupied slots (including zero weights)
+        self.used = 0
+        self._bind()
+
+    def _bind(self):
+        self.capacity = 1 << self.bits
+        self._mask = self.capacity - 1
+        self._shift = 64 - self.bits
+        self._limit = (2 * self.capacity) // 3
+        self._keys = memoryview(self.keys)
+        self._counts = memoryview(self.counts)
+
+    def __getstate__(self):
+        return {'n': self.n, 'bits': self.bits, 'keys': self.keys,
+                'counts': self.counts, 'used': self.used}
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._bind()
+
+    @classmethod
+    def from_pairs(cls,
+                   n: int,
+                   src: np.ndarray,
+                   dst: np.ndarray):
+        '''
+        Builds the table of the multigraph with edges (src[i], dst[i]).
+        '''
+        keys, weights = pack_pairs(n, src, dst, np.ones(len(src), np.int64))
+        keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(keys))
+        table = cls(n, 2 * len(keys))
+        table._insert_new(keys, weights.astype(np.int32))
+        return table
+
+    def copy(self):
+        '''
+        Creates a deep copy of the table.
+        '''
+        table = MultiplicityTable.__new__(MultiplicityTable)
+        table.__setstate__({'n': self.n, 'bits': self.bits,
+                            'keys': self.keys.copy(),
+                            'counts': self.counts.copy(),
+                            'used': self.used})
+        return table
+
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.counts.nbytes
+
+    def get(self, u: int, v: int) -> int:
+        '''
+        Weight of the pair (u, v), 0 if absent.
+        '''
+        if u > v:
+            u, v = v, u
+        key = u * self.n + v
+        keys = self._keys
+        i = ((key * HASH_MUL) >> self._shift) & self._mask
+        while True:
+            k = keys[i]
+            if k == key:
+                return self._counts[i]
+            if k == EMPTY:
+                return 0
+            i = (i + 1) & self._mask
+
+    def add(self, u: int, v: int, delta: int):
+        '''
+        Adds delta parallel edges between u and v
+        (removes them if delta is negative).
+        '''
+        if u > v:
+            u, v = v, u
+        elif u == v:
+            delta *= 2
+        key = u * self.n + v
+        keys = self._keys
+        i = ((key * HASH_MUL) >> self._shift) & self._mask
+        while True:
+            k = keys[i]
+            if k == key:
+                self._counts[i] += delta
+                return
+            if k == EMPTY:
+                keys[i] = key
+                self._counts[i] = delta
+                self.used += 1
+                if self.used > self._limit:
+                    self.rebuild()
+                return
+            i = (i + 1) & self._mask
+
+    def _probe(self, key: int, i: int) -> int:
+        '''
+        Slot of key, or the empty slot where it should be inserted,
+        probing from slot i.
+        '''
+        keys = self._keys
+        while True:
+            k = keys[i]
+            if k == key or k == EMPTY:
+                return i
+            i = (i + 1) & self._mask
+
+    def _home(self, keys: np.ndarray) -> np.ndarray:
+        h = keys.astype(np.uint64) * np.uint64(HASH_MUL)
+        return (h >> np.uint64(self._shift)).astype(np.int64)
+
+    def locate(self, keys: np.ndarray) -> np.ndarray:
+        '''
+        Slot of each packed key, -1 if the key is absent.
+        '''
+        out = np.full(len(keys), -1, np.int64)
+        todo = np.arange(len(keys))
+        pos = self._home(keys)
+        while len(todo) > PROBE_TAIL:
+            k = self.keys[pos]
+            hit = k == keys[todo]
+            out[todo[hit]] = pos[hit]
+            live = ~hit & (k != EMPTY)
+            todo = todo[live]
+            pos = (pos[live] + 1) & self._mask
+        for j, i in zip(todo.tolist(), pos.tolist()):
+            i = self._probe(int(keys[j]), i)
+            if self._keys[i] != EMPTY:
+                out[j] = i
+        return out
+
+    def get_many(self, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized version of get.
+        '''
+        keys, _ = pack_pairs(self.n, src, dst)
+        slots = self.locate(keys)
+        out = np.zeros(len(keys), np.int64)
+        found = slots >= 0
+        out[found] = self.counts[slots[found]]
+        return out
+
+    def add_many(self, src: np.ndarray, dst: np.ndarray, deltas: np.ndarray):
+        '''
+        Vectorized version of add. Repeated pairs are allowed.
+        '''
+        keys, deltas = pack_pairs(self.n, src, dst, deltas)
+        self.update(keys, self.locate(keys), deltas)
+
+    def update(self, keys: np.ndarray, slots: np.ndarray, deltas: np.ndarray):
+        '''
+        Adds deltas to the weights of the packed keys,
+        whose slots were found with locate.
+        Repeated keys are allowed.
+        '''
+        found = slots >= 0
+        np.add.at(self.counts, slots[found], deltas[found])
+        if not found.all():
+            keys, inverse = np.unique(keys[~found], return_inverse=True)
+            deltas = np.bincount(inverse, weights=deltas[~found], minlength=len(keys))
+            if self.used + len(keys) > self._limit:
+                self.rebuild(len(keys))
+            self._insert_new(keys, deltas.astype(np.int32))
+
+    def _insert_new(self, keys: np.ndarray, counts: np.ndarray):
+        '''
+        Inserts keys that are not in the table yet.
+        '''
+        todo = np.arange(len(keys))
+        pos = self._home(keys)
+        while len(todo) > PROBE_TAIL:
+            free = self.keys[pos] == EMPTY
+            # one of the keys probing the same empty slot claims it,
+            # the others find it occupied in the next round
+            self.keys[pos[free]] = keys[todo[free]]
+            placed = free & (self.keys[pos] == keys[todo])
+            self.counts[pos[placed]] = counts[todo[placed]]
+            move = ~free
+            pos[move] = (pos[move] + 1) & self._mask
+            keep = ~placed
+            todo = todo[keep]
+            pos = pos[keep]
+        for j, i in zip(todo.tolist(), pos.tolist()):
+            i = self._probe(int(keys[j]), i)
+            self._keys[i] = int(keys[j])
+            self._counts[i] = int(counts[j])
+        self.used += len(keys)
+
+    def pairs(self):
+        '''
+        OUTPUT
+        ======
+        u, v (np.ndarray): node pairs with positive weight, u <= v.
+        w (np.ndarray): their weight.
+        '''
+        live = self.counts > 0
+        keys = self.keys[live]
+        return keys // self.n, keys % self.n, self.counts[live].astype(np.int64)
+
+    def rebuild(self, extra: int=0):
+        '''
+        Drops the pairs with zero weight and resizes the table
+        so that it is at most half full after inserting extra pairs.
+        '''
+        live = self.counts > 0
+        keys = self.keys[live]
+        counts = self.counts[live]
+        self.bits = max(4, int(2 * (len(keys) + extra) - 1).bit_length())
+        self.keys = np.full(1 << self.bits, EMPTY, np.int64)
+        self.counts = np.zeros(1 << self.bits, np.int32)
+        self.used = 0
+        self._bind()
+        self._insert_new(keys, counts)
+
+
+def pack_pairs(n: int,
+               src: np.ndarray,
+               dst: np.ndarray,
+               weights: np.ndarray | None=None):
+    '''
+    Packs each pair into the key min(u, v) * n + max(u, v).
+    If weights are given, the weights of the self-loops are doubled.
+    '''
+    src = np.asarray(src, np.int64)
+    dst = np.asarray(dst, np.int64)
+    keys = np.minimum(src, dst) * n + np.maximum(src, dst)
+    if weights is None:
+        return keys, None
+    weights = np.where(src == dst, 2 * weights, weights)
+    return keys, weights
+
+
+def count_triangles(n: int,
+                    u: np.ndarray,
+                    v: np.ndarray,
+                    w: np.ndarray) -> np.ndarray:
+    '''
+    Triangles of each node of the multigraph with n nodes and weight
+    w[i] between u[i] and v[i] (each pair once, u < v), weighted by
+    the multiplicities of their edges: half the diagonal of A^3.
+    '''
+    A = sparse.coo_matrix((np.concatenate([w, w]), (np.concatenate([u, v]), np.concatenate([v, u]))),
+                          shape=(n, n)).tocsr()
+    return np.asarray((A @ A).multiply(A).sum(axis=1)).ravel().astype(np.int64) // 2
+
+
+def link_sums(n: int,
+              u: np.ndarray,
+              v: np.ndarray,
+              w: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Number of edges of each node to other nodes, and sum of their
+    squared multiplicities, for the pairs of count_triangles. A node
+    with k such edges is the center of (k^2 - squares) / 2 wedges.
+    '''
+    links = np.bincount(u, w, n) + np.bincount(v, w, n)
+    squares = np.bincount(u, w * w, n) + np.bincount(v, w * w, n)
+    return links.astype(np.int64), squares.astype(np.int64)
+
+
+class GraphState:
+    '''
+    Array-backed state of a chromatic multigraph.
+    Slot i of src and dst stores the endpoints of the i-th edge,
+    labels and degrees are indexed by node id, and table stores the
+    multiplicity of each node pair.
+    src_view, dst_view, label_view, and degree_view are memoryviews
+    of the same buffers, for fast scalar access in the samplers.
+    '''
+
+    def __init__(self,
+                 src: np.ndarray,
+                 dst: np.ndarray,
+                 labels: np.ndarray,
+                 degrees: np.ndarray,
+                 table: MultiplicityTable):
+        self.src = src
+        self.dst = dst
+        self.labels = labels
+        self.degrees = degrees
+        self.table = table
+        # InvariantAudit of the state, if any (see start_audit)
+        self.audit = None
+        # SlotLog of the state, if any (see start_log)
+        self.log = None
+        # NodeMixing of the state, if any (see start_mixing)
+        self.mixing = None
+        # TriangleCounter of the state, if any (see start_triangles)
+        self.triangles = None
+        self._bind()
+
+    def _bind(self):
+        self.n = len(self.labels)
+        self.m = len(self.src)
+        self.src_view = memoryview(self.src)
+        self.dst_view = memoryview(self.dst)
+        self.label_view = memoryview(self.labels)
+        self.degree_view = memoryview(self.degrees)
+
+    def __getstate__(self):
+        return {'src': self.src, 'dst': self.dst, 'labels': self.labels,
+                'degrees': self.degrees, 'table': self.table}
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.audit = None
+        self.log = None
+        self.mixing = None
+        self.triangles = None
+        self._bind()
+
+    @classmethod
+    def from_edges(cls,
+                   edges,
+                   node_labels,
+                   degrees=None):
+        '''
+        edges (list or np.ndarray): list of edges, or array of shape (m, 2).
+        node_labels (dict or np.ndarray): label of each node.
+        degrees (dict or np.ndarray): degree of each node.
+                                      Computed from edges if None.
+        '''
+        edges = np.asarray(edges, np.int64).reshape(-1, 2)
+        n = int(edges.max()) + 1 if len(edges) else 0
+        if isinstance(node_labels, dict):
+            n = max(n, max(node_labels) + 1)
+            labels = np.full(n, -1, np.int32)
+            labels[list(node_labels.keys())] = list(node_labels.values())
+        else:
+            n = max(n, len(node_labels))
+            labels = np.full(n, -1, np.int32)
+            labels[:len(node_labels)] = node_labels
+        if degrees is None:
+            degs = np.bincount(edges.ravel(), minlength=n)
+        elif isinstance(degrees, dict):
+            degs = np.zeros(n, np.int64)
+            degs[list(degrees.keys())] = list(degrees.values())
+        else:
+            degs = np.zeros(n, np.int64)
+            degs[:len(degrees)] = degrees
+        dtype = np.int32 if n < 2**31 else np.int64
+        src = edges[:, 0].astype(dtype)
+        dst = edges[:, 1].astype(dtype)
+        table = MultiplicityTable.from_pairs(n, src, dst)
+        return cls(src, dst, labels, degs.astype(np.int64), table)
+
+    def copy(self):
+        '''
+        Creates a deep copy of the edge slots and of the table.
+        Labels and degrees are invariant, so they are shared.
+        The copy is not audited, logged, or tracked by a NodeMixing
+        or a TriangleCounter.
+        '''
+        return GraphState(self.src.copy(), self.dst.copy(),
+                          self.labels, self.degrees, self.table.copy())
+
+    def nbytes(self) -> int:
+        return (self.src.nbytes + self.dst.nbytes + self.labels.nbytes
+                + self.degrees.nbytes + self.table.nbytes())
+
+    def multiplicity(self, u: int, v: int) -> int:
+        '''
+        Adjacency matrix entry (u, v).
+        A self-loop on u contributes 2 to the entry (u, u).
+        '''
+        return self.table.get(u, v)
+
+    def apply_swap(self,
+                   e1: int,
+                   e2: int,
+                   a: int,
+                   b: int,
+                   c: int,
+                   d: int,
+                   flip: bool=False):
+        '''
+        Replaces the edges (a, b) and (c, d) with (a, c) and (b, d),
+        which are stored in slot e1 and e2, respectively.
+        If flip is True, the second edge is stored as (d, b).
+        '''
+        table = self.table
+        table.add(a, b, -1)
+        table.add(c, d, -1)
+        table.add(a, c, 1)
+        table.add(b, d, 1)
+        if self.audit is not None:
+            self.audit.replace(self.src_view[e1], self.dst_view[e1],
+                               self.src_view[e2], self.dst_view[e2],
+                               a, c, d if flip else b, b if flip else d)
+        self.src_view[e1] = a
+        self.dst_view[e1] = c
+        if flip:
+            self.src_view[e2] = d
+            self.dst_view[e2] = b
+        else:
+            self.src_view[e2] = b
+            self.dst_view[e2] = d
+        if self.log is not None:
+            self.log.swap(e1, a, c, e2, self.src_view[e2], self.dst_view[e2])
+        if self.mixing is not None:
+            self.mixing.swap(a, b, c, d)
+        if self.triangles is not None:
+            self.triangles.swap(a, b, c, d)
+
+    def set_edges(self,
+                  eids: np.ndarray,
+                  src: np.ndarray,
+                  dst: np.ndarray):
+        '''
+        Stores the edge (src[i], dst[i]) in slot eids[i].
+        The multiplicities in table are not changed.
+        '''
+        if self.audit is not None:
+            self.audit.change_many(self.src[eids], self.dst[eids], -1)
+            self.audit.change_many(src, dst, 1)
+        if self.mixing is not None:
+            self.mixing.change_many(self.src[eids], self.dst[eids], -1)
+            self.mixing.change_many(src, dst, 1)
+        if self.triangles is not None:
+            self.triangles.change_many(self.src[eids], self.dst[eids], -1)
+            self.triangles.change_many(src, dst, 1)
+        self.src[eids] = src
+        self.dst[eids] = dst
+        if self.log is not None:
+            self.log.write_many(eids, src, dst)
+
+    def load_edges(self,
+                   src: np.ndarray,
+                   dst: np.ndarray):
+        '''
+        Stores the edge (src[i], dst[i]) in slot i, for all the slots,
+        and rebuilds the table (e.g., to restore a chain from a
+        checkpoint). Audit, log, mixing, and triangles are not updated.
+        '''
+        self.src[:] = src
+        self.dst[:] = dst
+        self.table = MultiplicityTable.from_pairs(self.n, self.src, self.dst)
+
+    def start_audit(self, jlm: bool=True):
+        '''
+        Starts tracking the degree sequence and, if jlm is True,
+        the JLM of the state (see InvariantAudit).
+        '''
+        self.audit = InvariantAudit(self, jlm)
+        return self.audit
+
+    def start_log(self, limit: int=-1):
+        '''
+        Starts logging the edges written in the slots of the state
+        (see SlotLog).
+        '''
+        self.log = SlotLog(limit)
+        return self.log
+
+    def start_mixing(self):
+        '''
+        Starts tracking the same-label and cross-label neighbors
+        of each node (see NodeMixing).
+        '''
+        self.mixing = NodeMixing(self)
+        return self.mixing
+
+    def start_triangles(self):
+        '''
+        Starts tracking the triangles of the state (see TriangleCounter).
+        '''
+        self.triangles = TriangleCounter(self)
+        return self.triangles
+
+    def edge_list(self) -> list[tuple[int, int]]:
+        return list(zip(self.src.tolist(), self.dst.tolist()))
+
+    def weight_dict(self) -> dict[tuple[int, int], int]:
+        '''
+        Dictionary of edge weights with both orientations of each pair,
+        as built by convert_edgelist_to_dictionary.
+        '''
+        A = dict()
+        for u, v, w in zip(*[x.tolist() for x in self.table.pairs()]):
+            A[u, v] = w
+            A[v, u] = w
+        return A
+
+
+class InvariantAudit:
+    '''
+    Degree sequence and JLM of a GraphState, updated in O(1) with
+    each edge written in the slots of the state, so that they can be
+    compared with the ones of the observed multigraph at any time.
+    The JLM is stored as in compute_JLM_from_list, over the distinct
+    node labels in increasing order, and it is checked only if jlm is True.
+    '''
+
+    def __init__(self, state: GraphState, jlm: bool=True):
+        self.check_jlm = jlm
+        _, self.lab = np.unique(state.labels, return_inverse=True)
+        self.num_labels = int(self.lab.max()) + 1 if len(self.lab) else 0
+        self.degrees = np.bincount(np.concatenate([state.src, state.dst]),
+                                   minlength=state.n).astype(np.int64)
+        self.jlm = np.zeros((self.num_labels, self.num_labels), np.int64)
+        self.change_many(state.src, state.dst, 1, degrees=False)
+        # invariants of the chain
+        self.expected_degrees = state.degrees
+        self.expected_jlm = self.jlm.copy()
+        self._lab = memoryview(self.lab.astype(np.int64))
+        self._degrees = memoryview(self.degrees)
+        self._jlm = memoryview(self.jlm.reshape(-1))
+
+    def replace(self,
+                u1: int, v1: int, u2: int, v2: int,
+                x1: int, y1: int, x2: int, y2: int):
+        '''
+        Replaces the edges (u1, v1) and (u2, v2) with (x1, y1) and (x2, y2).
+        '''
+        degrees = self._degrees
+        degrees[u1] -= 1
+        degrees[v1] -= 1
+        degrees[u2] -= 1
+        degrees[v2] -= 1
+        degrees[x1] += 1
+        degrees[y1] += 1
+        degrees[x2] += 1
+        degrees[y2] += 1
+        lab = self._lab
+        jlm = self._jlm
+        L = self.num_labels
+        for u, v, delta in ((u1, v1, -1), (u2, v2, -1), (x1, y1, 1), (x2, y2, 1)):
+            a = lab[u]
+            b = lab[v]
+            jlm[a * L + b] += delta
+            if a != b:
+                jlm[b * L + a] += delta
+
+    def change_many(self,
+                    src: np.ndarray,
+                    dst: np.ndarray,
+                    delta: int,
+                    degrees: bool=True):
+        '''
+        Adds delta copies of the edges (src[i], dst[i]).
+        '''
+        if degrees:
+            np.add.at(self.degrees, src, delta)
+            np.add.at(self.degrees, dst, delta)
+        a = self.lab[src]
+        b = self.lab[dst]
+        L = self.num_labels
+        np.add.at(self.jlm.reshape(-1), a * L + b, delta)
+        cross = a != b
+        np.add.at(self.jlm.reshape(-1), b[cross] * L + a[cross], delta)
+
+    def check(self):
+        '''
+        Raises an AssertionError if the degree sequence
+        or the JLM of the state changed.
+        '''
+        if not np.array_equal(self.degrees, self.expected_degrees):
+            nodes = np.flatnonzero(self.degrees != self.expected_degrees)
+            raise AssertionError(f'Degree sequence changed for {len(nodes)} nodes, e.g., node {nodes[0]}.')
+        if self.check_jlm and not np.array_equal(self.jlm, self.expected_jlm):
+            raise AssertionError('JLM changed.')
+
+
+class SlotLog:
+    '''
+    Edges written in the slots of a GraphState, in order, as
+    (slot, source, destination) triples. An accepted swap writes two
+    slots. If limit is non-negative, logging stops (and full is set)
+    once more than limit writes are logged.
+    '''
+
+    def __init__(self, limit: int=-1, capacity: int=1024):
+        self.limit = limit
+        self.size = 0
+        self.full = False
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int):
+        self.capacity = capacity
+        self.buf = np.empty(3 * capacity, np.int64)
+        self._buf = memoryview(self.buf)
+
+    def _reserve(self, k: int) -> bool:
+        '''
+        Makes room for k more writes. Returns False if the log is full.
+        '''
+        if self.full:
+            return False
+        if self.limit >= 0 and self.size + k > self.limit:
+            self.full = True
+            return False
+        if self.size + k > self.capacity:
+            old = self.buf[:3 * self.size]
+            self._alloc(max(2 * self.capacity, self.size + k))
+            self.buf[:len(old)] = old
+        return True
+
+    def swap(self,
+             e1: int, x1: int, y1: int,
+             e2: int, x2: int, y2: int):
+        '''
+        Logs the edges (x1, y1) and (x2, y2) written in slot e1 and e2.
+        '''
+        if not self._reserve(2):
+            return
+        buf = self._buf
+        i = 3 * self.size
+        buf[i] = e1
+        buf[i + 1] = x1
+        buf[i + 2] = y1
+        buf[i + 3] = e2
+        buf[i + 4] = x2
+        buf[i + 5] = y2
+        self.size += 2
+
+    def write_many(self,
+                   eids: np.ndarray,
+                   src: np.ndarray,
+                   dst: np.ndarray):
+        '''
+        Logs the edges (src[i], dst[i]) written in slot eids[i].
+        '''
+        k = len(eids)
+        if not self._reserve(k):
+            return
+        writes = self.buf[3 * self.size:3 * (self.size + k)].reshape(-1, 3)
+        writes[:, 0] = eids
+        writes[:, 1] = src
+        writes[:, 2] = dst
+        self.size += k
+
+    def writes(self) -> np.ndarray:
+        '''
+        Array of shape (size, 3) with the logged writes.
+        '''
+        return self.buf[:3 * self.size].reshape(-1, 3)
+
+    def clear(self):
+        self.size = 0
+        self.full = False
+
+
+class NodeMixing:
+    '''
+    Number of same-label (same) and cross-label (cross) neighbors of each
+    node of a GraphState, counted with multiplicity (a self-loop counts
+    twice, so same + cross is the degree), updated in O(1) with each
+    accepted swap. sample adds the current counts to running sums,
+    so that the statistics of each node along a chain cost one pass
+    over the nodes per sample.
+    '''
+
+    def __init__(self, state: GraphState):
+        self.labels = state.labels
+        self.same = np.zeros(state.n, np.int64)
+        self.cross = np.zeros(state.n, np.int64)
+        self.change_many(state.src, state.dst, 1)
+        # running sums of the sampled counts
+        self.num_samples = 0
+        self.same_sum = np.zeros(state.n, np.int64)
+        self.cross_sum = np.zeros(state.n, np.int64)
+        self.same_sq_sum = np.zeros(state.n, np.int64)
+        self._labels = memoryview(self.labels)
+        self._same = memoryview(self.same)
+        self._cross = memoryview(self.cross)
+
+    def _edge(self, u: int, v: int, delta: int):
+        if self._labels[u] == self._labels[v]:
+            self._same[u] += delta
+            self._same[v] += delta
+        else:
+            self._cross[u] += delta
+            self._cross[v] += delta
+
+    def swap(self, a: int, b: int, c: int, d: int):
+        '''
+        Replaces the edges (a, b) and (c, d) with (a, c) and (b, d).
+        '''
+        self._edge(a, b, -1)
+        self._edge(c, d, -1)
+        self._edge(a, c, 1)
+        self._edge(b, d, 1)
+
+    def change_many(self,
+                    src: np.ndarray,
+                    dst: np.ndarray,
+                    delta: int):
+        '''
+        Adds delta copies of the edges (src[i], dst[i]).
+        '''
+        same = self.labels[src] == self.labels[dst]
+        for counts, mask in ((self.same, same), (self.cross, ~same)):
+            np.add.at(counts, src[mask], delta)
+            np.add.at(counts, dst[mask], delta)
+
+    def sample(self):
+        '''
+        Adds the current counts to the running sums.
+        '''
+        self.num_samples += 1
+        self.same_sum += self.same
+        self.cross_sum += self.cross
+        self.same_sq_sum += self.same * self.same
+
+    def sums(self) -> dict:
+        '''
+        Running sums of the sampled counts, and of the squares of the
+        same-label ones, with the number of samples.
+        '''
+        return {'num_samples': self.num_samples,
+                'same_sum': self.same_sum,
+                'cross_sum': self.cross_sum,
+                'same_sq_sum': self.same_sq_sum}
+
+    def load_sums(self, sums: dict):
+        '''
+        Restores the running sums returned by sums
+        (e.g., read from a checkpoint).
+        '''
+        self.num_samples = int(sums['num_samples'])
+        self.same_sum[:] = sums['same_sum']
+        self.cross_sum[:] = sums['cross_sum']
+        self.same_sq_sum[:] = sums['same_sq_sum']
+
+
+class TriangleCounter:
+    '''
+    Triangles of a GraphState, weighted by the multiplicities of their
+    edges (u, v, w is counted A[u, v] A[v, w] A[u, w] times; self-loops
+    are in no triangle), in total and per node, and wedges (pairs of
+    edges to two distinct neighbors) centered at each node.
+    Adding or removing a copy of the edge (u, v) changes the triangles
+    by the common neighbors of u and v, weighted by the multiplicities,
+    so an accepted swap costs four neighborhood intersections on the
+    neighbor multiplicities kept for each node.
+    '''
+
+    def __init__(self, state: GraphState):
+        u, v, w = state.table.pairs()
+        loops = u == v
+        u, v, w = u[~loops], v[~loops], w[~loops]
+        n = state.n
+        # neighbor -> multiplicity, without self-loops
+        self.adj = [dict() for _ in range(n)]
+        for x, y, k in zip(u.tolist(), v.tolist(), w.tolist()):
+            self.adj[x][y] = k
+            self.adj[y][x] = k
+        self.node_triangles = count_triangles(n, u, v, w)
+        self.total = int(self.node_triangles.sum()) // 3
+        self.links, self.squares = link_sums(n, u, v, w)
+        self._node_triangles = memoryview(self.node_triangles)
+        self._links = memoryview(self.links)
+        self._squares = memoryview(self.squares)
+
+    def _edge(self, u: int, v: int, delta: int):
+        if u == v:
+            return
+        au = self.adj[u]
+        av = self.adj[v]
+        small, large = (au, av) if len(au) <= len(av) else (av, au)
+        tri = self._node_triangles
+        common = 0
+        for x, k in small.items():
+            k2 = large.get(x)
+            if k2 is not None:
+                tri[x] += delta * k * k2
+                common += k * k2
+        tri[u] += delta * common
+        tri[v] += delta * common
+        self.total += delta * common
+        k = au.get(v, 0)
+        # (k + delta)^2 - k^2
+        sq = 2 * delta * k + 1
+        self._squares[u] += sq
+        self._squares[v] += sq
+        self._links[u] += delta
+        self._links[v] += delta
+        if k + delta:
+            au[v] = k + delta
+            av[u] = k + delta
+        else:
+            del au[v]
+            del av[u]
+
+    def swap(self, a: int, b: int, c: int, d: int):
+        '''
+        Replaces the edges (a, b) and (c, d) with (a, c) and (b, d).
+        '''
+        self._edge(a, b, -1)
+        self._edge(c, d, -1)
+        self._edge(a, c, 1)
+        self._edge(b, d, 1)
+
+    def change_many(self,
+                    src: np.ndarray,
+                    dst: np.ndarray,
+                    delta: int):
+        '''
+        Adds delta copies of the edges (src[i], dst[i]).
+        '''
+        for u, v in zip(src.tolist(), dst.tolist()):
+            self._edge(u, v, delta)
+
+    def wedges(self) -> np.ndarray:
+        '''
+        Number of wedges centered at each node.
+        '''
+        return (self.links * self.links - self.squares) // 2
+
+    def transitivity(self) -> float:
+        '''
+        Fraction of the wedges closed by a triangle.
+        '''
+        wedges = int(self.wedges().sum())
+        return 3 * self.total / wedges if wedges else 0.
+
+    def local_clustering(self) -> np.ndarray:
+        '''
+        Fraction of the wedges centered at each node closed by a
+        triangle (0 for the nodes without wedges).
+        '''
+        wedges = self.wedges()
+        return np.divide(self.node_triangles, wedges, out=np.zeros(len(wedges)), where=wedges > 0)
@@ -0,0 +1,135 @@
+import numpy as np
+import sys
+sys.path.insert(1,'../')
+from src.assortativity import edge_attribute_assortativity # type: ignore
+from src.graph_state import count_triangles, link_sums # type: ignore
+
+
+def degree_assortativity(sampler, state) -> float:
+    '''
+    Degree assortativity (Eq (2) paper Dutta et al. 2023) of state.
+    '''
+    degrees = sampler.degrees
+    SL = 2 * int((degrees[state.src] * degrees[state.dst]).sum())
+    S1 = 2 * sampler.m
+    numerator = S1 * SL - (sampler.S2**2)
+    return float(numerator) / sampler.r_denominator
+
+
+def self_loops(sampler, state) -> int:
+    '''
+    Number of self-loops of state.
+    '''
+    return int(np.count_nonzero(state.src == state.dst))
+
+
+def multi_edges(sampler, state) -> int:
+    '''
+    Number of edges of state parallel to another edge, i.e., number of
+    edges minus number of distinct node pairs.
+    '''
+    src = state.src.astype(np.int64)
+    dst = state.dst.astype(np.int64)
+    pairs = np.minimum(src, dst) * state.n + np.maximum(src, dst)
+    return state.m - len(np.unique(pairs))
+
+
+def color_assortativity(sampler, state) -> float:
+    '''
+    Color assortativity of state, as computed by
+    assortativity.attribute_assortativity_coefficient on the
+    multigraph with the node labels as attribute.
+    '''
+    return edge_attribute_assortativity(state.src, state.dst, state.labels)
+
+
+def node_triangles(state) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Triangles and wedges of each node of state, weighted by the
+    multiplicities of the edges (see graph_state.TriangleCounter).
+    They are read from the TriangleCounter of state if it has one,
+    and computed from scratch otherwise.
+    '''
+    if state.triangles is not None:
+        return state.triangles.node_triangles, state.triangles.wedges()
+    u, v, w = state.table.pairs()
+    loops = u == v
+    u, v, w = u[~loops], v[~loops], w[~loops]
+    links, squares = link_sums(state.n, u, v, w)
+    return count_triangles(state.n, u, v, w), (links * links - squares) // 2
+
+
+def triangles(sampler, state) -> int:
+    '''
+    Number of triangles of state, weighted by the multiplicities of their edges.
+    '''
+    return int(node_triangles(state)[0].sum()) // 3
+
+
+def transitivity(sampler, state) -> float:
+    '''
+    Fraction of the wedges of state closed by a triangle.
+    '''
+    tri, wedges = node_triangles(state)
+    total = int(wedges.sum())
+    return int(tri.sum()) / total if total else 0.
+
+
+def average_clustering(sampler, state) -> float:
+    '''
+    Average over the nodes of state of the fraction of the wedges
+    centered at the node closed by a triangle (0 without wedges).
+    '''
+    tri, wedges = node_triangles(state)
+    return float(np.divide(tri, wedges, out=np.zeros(len(wedges)), where=wedges > 0).mean())
+
+
+# statistics available by name
+STATISTICS = {'degree_assortativity': degree_assortativity,
+              'self_loops': self_loops,
+              'multi_edges': multi_edges,
+              'color_assortativity': color_assortativity,
+              'triangles': triangles,
+              'transitivity': transitivity,
+              'average_clustering': average_clustering}
+# statistics read from a TriangleCounter, if the state has one
+TRIANGLE_STATISTICS = ('triangles', 'transitivity', 'average_clustering')
+
+
+def get_statistics(statistics: list) -> dict:
+    '''
+    Statistics by name. Each element of statistics is the name of
+    a statistic in STATISTICS, or a function f(sampler, state) of
+    the sampler and of the GraphState of a sample, named after
+    f.__name__. Functions run in the workers, so they must be defined
+    at the top level of a module.
+    '''
+    out = dict()
+    for stat in statistics:
+        if callable(stat):
+            out[stat.__name__] = stat
+        elif stat in STATISTICS:
+            out[stat] = STATISTICS[stat]
+        else:
+            raise ValueError(f'Unknown statistic {stat}.')
+    return out
+
+
+def evaluate(statistics: dict, sampler, state) -> dict:
+    '''
+    Value of each statistic (see get_statistics) on state.
+    '''
+    # NumPy scalars as Python numbers
+    return {name: np.asarray(f(sampler, state)).item() for name, f in statistics.items()}
+
+
+def save_table(file_path: str, rows: list[dict]):
+    '''
+    Writes rows with the same keys as a tab-separated table with a header.
+    '''
+    with open(file_path, 'w') as out_f:
+        if not rows:
+            return
+        out_f.write('\t'.join(rows[0]) + '\n')
+        for row in rows:
+            out_f.write('\t'.join(str(v) for v in row.values()) + '\n')
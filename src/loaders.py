@@ -1,4 +1,14 @@
 import argparse
+import itertools
+import json
+import os
+import numpy as np
+
+
+# subdirectory of the data directory with the parsed datasets
+CACHE_DIR = 'cache'
+# lines of text parsed at a time
+CHUNK_LINES = 1 << 18
 
 def read_arguments():
     parser = argparse.ArgumentParser()
@@ -9,6 +19,10 @@ def read_arguments():
     parser.add_argument('--base_path', type=str, default='.', help='Directory with the data and out directory.')
     parser.add_argument('--data_dir', type=str, default='data', help='Name of the directory with the datasets.')
     parser.add_argument('--graph_name', type=str, help='Name of the graph to load (without extension).')
+    parser.add_argument('--datasets', type=str, help='Names of the graphs of the sweep (without extension). Comma separated list.')
+    parser.add_argument('--algorithms', type=str, help='Sampler names of the sweep. Comma separated list.')
+    parser.add_argument('--seeds', type=str, help='Seeds of the sweep. Comma separated list.')
+    parser.add_argument('--exper', type=int, default=0, choices=[0, 1], help='Experiment of the sweep: 0 = sampling, 1 = convergence.')
     parser.add_argument('--algorithm', type=str, default='LA', choices=['LA', 'LW', 'CM'], help='Sampler name.')
     parser.add_argument('--D', type=int, default=10, help='Number of parallel chain to test convergence.')
     parser.add_argument('--mul_fact', default=100, type=int, help='Multiplying factor M to get the number of steps: M * num_edges.')
@@ -16,6 +30,27 @@ def read_arguments():
     parser.add_argument('--actual_swaps', type=str, default='False', choices=['True', 'False'], help='If the number of steps to perform indicates the number of actual moves in the Markov chain.')
     parser.add_argument('--label_list', type=str, help='List of number of labels for the scalability experiment. Comma separated list.')
     parser.add_argument('--perc', type=float, default=0.05, help='Multiplying factor P to get the interval between two consecutive measurements of time elapsed: P * num_edges.')
+    parser.add_argument('--node_mixing', type=str, default='False', choices=['True', 'False'], help='If the same-label and cross-label neighbors of each node are tracked along each chain of the convergence experiment.')
+    parser.add_argument('--triangles', type=str, default='False', choices=['True', 'False'], help='If the triangles and the transitivity are tracked along each chain of the convergence experiment.')
+    parser.add_argument('--keep_traces', type=str, default='True', choices=['True', 'False'], help='If the values measured along each chain of the convergence experiment are kept, or only their online estimators (ESS, IAT, batch means).')
+    parser.add_argument('--rhat', type=float, default=0., help='If positive, the chains of the convergence experiment are stopped as soon as the split R-hat of the degree assortativity (and of the triangles and the transitivity with --triangles) is below this threshold, with at most mul_fact * num_edges steps.')
+    parser.add_argument('--rhat_block', type=int, default=10, help='Number of measurements of each chain between two computations of R-hat.')
+    parser.add_argument('--time_every', type=int, default=1024, help='One step every time_every of each chain of the convergence experiment is timed, and the time of the others is estimated from them (1 times every step).')
+    parser.add_argument('--statistics', type=str, help='Statistics computed on each random graph instead of writing it, or by run_evaluation.py on the graphs already written (degree_assortativity, self_loops, multi_edges, color_assortativity, triangles, transitivity, average_clustering). Comma separated list.')
+    parser.add_argument('--output', type=str, default='tsv', choices=['tsv', 'store'], help='Write each sampled graph to a TSV file, or all the graphs of a run to a single binary container.')
+    parser.add_argument('--encoding', type=str, default='full', choices=['full', 'diff', 'log'], help='How the graphs are stored in the binary container: all the edges, the edges that differ from the previous graph of the chain, or the swaps performed since then.')
+    parser.add_argument('--codec', type=str, default='none', choices=['none', 'zlib', 'lzma'], help='Compression of the graphs in the binary container.')
+    parser.add_argument('--cache', type=str, default='True', choices=['True', 'False'], help='If the parsed datasets are cached as .npy files in the cache subdirectory of the data directory.')
+    parser.add_argument('--batch_size', type=int, default=0, help='Number of steps evaluated together by the batched swap engine (0 to perform the steps one by one).')
+    parser.add_argument('--num_chains', type=int, default=0, help='Number of long chains emitting the random graphs, each burned in once (0 to run one chain per graph).')
+    parser.add_argument('--spacing', type=int, default=-1, help='Number of steps between two graphs emitted by the same chain (-1 to use the spacing of the sampler, or the number of edges).')
+    parser.add_argument('--auto_tune', type=str, default='False', choices=['True', 'False'], help='If the burn-in and the spacing are found with D pilot chains of at most M * num_edges steps before sampling.')
+    parser.add_argument('--T', type=int, default=50, help='Number of draws from each pilot chain used by the lag-1 autocorrelation test.')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Significance level of the lag-1 autocorrelation test.')
+    parser.add_argument('--checkpoint_every', type=int, default=0, help='Save a checkpoint of each chain every checkpoint_every steps (0 to disable).')
+    parser.add_argument('--checkpoint_seconds', type=float, default=0, help='Save a checkpoint of each chain every checkpoint_seconds seconds (0 to disable).')
+    parser.add_argument('--resume', type=str, default='False', choices=['True', 'False'], help='If the chains continue from their latest checkpoint.')
+    parser.add_argument('--audit_every', type=int, default=-1, help='Check the degree sequence and the JLM of each chain every audit_every steps (0 to check only at the end of the chain, -1 to disable).')
 
     args = parser.parse_args()
     args = vars(args)
@@ -23,17 +58,101 @@ def read_arguments():
     return args
 
 
+def read_line_chunks(file_path: str, chunk_lines: int=CHUNK_LINES):
+    '''
+    Generator of the lines of a file in lists of chunk_lines lines,
+    so that only one chunk of text is in memory.
+    '''
+    with open(file_path) as in_f:
+        while True:
+            lines = list(itertools.islice(in_f, chunk_lines))
+            if not lines:
+                return
+            yield lines
+
+
+def parse_column(lines: list[str], col: int, dtype) -> np.ndarray:
+    '''
+    Column col of tab-separated lines. Blank lines are ignored.
+    '''
+    return np.loadtxt(lines, dtype=dtype, delimiter='\t', usecols=(col,),
+                      comments=None, ndmin=1)
+
+
+def read_tsv_edges(file_path: str, chunk_lines: int=CHUNK_LINES) -> np.ndarray:
+    '''
+    Read multi-graph stored as a list of edges,
+    where source and destination are tab-separated.
+    Other columns are ignored. The file is parsed in chunks
+    (see read_line_chunks).
+
+    OUTPUT
+    ======
+    Array of shape (m, 2) with the edges, int32 if the node ids fit.
+    '''
+    chunks = []
+    for lines in read_line_chunks(file_path, chunk_lines):
+        chunk = np.loadtxt(lines, dtype=np.int64, delimiter='\t', usecols=(0, 1),
+                           comments=None, ndmin=2)
+        if len(chunk) and chunk.max() < 2**31:
+            # concatenate goes back to int64 if any chunk needs it
+            chunk = chunk.astype(np.int32)
+        chunks.append(chunk)
+    if not chunks:
+        return np.zeros((0, 2), np.int32)
+    return np.concatenate(chunks)
+
+
+def read_label_array(filepath: str,
+                     edges: np.ndarray,
+                     chunk_lines: int=CHUNK_LINES):
+    '''
+    Read node labels from disk.
+    Each line contains a node id and its label, separated by a tab.
+    Node labels are replaced with integers starting from 0, in order of
+    appearance. The nodes of edges without a label get a new label.
+    The file is parsed in chunks (see read_line_chunks), and the labels of
+    each chunk are replaced with one call to np.unique.
+
+    OUTPUT
+    ======
+    node_labels (np.ndarray): label of node i in position i, or -1 if
+                              node i has no label and no edge.
+    inner_outer_labels (dict): integer of each label in the file.
+    '''
+    inner_outer_labels = dict()
+    nodes = []
+    ids = []
+    for lines in read_line_chunks(filepath, chunk_lines):
+        names, first, inverse = np.unique(np.char.strip(parse_column(lines, 1, str)),
+                                          return_index=True, return_inverse=True)
+        # new labels in order of appearance
+        for name in names[np.argsort(first, kind='stable')].tolist():
+            if name not in inner_outer_labels:
+                inner_outer_labels[name] = len(inner_outer_labels)
+        lookup = np.array([inner_outer_labels[name] for name in names.tolist()], np.int32)
+        nodes.append(parse_column(lines, 0, np.int64))
+        ids.append(lookup[inverse.ravel()])
+    nodes = np.concatenate(nodes) if nodes else np.zeros(0, np.int64)
+    ids = np.concatenate(ids) if ids else np.zeros(0, np.int32)
+    n = max(int(edges.max()) + 1 if len(edges) else 0,
+            int(nodes.max()) + 1 if len(nodes) else 0)
+    node_labels = np.full(n, -1, np.int32)
+    # a later line overrides an earlier one
+    node_labels[nodes] = ids
+    unlabeled = np.zeros(n, bool)
+    unlabeled[edges.ravel()] = True
+    unlabeled &= node_labels < 0
+    node_labels[unlabeled] = len(inner_outer_labels)
+    return node_labels, inner_outer_labels
+
+
 def read_tsv_graph(file_path):
     '''
     Read multi-graph stored as a list of edges,
     where source and destination are tab-separated.
     '''
-    edges = []
-    with open(file_path) as in_f:
-        for line in in_f.readlines():
-            lst = line.split('\t')
-            edges.append((int(lst[0]), int(lst[1])))
-    return edges
+    return [tuple(edge) for edge in read_tsv_edges(file_path).tolist()]
 
 
 def read_node_labels(filepath, nodes):
@@ -41,19 +160,112 @@ def read_node_labels(filepath, nodes):
     Read node labels from disk.
     Each line contains a node id and its label, separated by a tab.
     Node labels are replaced with integers starting from 0.
+    Nodes without a label get a new label.
     '''
-    inner_outer_labels = dict()
-    node_labels = dict()
-    lab_id = 0
-    with open(filepath) as in_f:
-        for line in in_f.readlines():
-            lst = line.strip().split('\t')
-            inn_lab = lst[1].strip()
-            if inn_lab not in inner_outer_labels:
-                inner_outer_labels[inn_lab] = lab_id
-                lab_id += 1
-            node_labels[int(lst[0])] = inner_outer_labels[inn_lab]
-    for node in nodes:
-        if node not in node_labels:
-            node_labels[node] = lab_id
-    return node_labels, inner_outer_labels
\ No newline at end of file
+    nodes = np.fromiter(nodes, np.int64)
+    labels, inner_outer_labels = read_label_array(filepath, np.stack([nodes, nodes], 1))
+    node_labels = {node: lab for node, lab in enumerate(labels.tolist()) if lab >= 0}
+    return node_labels, inner_outer_labels
+
+
+def source_key(paths: list[str]) -> str:
+    '''
+    Path, size, and modification time of the files.
+    '''
+    key = []
+    for path in paths:
+        st = os.stat(path)
+        key.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    return json.dumps(key)
+
+
+def load_cached(cache_path: str, sources: list[str], build) -> dict:
+    '''
+    Arrays of the dictionary returned by build(), cached in
+    cache_path.<name>.npy and memory-mapped when read.
+    The cache is keyed by path, size, and modification time of the
+    source files (stored in cache_path.npz), and it is rebuilt when
+    any of them changes.
+    '''
+    key = source_key(sources)
+    meta_path = f'{cache_path}.npz'
+    if os.path.exists(meta_path):
+        with np.load(meta_path) as meta:
+            if str(meta['key']) == key:
+                return {name: np.load(f'{cache_path}.{name}.npy', mmap_mode='r')
+                        for name in meta['names'].tolist()}
+    arrays = build()
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    # files are replaced atomically, and the key is written last
+    tmp = f'{cache_path}.{os.getpid()}.tmp'
+    for name, arr in arrays.items():
+        with open(tmp, 'wb') as out_f:
+            np.save(out_f, arr)
+        os.replace(tmp, f'{cache_path}.{name}.npy')
+    with open(tmp, 'wb') as out_f:
+        np.savez(out_f, key=np.array(key), names=np.array(list(arrays)))
+    os.replace(tmp, meta_path)
+    return arrays
+
+
+def cache_path(file_path: str) -> str:
+    head, tail = os.path.split(file_path)
+    return os.path.join(head, CACHE_DIR, os.path.splitext(tail)[0])
+
+
+def load_edges(file_path: str, cache: bool=True) -> np.ndarray:
+    '''
+    Edges of the multi-graph stored in file_path (see read_tsv_edges),
+    as an array of shape (m, 2).
+    If cache, the array is read from the cache (see load_cached).
+    '''
+    def build():
+        return {'edges': read_tsv_edges(file_path)}
+
+    if not cache:
+        return build()['edges']
+    return load_cached(cache_path(file_path), [file_path], build)['edges']
+
+
+def load_node_labels(filepath: str, graph_path: str, cache: bool=True):
+    '''
+    Labels of the nodes of the multi-graph stored in graph_path
+    (see read_label_array).
+    If cache, the array is read from the cache (see load_cached).
+
+    OUTPUT
+    ======
+    node_labels (np.ndarray): label of each node.
+    inner_outer_labels (dict): integer of each label in the file.
+    '''
+    def build():
+        labels, inner_outer_labels = read_label_array(filepath, load_edges(graph_path, cache))
+        names = list(inner_outer_labels)
+        return {'labels': labels, 'names': np.array(names, dtype=str)}
+
+    if cache:
+        arrays = load_cached(cache_path(filepath), [filepath, graph_path], build)
+    else:
+        arrays = build()
+    inner_outer_labels = {name: i for i, name in enumerate(arrays['names'].tolist())}
+    return arrays['labels'], inner_outer_labels
+
+
+def load_dataset(data_dir: str, graph_name: str, cache: bool=True):
+    '''
+    Edges and node labels of the dataset graph_name in data_dir
+    (files <graph_name>.tsv and <graph_name>_labels.tsv).
+
+    OUTPUT
+    ======
+    edges (np.ndarray): array of shape (m, 2) with the edges.
+    degrees (np.ndarray): degree of each node.
+    node_labels (np.ndarray): label of each node.
+    inner_outer_labels (dict): integer of each label in the file.
+    '''
+    graph_path = f'{data_dir}/{graph_name}.tsv'
+    edges = load_edges(graph_path, cache)
+    node_labels, inner_outer_labels = load_node_labels(f'{data_dir}/{graph_name}_labels.tsv',
+                                                       graph_path, cache)
+    degrees = np.bincount(edges.ravel(), minlength=len(node_labels))
+    return edges, degrees, node_labels, inner_outer_labels
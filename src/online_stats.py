@@ -0,0 +1,236 @@
+import numpy as np
+
+
+class OnlineAutocorrelation:
+    '''
+    Streaming estimators of the autocorrelation of a series (e.g., the
+    degree assortativity recorded along a chain), in memory that does
+    not depend on its length:
+    - the autocovariances at lags 0, ..., max_lag, from running sums of
+      the lagged products and the first and last max_lag values, which
+      give the integrated autocorrelation time (IAT) with the initial
+      positive sequence estimator (Geyer 1992);
+    - the batch means, with at most 2 * num_batches batches whose size
+      doubles when they are all full.
+    The values are shifted by the first one, so that the running sums
+    do not lose precision when the series moves little around a large
+    value. Lags and IATs are in number of values of the series.
+    '''
+
+    def __init__(self, max_lag: int=100, num_batches: int=32):
+        self.max_lag = max_lag
+        self.num_batches = num_batches
+        self.n = 0
+        self.shift = 0.
+        self.total = 0.
+        # sum over t of y[t] y[t - k], for k = 0, ..., max_lag
+        self.lagged = np.zeros(max_lag + 1)
+        # first max_lag values, and the last max_lag ones (value t in t % max_lag)
+        self.head = np.zeros(max_lag)
+        self.tail = np.zeros(max_lag)
+        # sums of the full batches, and of the current one
+        self.batch_size = 1
+        self.batches = []
+        self.current = 0.
+        self.current_size = 0
+
+    def _last(self, k: int) -> np.ndarray:
+        '''
+        Last k values, from the most recent one.
+        '''
+        return self.tail[(self.n - 1 - np.arange(k)) % self.max_lag]
+
+    def update(self, x: float):
+        '''
+        Adds the next value of the series.
+        '''
+        if self.n == 0:
+            self.shift = float(x)
+        y = float(x) - self.shift
+        K = self.max_lag
+        k = min(self.n, K)
+        self.lagged[0] += y * y
+        if k:
+            self.lagged[1:k + 1] += y * self._last(k)
+        if K:
+            if self.n < K:
+                self.head[self.n] = y
+            self.tail[self.n % K] = y
+        self.n += 1
+        self.total += y
+        self.current += y
+        self.current_size += 1
+        if self.current_size == self.batch_size:
+            self.batches.append(self.current)
+            self.current = 0.
+            self.current_size = 0
+            if len(self.batches) == 2 * self.num_batches:
+                # pairs of batches are merged
+                self.batches = [self.batches[i] + self.batches[i + 1]
+                                for i in range(0, len(self.batches), 2)]
+                self.batch_size *= 2
+
+    def autocovariances(self) -> np.ndarray:
+        '''
+        Autocovariances at lags 0, ..., min(max_lag, n - 1), with the
+        estimator of line 2 Algorithm 2 Dutta et al. (divided by n).
+        '''
+        n = self.n
+        K = min(self.max_lag, n - 1)
+        if K < 0:
+            return np.zeros(0)
+        mean = self.total / n
+        lags = np.arange(K + 1)
+        # sums of the values from lag k on, and up to n - 1 - k
+        first = np.concatenate([[0.], np.cumsum(self.head[:K])])
+        last = np.concatenate([[0.], np.cumsum(self._last(K))])
+        late = self.total - first
+        early = self.total - last
+        return (self.lagged[:K + 1] - mean * (late + early) + (n - lags) * mean * mean) / n
+
+    def iat(self) -> tuple[float, bool]:
+        '''
+        Integrated autocorrelation time with the initial positive
+        sequence estimator: -1 + 2 sum of the sums of the
+        autocorrelations at lags 2m and 2m + 1 while they are positive.
+        Also returns True if all the sums up to max_lag are positive,
+        i.e., the estimate is truncated (the chain mixes slower than max_lag).
+        nan if the series is constant.
+        '''
+        g = self.autocovariances()
+        if len(g) < 2 or g[0] <= 0:
+            return np.nan, False
+        pairs = g[0:len(g) - 1:2] + g[1::2]
+        negative = np.flatnonzero(pairs <= 0)
+        stop = negative[0] if len(negative) else len(pairs)
+        return float(-1 + 2 * pairs[:stop].sum() / g[0]), len(negative) == 0
+
+    def batch_means_variance(self) -> float:
+        '''
+        Asymptotic variance of the series estimated with the batch means,
+        i.e., batch size times the variance of the means of the full
+        batches. nan with less than two full batches.
+        '''
+        if len(self.batches) < 2:
+            return np.nan
+        means = np.array(self.batches) / self.batch_size
+        return float(self.batch_size * means.var(ddof=1))
+
+    def summary(self) -> dict:
+        '''
+        Mean and variance of the series, IAT and effective sample size
+        (n / IAT) with the initial positive sequence and with the batch
+        means, and standard error of the mean with the batch means.
+        '''
+        g = self.autocovariances()
+        var = float(g[0]) if len(g) else np.nan
+        tau, truncated = self.iat()
+        bm = self.batch_means_variance()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau_bm = bm / var if var > 0 else np.nan
+        return {'Mean': self.shift + self.total / self.n if self.n else np.nan,
+                'Variance': var,
+                'IAT': tau,
+                'IAT Truncated': truncated,
+                'ESS': self.n / tau if tau > 0 else np.nan,
+                'IAT (Batch Means)': tau_bm,
+                'ESS (Batch Means)': self.n / tau_bm if tau_bm > 0 else np.nan,
+                'Std Error (Batch Means)': float(np.sqrt(bm / self.n)) if self.n else np.nan,
+                'Num Values': self.n}
+
+    def get_state(self) -> dict:
+        '''
+        State of the estimators as JSON-serializable values (e.g., for a checkpoint).
+        '''
+        return {'max_lag': self.max_lag, 'num_batches': self.num_batches,
+                'n': self.n, 'shift': self.shift, 'total': self.total,
+                'lagged': self.lagged.tolist(), 'head': self.head.tolist(),
+                'tail': self.tail.tolist(), 'batch_size': self.batch_size,
+                'batches': list(self.batches), 'current': self.current,
+                'current_size': self.current_size}
+
+    @classmethod
+    def from_state(cls, d: dict):
+        '''
+        Estimators with the state returned by get_state.
+        '''
+        est = cls(d['max_lag'], d['num_batches'])
+        est.n = d['n']
+        est.shift = d['shift']
+        est.total = d['total']
+        est.lagged = np.array(d['lagged'])
+        est.head = np.array(d['head'])
+        est.tail = np.array(d['tail'])
+        est.batch_size = d['batch_size']
+        est.batches = list(d['batches'])
+        est.current = d['current']
+        est.current_size = d['current_size']
+        return est
+
+
+class RunningMoments:
+    '''
+    Number of values, mean, and sum of squared deviations from the mean
+    (m2) of a series, updated with each value (Welford) and merged with
+    the ones of other series (Chan et al.).
+    '''
+
+    def __init__(self, n: int=0, mean: float=0., m2: float=0.):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        '''
+        Moments of the concatenation of the two series.
+        '''
+        n = self.n + other.n
+        if n == 0:
+            return RunningMoments()
+        delta = other.mean - self.mean
+        return RunningMoments(n,
+                              self.mean + delta * other.n / n,
+                              self.m2 + other.m2 + delta * delta * self.n * other.n / n)
+
+    def variance(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    def get_state(self) -> tuple:
+        return (self.n, self.mean, self.m2)
+
+
+def split_rhat(chains: list[list[tuple]]) -> float:
+    '''
+    Split R-hat (Gelman et al., Bayesian Data Analysis, Eq. 11.4) of a
+    statistic from the moments of consecutive blocks of values of each
+    chain (see RunningMoments.get_state). The first half of the blocks
+    that all the chains reported is discarded as warm-up, and the second
+    half of each chain is split in two sequences with the same number of
+    blocks. nan with less than four blocks per chain, or if the statistic
+    is constant within the sequences.
+    '''
+    num_blocks = min(len(blocks) for blocks in chains)
+    k = num_blocks // 4
+    if k == 0:
+        return np.nan
+    seqs = []
+    for blocks in chains:
+        blocks = [RunningMoments(*b) for b in blocks[num_blocks - 2 * k:num_blocks]]
+        for part in (blocks[:k], blocks[k:]):
+            seq = RunningMoments()
+            for b in part:
+                seq = seq.merge(b)
+            seqs.append(seq)
+    n = np.mean([seq.n for seq in seqs])
+    W = np.mean([seq.variance() for seq in seqs])
+    if not W > 0:
+        return np.nan
+    B = n * np.var([seq.mean for seq in seqs], ddof=1)
+    var_plus = (n - 1) / n * W + B / n
+    return float(np.sqrt(var_plus / W))
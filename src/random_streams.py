@@ -0,0 +1,113 @@
+import numpy as np
+
+
+# spawn key of the pilot chains, out of the range of the chain ids
+PILOT_KEY = 1 << 32
+
+
+def spawn_generators(seed: int, count: int) -> list[np.random.Generator]:
+    '''
+    Independent generators for count chains of the run with the given seed.
+    The i-th generator does not depend on count.
+    '''
+    return [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(count)]
+
+
+def chain_generator(seed: int, idx: int) -> np.random.Generator:
+    '''
+    Generator of the idx-th chain of the run with the given seed.
+    Same stream as spawn_generators(seed, count)[idx].
+    '''
+    return spawn_generators(seed, idx + 1)[idx]
+
+
+def pilot_generator(seed: int, idx: int) -> np.random.Generator:
+    '''
+    Generator of the idx-th pilot chain of the run with the given seed
+    (see tuning). Pilot chains never share a stream with the chains
+    of chain_generator.
+    '''
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PILOT_KEY, idx)))
+
+
+class RandomStream:
+    '''
+    Random draws of a Markov chain.
+    draw_block(rng, size) returns a tuple of arrays with the draws of
+    size consecutive steps. Blocks are drawn from rng when the previous
+    block is used up, so the draws do not depend on how they are read.
+    '''
+
+    def __init__(self,
+                 rng: np.random.Generator,
+                 draw_block,
+                 block_size: int=1 << 14):
+        self.rng = rng
+        self.draw_block = draw_block
+        self.block_size = block_size
+        self._block = ()
+        # state of rng before drawing the current block
+        self._block_state = None
+        # position of the next step in the current block
+        self._pos = block_size
+        self._rows = iter(())
+
+    def _refill(self):
+        self._block_state = self.rng.bit_generator.state
+        self._block = self.draw_block(self.rng, self.block_size)
+        self._pos = 0
+
+    def get_state(self) -> dict:
+        '''
+        Position of the stream, as a JSON-serializable dictionary:
+        state of rng before drawing the current block, and position
+        of the next step in the block.
+        '''
+        if self._block_state is None:
+            return {'rng': self.rng.bit_generator.state, 'pos': self._pos, 'block': False}
+        return {'rng': self._block_state, 'pos': self._pos, 'block': True}
+
+    def set_state(self, d: dict):
+        '''
+        Moves the stream to the position returned by get_state.
+        The current block is drawn again.
+        '''
+        self.rng.bit_generator.state = d['rng']
+        self._block = ()
+        self._block_state = None
+        self._pos = self.block_size
+        self._rows = iter(())
+        if d['block']:
+            self._refill()
+            self._pos = d['pos']
+
+    def next(self) -> tuple:
+        '''
+        Draws of the next step.
+        '''
+        try:
+            row = next(self._rows)
+        except StopIteration:
+            if self._pos == self.block_size:
+                self._refill()
+            self._rows = zip(*[col[self._pos:].tolist() for col in self._block])
+            row = next(self._rows)
+        self._pos += 1
+        return row
+
+    def take(self, size: int) -> tuple:
+        '''
+        Draws of the next size steps, as arrays.
+        '''
+        parts = []
+        while size > 0:
+            if self._pos == self.block_size:
+                self._refill()
+            k = min(size, self.block_size - self._pos)
+            parts.append([col[self._pos:self._pos + k] for col in self._block])
+            self._pos += k
+            size -= k
+        self._rows = iter(())
+        if len(parts) == 1:
+            return tuple(parts[0])
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
@@ -23,7 +23,8 @@ actual='False'
 # max number of concurrent threads
 num_workers=10
 
-# 0 = run sampling, 1 = run convergence, 2 = run label experiment
+# 0 = run sampling, 1 = run convergence, 2 = run label experiment,
+# 3 = run sampling sweep, 4 = run convergence sweep (single Python process)
 exper=0
 
 if [ "$exper" -eq 0 ]; then
@@ -53,3 +54,9 @@ if [ "$exper" -eq 2 ]; then
         python run_label_scalability.py --seed $seed --num_samples $S --label_list 2,4,8,11 --base_path ${base_path} --data_dir ${data_dir} --graph_name walmart-trips --num_workers ${num_workers} --algorithm $al
     done
 fi
+
+if [ "$exper" -eq 3 ] || [ "$exper" -eq 4 ]; then
+    echo "Running SWEEP for ${datasets[*]} and ${algos[*]}"
+    echo "---- `date`"
+    python run_sweep.py --exper $((exper - 3)) --seeds $seed --num_samples $S --base_path ${base_path} --data_dir ${data_dir} --datasets $(IFS=,; echo "${datasets[*]}") --algorithms $(IFS=,; echo "${algos[*]}") --num_workers ${num_workers} --actual_swaps $actual --perc $perc --D $D --mul_fact ${mul_fact}
+fi
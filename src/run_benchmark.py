@@ -0,0 +1,67 @@
+import sys
+import time
+import tracemalloc
+sys.path.insert(1,'../')
+import src.utils as ut # type: ignore
+import src.loaders as ld # type: ignore
+import src.random_streams as rs # type: ignore
+import src.MCMC_LA as la # type: ignore
+import src.MCMC_LW as lw # type: ignore
+import src.CM as cm # type: ignore
+
+
+def dict_state_nbytes(edges: list[tuple[int,int]]) -> int:
+    '''
+    Memory allocated by the dictionary of edge weights
+    and the list of edges used by the samplers before GraphState.
+    '''
+    tracemalloc.start()
+    A = dict()
+    ut.convert_edgelist_to_dictionary(edges, A)
+    edge_list = ut.copy_edge_list(edges)
+    nbytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del A, edge_list
+    return nbytes
+
+
+def benchmark_sampler(sampler, num_steps: int, seed: int=0, batch_size: int=0) -> float:
+    '''
+    Number of steps per second performed by sampler,
+    in batches of batch_size steps if batch_size is positive.
+    '''
+    stream = rs.RandomStream(rs.chain_generator(seed, 0), sampler.draw_block)
+    state = sampler.state.copy()
+    swapped = [-1, -1, -1, -1]
+    start = time.perf_counter()
+    if batch_size > 0:
+        for done in range(0, num_steps, batch_size):
+            sampler.MCMC_batch(state, stream, min(batch_size, num_steps - done))
+    else:
+        for _ in range(num_steps):
+            sampler.MCMC_step(state, stream, swapped)
+    return num_steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+
+    args = ld.read_arguments()
+
+    data_dir = f"{args['base_path']}/{args['data_dir']}"
+    graph_name = args['graph_name']
+    num_steps = args['num_swaps'] if args['num_swaps'] > 0 else 200000
+
+    edges, degrees, node_labels, _ = ld.load_dataset(data_dir, graph_name, args['cache'] == 'True')
+    m = len(edges)
+
+    print(f'{graph_name}: {m} edges')
+    print(f'dict state: {dict_state_nbytes(edges.tolist()) / m:.1f} bytes/edge')
+    for algo, cls in [('CM', cm.CM), ('LA', la.MCMC_LA), ('LW', lw.MCMC_LW)]:
+        sampler = cls(edges, degrees, node_labels)
+        if algo == 'CM':
+            print(f'array state: {sampler.state.nbytes() / m:.1f} bytes/edge')
+        rate = benchmark_sampler(sampler, num_steps, args['seed'])
+        print(f'{algo}: {rate:.0f} steps/s')
+        if args['batch_size'] > 0:
+            rate = benchmark_sampler(sampler, num_steps, args['seed'], args['batch_size'])
+            print(f'{algo} (batch_size={args["batch_size"]}): {rate:.0f} steps/s')
@@ -1,17 +1,24 @@
 import sys
 import json
 import os
+import queue
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
 from tqdm.contrib.concurrent import process_map
 sys.path.insert(1,'../')
 import src.loaders as ld # type: ignore
-import src.utils as ut # type: ignore
 import src.ConfigModel_MCMC as mcmc # type: ignore
 import src.MCMC_LA as la # type: ignore
 import src.MCMC_LW as lw # type: ignore
 import src.CM as cm # type: ignore
+import src.shared_state as ss # type: ignore
+import src.checkpoint as ck # type: ignore
+import src.online_stats as ost # type: ignore
 
 
-def save_data(ass_lst, time_lst, prob, stats, out_dir, out_base):
+def save_data(ass_lst, time_lst, prob, stats, out_dir, out_base, mixing=None, triangles=None):
     # array of arrays
     print('Saving Assortativity')
     with open(f'{out_dir}/assortativities__{out_base}', 'w') as out_f:
@@ -39,9 +46,85 @@ def save_data(ass_lst, time_lst, prob, stats, out_dir, out_base):
     with open(f'{out_dir}/stats__{out_base}', 'w') as out_f:
         for stats_dict in stats:
             out_f.write(json.dumps(stats_dict) + '\n')
+    if mixing is not None and mixing[0] is not None:
+        # one row per chain
+        print('Saving Node Mixing')
+        np.savez(f'{out_dir}/mixing__{out_base}.npz',
+                 num_samples=np.array([mix['num_samples'] for mix in mixing]),
+                 same_sum=np.stack([mix['same_sum'] for mix in mixing]),
+                 cross_sum=np.stack([mix['cross_sum'] for mix in mixing]),
+                 same_sq_sum=np.stack([mix['same_sq_sum'] for mix in mixing]))
+    if triangles is not None and triangles[0] is not None:
+        print('Saving Triangles')
+        with open(f'{out_dir}/triangles__{out_base}', 'w') as out_f:
+            # Chain Iteration Triangles Transitivity
+            for idx, data in enumerate(triangles):
+                for it, t, c in data:
+                    out_f.write(f'{idx}\t{it}\t{t}\t{c}\n')
     print('Finished.')
 
 
+def monitor_chains(reports, decisions, futures, num_swaps: int, threshold: float) -> dict:
+    '''
+    Collects the blocks reported by the chains (see progress_chain) and,
+    once every chain has reported a block, computes the split R-hat
+    (see online_stats.split_rhat) of each traced statistic on the blocks
+    reported so far. The chains stop if all the R-hats are below
+    threshold, and continue with the next block otherwise.
+
+    INPUT
+    ======
+    reports (Queue): blocks reported by the chains.
+    decisions (list): queue of the decisions of each chain.
+    futures (list): futures of the chains, to stop if a chain fails.
+    num_swaps (int): maximum number of steps of each chain.
+    threshold (float): R-hat below which the chains are stopped.
+
+    OUTPUT
+    ======
+    Dictionary with the threshold, whether the chains converged, the
+    number of steps at which they did (-1 otherwise), the number of
+    blocks, and the last R-hat of each statistic.
+    '''
+    D = len(decisions)
+    blocks = [[] for _ in range(D)]
+    info = {'R-hat Threshold': threshold, 'R-hat Converged': False, 'R-hat Converged At': -1}
+    bar = tqdm(total=num_swaps)
+    b = 0
+    while True:
+        while any(len(chain) <= b for chain in blocks):
+            try:
+                idx, last, counted, moments = reports.get(timeout=1)
+            except queue.Empty:
+                for fut in futures:
+                    if fut.done() and fut.exception() is not None:
+                        raise fut.exception()
+                continue
+            blocks[idx].append(moments)
+        # all the chains report the same number of steps in each block
+        bar.update(counted - bar.n)
+        rhat = {name: ost.split_rhat([[chain[k][name] for k in range(b + 1)] for chain in blocks])
+                for name in blocks[0][0]}
+        for name, value in rhat.items():
+            info[f'R-hat {name}'] = value
+        info['R-hat Blocks'] = b + 1
+        bar.set_postfix({'R-hat': max(rhat.values())})
+        # the chains that reach num_swaps do not wait for a decision
+        if last:
+            break
+        values = [value for value in rhat.values() if not np.isnan(value)]
+        stop = len(values) > 0 and max(values) < threshold
+        for decision in decisions:
+            decision.put(stop)
+        if stop:
+            info['R-hat Converged'] = True
+            info['R-hat Converged At'] = counted
+            break
+        b += 1
+    bar.close()
+    return info
+
+
 def run_convergence(edges: list[tuple[int,int]], 
                     degrees: dict[int, int], 
                     node_labels: dict[int, int],
@@ -50,7 +133,16 @@ def run_convergence(edges: list[tuple[int,int]],
                     max_workers: int=4,
                     mul_fact: float=2.,
                     algo: str='LA',
-                    seed: int=0):
+                    seed: int=0,
+                    checkpoint: dict=None,
+                    out_dir: str='.',
+                    graph_name: str='',
+                    node_mixing: bool=False,
+                    triangles: bool=False,
+                    keep_traces: bool=True,
+                    rhat_threshold: float=0.,
+                    rhat_block: int=10,
+                    time_every: int=1024):
         '''
         INPUT
         ======
@@ -63,6 +155,36 @@ def run_convergence(edges: list[tuple[int,int]],
         mul_fact (float): percentage of number of edges to use as number of swaps.
         algo (str): name of the sampler to use to move in the state space.
         seed (int): for reproducibility.
+        checkpoint (dict): if given, arguments of the Checkpointer of each
+                           chain ('every', 'seconds', and 'resume', see
+                           checkpoint.Checkpointer). With resume, the chains
+                           continue from their latest checkpoint, including
+                           the final one of a run with a smaller mul_fact.
+        out_dir (str): where the checkpoints are stored.
+        graph_name (str): name of the observed graph.
+        node_mixing (bool): if True, the same-label neighbors of each node
+                            are summed over the measurements of each chain
+                            (see progress_chain).
+        triangles (bool): if True, the triangles of each chain are
+                          tracked and recorded (see progress_chain).
+        keep_traces (bool): if False, the chains do not keep the values
+                            of their measurements, only their online
+                            estimators (see progress_chain).
+        rhat_threshold (float): if positive, the chains are stopped as soon
+                                as the split R-hat of all their traced
+                                statistics is below rhat_threshold (see
+                                monitor_chains), and mul_fact * num_edges
+                                is only their maximum length. The D chains
+                                run at the same time, whatever max_workers.
+                                Not supported with checkpoint.
+        rhat_block (int): with rhat_threshold, number of measurements of
+                          each chain between two computations of R-hat.
+        time_every (int): one step every time_every of each chain is timed
+                          (see progress_chain).
+
+        OUTPUT
+        ======
+        The measurements of each chain (see progress_chain).
         '''
         if algo == 'LA':
             sampler = la.MCMC_LA(edges, degrees, node_labels)
@@ -72,34 +194,60 @@ def run_convergence(edges: list[tuple[int,int]],
             sampler = cm.CM(edges, degrees, node_labels)
         else:
             sys.exit(f'{algo} not supported.')
+        adaptive = rhat_threshold > 0
+        if adaptive and checkpoint is not None:
+            raise ValueError('The chains cannot be checkpointed when they are stopped with R-hat.')
         denominator = sampler.r_denominator
         num_swaps = int(mul_fact * sampler.m)
-        SL = 0
-        for e in edges:
-            SL += 2 * degrees[e[0]] * degrees[e[1]]
+        SL = 2 * int((sampler.degrees[sampler.state.src] * sampler.degrees[sampler.state.dst]).sum())
         S1 = 2 * sampler.m
         S2 = sampler.S2
         numerator = S1 * SL - (S2**2)
         r_burn_in = float(numerator) / denominator
-        inputs = []
-        for idx in range(D):
-            row = [num_swaps,
-                   r_burn_in, # current degree assortativity
-                   denominator,
-                   max(int(sampler.m * perc), 1),
-                   seed,
-                   idx,
-                   sampler,
-                   algo]
-            inputs.append(row)
-        
-        outputs = process_map(mcmc.progress_chain, inputs, max_workers=max_workers)
+        # the checkpoints of a chain do not depend on its length
+        run_name = f'{graph_name}__method_{algo}__perc_{perc}__seed_{seed}'
+        # the workers attach to the sampler published once in shared memory
+        with ss.SharedSampler(sampler) as shared:
+            inputs = []
+            for idx in range(D):
+                row = [num_swaps,
+                       r_burn_in, # current degree assortativity
+                       denominator,
+                       max(int(sampler.m * perc), 1),
+                       seed,
+                       idx,
+                       shared,
+                       algo,
+                       ck.chain_checkpointer(checkpoint, out_dir, run_name, idx),
+                       node_mixing,
+                       triangles,
+                       keep_traces,
+                       None,
+                       time_every]
+                inputs.append(row)
+            
+            if not adaptive:
+                outputs = process_map(mcmc.progress_chain, inputs, max_workers=max_workers)
+            else:
+                # the chains wait for each other after each block
+                with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=D) as ex:
+                    reports = manager.Queue()
+                    decisions = [manager.Queue() for _ in range(D)]
+                    for idx, row in enumerate(inputs):
+                        row[12] = [reports, decisions[idx], rhat_block]
+                    futures = [ex.submit(mcmc.progress_chain, row) for row in inputs]
+                    info = monitor_chains(reports, decisions, futures, num_swaps, rhat_threshold)
+                    outputs = [fut.result() for fut in futures]
+                for out in outputs:
+                    out[3].update(info)
         
         ass_list = [[[0, r_burn_in]] + outputs[i][0] for i in range(D)]
         time_list = [outputs[i][1] for i in range(D)]
         prob_list = [outputs[i][2] for i in range(D)]
         stats_dict = [outputs[i][3] for i in range(D)]
-        return ass_list, time_list, prob_list, stats_dict
+        mixing_list = [outputs[i][4] for i in range(D)]
+        triangle_list = [outputs[i][5] for i in range(D)]
+        return ass_list, time_list, prob_list, stats_dict, mixing_list, triangle_list
     
 
 if __name__ == '__main__':
@@ -114,27 +262,33 @@ if __name__ == '__main__':
     mul_fact = args['mul_fact']
     perc = args['perc']
     D = args['D']
+    checkpoint = ck.checkpoint_options(args)
 
     data_dir = f'{base_path}/{data_dir}'
     out_dir = f'{base_path}/out'
     os.makedirs(out_dir, exist_ok=True)
     
-    file_path = f'{data_dir}/{graph_name}.tsv'
-    edges = ld.read_tsv_graph(file_path)
-    degrees = ut.compute_degree_sequence_from_list(edges)
-    
-    lab_path = f'{data_dir}/{graph_name}_labels.tsv'
-    node_labels, inner_outer_labels = ld.read_node_labels(lab_path, degrees.keys())
+    edges, degrees, node_labels, inner_outer_labels = ld.load_dataset(data_dir, graph_name,
+                                                                                    args['cache'] == 'True')
 
-    ass_lists, time_lists, prob_lists, stats_dicts = run_convergence(edges=edges,
-                                                                     degrees=degrees,  # type: ignore
-                                                                     node_labels=node_labels,
-                                                                     perc=perc, 
-                                                                     D=D, 
-                                                                     mul_fact=mul_fact, 
-                                                                     max_workers=min(D, args['num_workers']),
-                                                                     algo=sampl_name,
-                                                                     seed=base_seed)
+    ass_lists, time_lists, prob_lists, stats_dicts, mixing_lists, triangle_lists = run_convergence(edges=edges,
+                                                                                                   degrees=degrees,  # type: ignore
+                                                                                                   node_labels=node_labels,
+                                                                                                   perc=perc, 
+                                                                                                   D=D, 
+                                                                                                   mul_fact=mul_fact, 
+                                                                                                   max_workers=min(D, args['num_workers']),
+                                                                                                   algo=sampl_name,
+                                                                                                   seed=base_seed,
+                                                                                                   checkpoint=checkpoint,
+                                                                                                   out_dir=out_dir,
+                                                                                                   graph_name=graph_name,
+                                                                                                   node_mixing=args['node_mixing'] == 'True',
+                                                                                                   triangles=args['triangles'] == 'True',
+                                                                                                   keep_traces=args['keep_traces'] == 'True',
+                                                                                                   rhat_threshold=args['rhat'],
+                                                                                                   rhat_block=args['rhat_block'],
+                                                                                                   time_every=args['time_every'])
     # save data
     out_base = f'{graph_name}__method_{sampl_name}__mul_fact_{mul_fact}__D_{D}__perc_{perc}__seed_{base_seed}'
-    save_data(ass_lists, time_lists, prob_lists, stats_dicts, out_dir, out_base)
+    save_data(ass_lists, time_lists, prob_lists, stats_dicts, out_dir, out_base, mixing_lists, triangle_lists)
@@ -0,0 +1,206 @@
+import sys
+import os
+import numpy as np
+from tqdm.contrib.concurrent import process_map
+sys.path.insert(1,'../')
+import src.loaders as ld # type: ignore
+import src.graph_stats as gs # type: ignore
+import src.sample_store as sst # type: ignore
+import src.shared_state as ss # type: ignore
+from src.run_sweep import build_sampler # type: ignore
+
+
+# prefixes of the tables written next to the samples (statistics, evaluation)
+TABLE_PREFIXES = ('statistics', 'evaluation')
+
+
+def parse_sample_name(file_name: str) -> dict:
+    '''
+    Fields of the name of a file written by the sampling experiment
+    (e.g., <graph>__sampler_LA__swaps_10__runtime_0.5__seed_0__sample_3__actualswaps_False.tsv),
+    with the name of the graph as 'graph' and the extension as 'ext'.
+    '''
+    base, ext = os.path.splitext(file_name)
+    fields = base.split('__')
+    info = {'graph': fields[0], 'ext': ext}
+    for field in fields[1:]:
+        key, _, value = field.partition('_')
+        info[key] = value
+    return info
+
+
+def find_samples(out_dir: str,
+                 graph_name: str,
+                 sampler_name: str,
+                 seeds: list[int]=None) -> list[tuple[str, dict]]:
+    '''
+    Files with the samples of graph_name generated by sampler_name in
+    out_dir (TSV files and sample containers), with the fields of their
+    name (see parse_sample_name), optionally only for the given seeds.
+    The TSV files written before the samples had an id in their name
+    are included.
+    '''
+    samples = []
+    for file_name in sorted(os.listdir(out_dir)):
+        info = parse_sample_name(file_name)
+        if info['ext'] not in ('.tsv', '.samples'):
+            continue
+        if info['graph'] in TABLE_PREFIXES:
+            continue
+        if info['graph'] != graph_name or info.get('sampler') != sampler_name or 'seed' not in info:
+            continue
+        if seeds is not None and int(info['seed']) not in seeds:
+            continue
+        samples.append((f'{out_dir}/{file_name}', info))
+    return samples
+
+
+def evaluation_tasks(samples: list[tuple[str, dict]], chunk_size: int=16) -> list[list]:
+    '''
+    Chunks of at most chunk_size samples, as (path, id) pairs: id is the
+    id of the sample in a container, or None for a TSV file. The ids of a
+    container are kept in order, so that its deltas are decoded once.
+    '''
+    items = []
+    for path, info in samples:
+        if info['ext'] == '.tsv':
+            items.append((path, None))
+        else:
+            items += [(path, idx) for idx in sst.SampleStore(path).written().tolist()]
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def evaluate_samples(inp):
+    '''
+    Statistics of a chunk of samples (see evaluation_tasks).
+
+    INPUT
+    ======
+    sampler (object): sampler of the observed graph, or its SharedSampler.
+    statistics (list): names of the statistics, or functions (see graph_stats.get_statistics).
+    items (list): (path, id) pair of each sample.
+
+    OUTPUT
+    ======
+    rows (list): file, id (-1 for a TSV file without id in its name),
+                 and statistics of each sample.
+    '''
+    sampler = ss.get_sampler(inp[0])
+    statistics = gs.get_statistics(inp[1])
+    items = inp[2]
+
+    state = sampler.state.copy()
+    stores = dict()
+    rows = []
+    for path, idx in items:
+        if idx is None:
+            edges = ld.read_tsv_edges(path)
+        else:
+            if path not in stores:
+                stores[path] = sst.SampleStore(path)
+            edges = stores[path].read(idx)
+        if len(edges) != state.m:
+            raise ValueError(f'{path} has {len(edges)} edges instead of {state.m}.')
+        state.load_edges(edges[:, 0], edges[:, 1])
+        if idx is None:
+            sample = int(parse_sample_name(os.path.basename(path)).get('sample', -1))
+        else:
+            sample = idx
+        row = {'file': os.path.basename(path), 'sample': sample}
+        row.update(gs.evaluate(statistics, sampler, state))
+        rows.append(row)
+    return rows
+
+
+def z_scores(observed: dict, rows: list[dict]) -> list[dict]:
+    '''
+    Observed value, mean and standard deviation over the samples
+    (rows), and z-score of the observed value of each statistic.
+    The z-score is nan if the statistic is constant in the ensemble.
+    '''
+    table = []
+    for name, value in observed.items():
+        values = np.array([row[name] for row in rows], np.float64)
+        mean = values.mean() if len(values) else np.nan
+        std = values.std(ddof=1) if len(values) > 1 else np.nan
+        z = (value - mean) / std if std > 0 else np.nan
+        table.append({'statistic': name, 'observed': value, 'mean': float(mean),
+                      'std': float(std), 'z_score': float(z), 'num_samples': len(values)})
+    return table
+
+
+def run_evaluation(edges: list[tuple[int,int]],
+                   degrees: dict[int, int],
+                   node_labels: dict[int, int],
+                   out_dir: str,
+                   graph_name: str,
+                   algo: str='LA',
+                   statistics: list=None,
+                   seeds: list[int]=None,
+                   max_workers: int=4,
+                   chunk_size: int=16):
+    '''
+    Computes statistics on the observed graph and on the samples of
+    graph_name generated by algo in out_dir with a pool of workers.
+    The sampler of the observed graph is published once in shared
+    memory, and each worker loads its samples (TSV files or samples of
+    containers) in the slots of a copy of its state.
+
+    INPUT
+    ======
+    edges (list): list of edges in the original graph.
+    degrees (dict): degree of each node.
+    node_labels (dict): label of each node.
+    out_dir (str): directory with the samples.
+    graph_name (str): name of the observed graph.
+    algo (str): name of the sampler that generated the samples.
+    statistics (list): names of the statistics, or functions (see
+                       graph_stats.get_statistics). All the statistics
+                       of graph_stats if None.
+    seeds (list): if given, only the samples of these seeds are evaluated.
+    max_workers (int): max number of concurrent processes.
+    chunk_size (int): number of samples evaluated by each task.
+
+    OUTPUT
+    ======
+    table (list): observed value and z-score of each statistic (see z_scores).
+    rows (list): file, id, and statistics of each sample.
+    '''
+    if statistics is None:
+        statistics = list(gs.STATISTICS)
+    samples = find_samples(out_dir, graph_name, algo, seeds)
+    tasks = evaluation_tasks(samples, chunk_size)
+    sampler = build_sampler(algo, edges, degrees, node_labels)
+    observed = gs.evaluate(gs.get_statistics(statistics), sampler, sampler.state)
+    print(f'{graph_name} {algo}: {sum(len(task) for task in tasks)} samples in {len(samples)} files')
+    with ss.SharedSampler(sampler) as shared:
+        inputs = [[shared, statistics, task] for task in tasks]
+        outputs = process_map(evaluate_samples, inputs, max_workers=max_workers) if inputs else []
+    rows = [row for out in outputs for row in out]
+    return z_scores(observed, rows), rows
+
+
+if __name__ == '__main__':
+
+    args = ld.read_arguments()
+
+    base_path = args['base_path']
+    data_dir = f"{base_path}/{args['data_dir']}"
+    out_dir = f'{base_path}/out'
+    graph_name = args['graph_name']
+    algo = args['algorithm']
+    statistics = args['statistics'].split(',') if args['statistics'] is not None else None
+    seeds = [int(seed) for seed in args['seeds'].split(',')] if args['seeds'] is not None else None
+
+    edges, degrees, node_labels, _ = ld.load_dataset(data_dir, graph_name, args['cache'] == 'True')
+
+    table, rows = run_evaluation(edges=edges,
+                                 degrees=degrees,
+                                 node_labels=node_labels,
+                                 out_dir=out_dir,
+                                 graph_name=graph_name,
+                                 algo=algo,
+                                 statistics=statistics,
+                                 seeds=seeds,
+                                 max_workers=args['num_workers'])
+    gs.save_table(f'{out_dir}/evaluation__{graph_name}__sampler_{algo}.tsv', table)
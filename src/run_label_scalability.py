@@ -1,7 +1,6 @@
 import sys
 import os
 sys.path.insert(1,'../')
-import src.utils as ut # type: ignore
 import src.loaders as ld # type: ignore
 import src.ConfigModel_MCMC as mcmc # type: ignore
 import src.MCMC_LA as la # type: ignore
@@ -19,7 +18,8 @@ def run_sampler(edges: list[tuple[int,int]],
                 swaps: int,
                 algo: str, 
                 max_workers: int=10,
-                seed: int=0):
+                seed: int=0,
+                batch_size: int=0):
 
     if algo == 'LA':
         sampler = la.MCMC_LA(edges, degrees, node_labels)
@@ -30,7 +30,7 @@ def run_sampler(edges: list[tuple[int,int]],
     else:
         sys.exit(f'{algo} not supported.')
         
-    mcmc.get_graph_parallel_chains(sampler, out_dir, name, algo, num_graphs, swaps, max_workers, False, seed) 
+    mcmc.get_graph_parallel_chains(sampler, out_dir, name, algo, num_graphs, swaps, max_workers, False, seed, batch_size) 
     
 
 if __name__ == '__main__':
@@ -50,8 +50,7 @@ if __name__ == '__main__':
     os.makedirs(out_dir, exist_ok=True)
     
     file_path = f'{data_dir}/{graph_name}.tsv'
-    edges = ld.read_tsv_graph(file_path)
-    degrees = ut.compute_degree_sequence_from_list(edges)
+    edges = ld.load_edges(file_path, args['cache'] == 'True')
     
     if args['num_swaps'] < 0:
         swaps = int(len(edges) * np.log(len(edges)))    
@@ -60,7 +59,8 @@ if __name__ == '__main__':
     
     for num_lab in label_list:
         lab_path = f'{data_dir}/{graph_name}_{num_lab}_labels.tsv'
-        node_labels, inner_outer_labels = ld.read_node_labels(lab_path, degrees.keys())
+        node_labels, inner_outer_labels = ld.load_node_labels(lab_path, file_path, args['cache'] == 'True')
+        degrees = np.bincount(edges.ravel(), minlength=len(node_labels))
 
         run_sampler(edges=edges,
                     degrees=degrees, # type: ignore
@@ -71,4 +71,5 @@ if __name__ == '__main__':
                     swaps=swaps,
                     algo=sampl_name,
                     max_workers=min(num_graphs, args['num_workers']),
-                    seed=base_seed)
+                    seed=base_seed,
+                    batch_size=args['batch_size'])
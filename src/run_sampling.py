@@ -1,12 +1,13 @@
 import sys
 import os
 sys.path.insert(1,'../')
-import src.utils as ut # type: ignore
 import src.loaders as ld # type: ignore
 import src.ConfigModel_MCMC as mcmc # type: ignore
 import src.MCMC_LA as la # type: ignore
 import src.MCMC_LW as lw # type: ignore
 import src.CM as cm # type: ignore
+import src.tuning as tn # type: ignore
+import src.checkpoint as ck # type: ignore
 import numpy as np
 
 
@@ -20,7 +21,16 @@ def run_sampler(edges: list[tuple[int,int]],
                 graph_name: str,
                 max_workers: int=10,
                 actual_swaps: bool=False,
-                seed: int=0):
+                seed: int=0,
+                batch_size: int=0,
+                audit_every: int=-1,
+                num_chains: int=0,
+                spacing: int=-1,
+                tuning: dict=None,
+                codec: str=None,
+                encoding: str='full',
+                checkpoint: dict=None,
+                statistics: list=None):
     '''
     INPUT
     ======
@@ -36,6 +46,26 @@ def run_sampler(edges: list[tuple[int,int]],
     actual_swaps (bool): if True, an iteration is counted only if the
                          transition to the next state was accepted.
     seed (int): for reproducibility.
+    batch_size (int): number of steps performed together by the batched
+                      swap engine (0 to perform the steps one by one).
+    audit_every (int): how often the degree sequence and the JLM of each
+                       chain are checked (-1 to disable).
+    num_chains (int): if positive, the graphs are emitted by num_chains
+                      chains burned in once with swaps iterations.
+    spacing (int): iterations between two graphs emitted by the same chain.
+    tuning (dict): if given, the burn-in and the spacing of the sampler are
+                   found with pilot chains (see tuning.tune_sampler, which
+                   is called with these arguments) and used when swaps
+                   or spacing are negative.
+    codec (str): if given, the graphs are written to a single container
+                 compressed with codec (see sample_store).
+    encoding (str): how the graphs are stored in the container
+                    ('full', 'diff', or 'log').
+    checkpoint (dict): if given, the chains are checkpointed and resumed
+                       (see get_graph_parallel_chains).
+    statistics (list): if given, statistics computed on each graph and saved
+                       in a single table, instead of writing the graphs
+                       (see graph_stats.get_statistics).
     '''
     if algo == 'LA':
         sampler = la.MCMC_LA(edges, degrees, node_labels)
@@ -45,6 +75,33 @@ def run_sampler(edges: list[tuple[int,int]],
         sampler = cm.CM(edges, degrees, node_labels)
     else:
         sys.exit(f'{algo} not supported.')
+
+    if tuning is not None:
+        tuned = tn.tune_sampler(sampler, graph_name, algo,
+                                count_mode='accepted' if actual_swaps else 'valid',
+                                seed=seed, max_workers=max_workers,
+                                batch_size=batch_size, **tuning)
+        print(f"Burn-in {tuned['burn_in']}, spacing {tuned['spacing']}")
+        
+    if num_chains > 0:
+        mcmc.get_graph_thinned_chains(sampler,
+                                      out_dir,
+                                      graph_name,
+                                      algo,
+                                      num_graphs,
+                                      swaps,
+                                      spacing,
+                                      num_chains,
+                                      max_workers,
+                                      actual_swaps,
+                                      seed,
+                                      batch_size,
+                                      audit_every,
+                                      codec,
+                                      encoding,
+                                      checkpoint,
+                                      statistics)
+        return
         
     mcmc.get_graph_parallel_chains(sampler, 
                                    out_dir,
@@ -54,7 +111,13 @@ def run_sampler(edges: list[tuple[int,int]],
                                    swaps, 
                                    max_workers, 
                                    actual_swaps, 
-                                   seed) 
+                                   seed,
+                                   batch_size,
+                                   audit_every,
+                                   codec,
+                                   encoding,
+                                   checkpoint,
+                                   statistics)
     
 
 if __name__ == '__main__':
@@ -76,17 +139,26 @@ if __name__ == '__main__':
     out_dir = f'{base_path}/out'
     os.makedirs(out_dir, exist_ok=True)
     
-    file_path = f'{data_dir}/{graph_name}.tsv'
-    edges = ld.read_tsv_graph(file_path)
-    degrees = ut.compute_degree_sequence_from_list(edges)
+    edges, degrees, node_labels, inner_outer_labels = ld.load_dataset(data_dir, graph_name,
+                                                                      args['cache'] == 'True')
     
-    lab_path = f'{data_dir}/{graph_name}_labels.tsv'
-    node_labels, inner_outer_labels = ld.read_node_labels(lab_path, degrees.keys())
+    tuning = None
+    if args['auto_tune'] == 'True':
+        tuning = {'cache_dir': f'{out_dir}/tuning',
+                  'D': args['D'],
+                  'T': args['T'],
+                  'alpha': args['alpha'],
+                  'perc': args['perc'],
+                  'max_mul_fact': args['mul_fact'],
+                  'sources': [f'{data_dir}/{graph_name}.tsv', f'{data_dir}/{graph_name}_labels.tsv']}
     
-    if args['num_swaps'] < 0:
-        swaps = int(len(edges) * np.log(len(edges)))    
-    else:
+    if args['num_swaps'] >= 0:
         swaps = args['num_swaps']
+    elif tuning is not None:
+        # burn-in found by the pilot chains
+        swaps = -1
+    else:
+        swaps = int(len(edges) * np.log(len(edges)))
         
     run_sampler(edges=edges,
                 degrees=degrees, # type: ignore
@@ -96,6 +168,15 @@ if __name__ == '__main__':
                 algo=sampl_name,
                 out_dir=out_dir,
                 graph_name=graph_name,
-                max_workers=min(num_graphs, args['num_workers']),
+                max_workers=min(args['num_chains'] or num_graphs, args['num_workers']),
                 actual_swaps=actual,
-                seed=base_seed)
+                seed=base_seed,
+                batch_size=args['batch_size'],
+                audit_every=args['audit_every'],
+                num_chains=args['num_chains'],
+                spacing=args['spacing'],
+                tuning=tuning,
+                codec=args['codec'] if args['output'] == 'store' else None,
+                encoding=args['encoding'],
+                checkpoint=ck.checkpoint_options(args),
+                statistics=args['statistics'].split(',') if args['statistics'] is not None else None)
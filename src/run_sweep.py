@@ -0,0 +1,267 @@
+import sys
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+sys.path.insert(1,'../')
+import src.loaders as ld # type: ignore
+import src.ConfigModel_MCMC as mcmc # type: ignore
+import src.MCMC_LA as la # type: ignore
+import src.MCMC_LW as lw # type: ignore
+import src.CM as cm # type: ignore
+import src.random_streams as rs # type: ignore
+import src.shared_state as ss # type: ignore
+import src.graph_stats as gs # type: ignore
+import src.checkpoint as ck # type: ignore
+from src.run_convergence import save_data # type: ignore
+
+
+def build_sampler(algo: str,
+                  edges: list[tuple[int,int]],
+                  degrees: dict[int, int],
+                  node_labels: dict[int, int]):
+    if algo == 'LA':
+        return la.MCMC_LA(edges, degrees, node_labels)
+    if algo == 'LW':
+        return lw.MCMC_LW(edges, degrees, node_labels)
+    if algo == 'CM':
+        return cm.CM(edges, degrees, node_labels)
+    sys.exit(f'{algo} not supported.')
+
+
+def step_rate(sampler,
+              count_mode: str='valid',
+              batch_size: int=0,
+              num_steps: int=20000,
+              seed: int=0) -> float:
+    '''
+    Number of counted steps per second performed by sampler,
+    measured on a short chain.
+    '''
+    stream = rs.RandomStream(rs.pilot_generator(seed, 0), sampler.draw_block)
+    state = sampler.state.copy()
+    start = time.time()
+    sampler.step_many(state, stream, num_steps, count_mode=count_mode, batch_size=batch_size)
+    return num_steps / max(time.time() - start, 1e-9)
+
+
+def sampling_tasks(shared,
+                   sampler,
+                   algo: str,
+                   graph_name: str,
+                   out_dir: str,
+                   args: dict,
+                   seeds: list[int]) -> list:
+    '''
+    Tasks of the sampling experiment on one dataset with one sampler,
+    with their estimated cost (s). Same rows as get_graph_parallel_chains
+    and get_graph_thinned_chains. With statistics, the rows of a run
+    are grouped by its name.
+    '''
+    actual = args['actual_swaps'] == 'True'
+    count_mode = 'accepted' if actual else 'valid'
+    if args['num_swaps'] < 0:
+        swaps = int(sampler.m * np.log(sampler.m))
+    else:
+        swaps = args['num_swaps']
+    rate = step_rate(sampler, count_mode, args['batch_size'])
+    # writing a graph costs about as much as a step per edge
+    write = sampler.m / rate
+    num_graphs = args['num_samples']
+    codec = args['codec'] if args['output'] == 'store' else None
+    statistics = None
+    if args['statistics'] is not None:
+        statistics = gs.get_statistics(args['statistics'].split(','))
+        codec = None
+        write = 0
+    checkpoint = ck.checkpoint_options(args)
+    resume = checkpoint is not None and checkpoint['resume']
+    tasks = []
+    for seed in seeds:
+        if args['num_chains'] > 0:
+            spacing = args['spacing'] if args['spacing'] > 0 else sampler.m
+            num_chains = max(1, min(args['num_chains'], num_graphs))
+            store = None
+            if codec is not None:
+                store = mcmc.create_sample_store(sampler, out_dir, graph_name, algo, num_graphs,
+                                                 swaps, seed, actual, codec, args['encoding'],
+                                                 exist_ok=resume, num_chains=num_chains, spacing=spacing)
+            run_name = (f'{graph_name}__sampler_{algo}__swaps_{swaps}__seed_{seed}__actualswaps_{actual}'
+                        f'__num_chains_{num_chains}__spacing_{spacing}__count_{num_graphs}')
+            for j, ids in enumerate(np.array_split(np.arange(num_graphs), num_chains)):
+                row = [shared, seed, j, ids.tolist(), swaps, spacing, out_dir, graph_name,
+                       algo, actual, args['batch_size'], args['audit_every'], store,
+                       ck.chain_checkpointer(checkpoint, out_dir, run_name, j), statistics]
+                cost = (swaps + spacing * (len(ids) - 1)) / rate + len(ids) * write
+                tasks.append((cost, mcmc.sample_graphs_thinned, row, run_name if statistics else None))
+        else:
+            worker = mcmc.sample_graph_exact_swaps if actual else mcmc.sample_graph
+            store = None
+            if codec is not None:
+                store = mcmc.create_sample_store(sampler, out_dir, graph_name, algo, num_graphs,
+                                                 swaps, seed, actual, codec, args['encoding'],
+                                                 exist_ok=resume)
+            run_name = f'{graph_name}__sampler_{algo}__swaps_{swaps}__seed_{seed}__actualswaps_{actual}'
+            for i in range(num_graphs):
+                row = [shared, seed, i, swaps, out_dir, graph_name, algo,
+                       args['batch_size'], args['audit_every'], store,
+                       ck.chain_checkpointer(checkpoint, out_dir, run_name, i), statistics]
+                tasks.append((swaps / rate + write, worker, row, run_name if statistics else None))
+    return tasks
+
+
+def convergence_tasks(shared,
+                      sampler,
+                      algo: str,
+                      graph_name: str,
+                      out_dir: str,
+                      args: dict,
+                      seeds: list[int]) -> list:
+    '''
+    Tasks of the convergence experiment on one dataset with one sampler,
+    with their estimated cost (s). Same rows as run_convergence; the
+    chains of a seed are grouped by their key.
+    '''
+    num_swaps = int(args['mul_fact'] * sampler.m)
+    r_burn_in = gs.degree_assortativity(sampler, sampler.state)
+    # progress_chain times a sample of the steps, so they are performed one by one
+    rate = step_rate(sampler)
+    checkpoint = ck.checkpoint_options(args)
+    tasks = []
+    for seed in seeds:
+        key = (graph_name, algo, seed, r_burn_in)
+        run_name = f"{graph_name}__method_{algo}__perc_{args['perc']}__seed_{seed}"
+        for idx in range(args['D']):
+            row = [num_swaps,
+                   r_burn_in, # current degree assortativity
+                   sampler.r_denominator,
+                   max(int(sampler.m * args['perc']), 1),
+                   seed,
+                   idx,
+                   shared,
+                   algo,
+                   ck.chain_checkpointer(checkpoint, out_dir, run_name, idx),
+                   args['node_mixing'] == 'True',
+                   args['triangles'] == 'True',
+                   args['keep_traces'] == 'True',
+                   None,
+                   args['time_every']]
+            tasks.append((num_swaps / rate, mcmc.progress_chain, row, key))
+    return tasks
+
+
+def run_sweep(datasets: list[str],
+              algos: list[str],
+              seeds: list[int],
+              args: dict,
+              data_dir: str,
+              out_dir: str,
+              exper: int=0,
+              max_workers: int=10):
+    '''
+    Runs the sampling (exper = 0) or the convergence (exper = 1)
+    experiment for each dataset, sampler, and seed with one pool of
+    workers. Each dataset is loaded once and each sampler is published
+    once in shared memory (see shared_state). The tasks of all the
+    experiments are submitted longest first according to their
+    estimated cost (number of steps over the steps per second of the
+    sampler on the dataset, measured on a short chain), so that the
+    workers are busy until the end of the sweep.
+
+    INPUT
+    ======
+    datasets (list): names of the datasets (without extension).
+    algos (list): names of the samplers.
+    seeds (list): seeds of the runs.
+    args (dict): parameters of the experiments (see loaders.read_arguments).
+    data_dir (str): directory with the datasets.
+    out_dir (str): where the outputs are stored.
+    exper (int): 0 for the sampling experiment, 1 for the convergence one.
+    max_workers (int): number of concurrent processes.
+    '''
+    tasks = []
+    handles = []
+    for graph_name in datasets:
+        edges, degrees, node_labels, _ = ld.load_dataset(data_dir, graph_name, args['cache'] == 'True')
+        for algo in algos:
+            sampler = build_sampler(algo, edges, degrees, node_labels)
+            shared = ss.SharedSampler(sampler)
+            handles.append(shared)
+            if exper == 0:
+                tasks += sampling_tasks(shared, sampler, algo, graph_name, out_dir, args, seeds)
+            else:
+                tasks += convergence_tasks(shared, sampler, algo, graph_name, out_dir, args, seeds)
+            print(f'{graph_name} {algo}: {sampler.m} edges')
+        del edges, degrees, node_labels
+
+    # longest processing time first
+    tasks.sort(key=lambda task: -task[0])
+    outputs = dict()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            futures = {ex.submit(worker, row): (key, row) for _, worker, row, key in tasks}
+            for fut in tqdm(as_completed(futures), total=len(futures)):
+                key, row = futures[fut]
+                out = fut.result()
+                if key is not None:
+                    outputs.setdefault(key, []).append((row, out))
+    finally:
+        for shared in handles:
+            shared.close()
+
+    for key, results in outputs.items():
+        if isinstance(key, str):
+            # statistics of the graphs of a sampling run
+            rows = []
+            for _, out in results:
+                rows += out if isinstance(out, list) else [out]
+            mcmc.save_statistics(sorted(rows, key=lambda row: row['sample']), out_dir, key)
+            continue
+        graph_name, algo, seed, r_burn_in = key
+        # by chain id
+        chains = [out for _, out in sorted(results, key=lambda res: res[0][5])]
+        D = len(chains)
+        ass_list = [[[0, r_burn_in]] + out[0] for out in chains]
+        time_list = [out[1] for out in chains]
+        prob_list = [out[2] for out in chains]
+        stats_dict = [out[3] for out in chains]
+        mixing_list = [out[4] for out in chains]
+        triangle_list = [out[5] for out in chains]
+        out_base = f"{graph_name}__method_{algo}__mul_fact_{args['mul_fact']}__D_{D}__perc_{args['perc']}__seed_{seed}"
+        save_data(ass_list, time_list, prob_list, stats_dict, out_dir, out_base, mixing_list, triangle_list)
+
+
+if __name__ == '__main__':
+
+    args = ld.read_arguments()
+
+    base_path = args['base_path']
+    data_dir = f"{base_path}/{args['data_dir']}"
+    out_dir = f'{base_path}/out'
+    os.makedirs(out_dir, exist_ok=True)
+
+    if args['datasets'] is not None:
+        datasets = args['datasets'].split(',')
+    else:
+        datasets = [args['graph_name']]
+    if args['algorithms'] is not None:
+        algos = args['algorithms'].split(',')
+    else:
+        algos = [args['algorithm']]
+    if args['seeds'] is not None:
+        seeds = [int(seed) for seed in args['seeds'].split(',')]
+    else:
+        seeds = [args['seed']]
+    if args['exper'] == 1 and args['rhat'] > 0:
+        # the chains of a run would wait for each other in the shared pool
+        sys.exit('R-hat early stopping is not supported in the sweep, use run_convergence.py.')
+
+    run_sweep(datasets=datasets,
+              algos=algos,
+              seeds=seeds,
+              args=args,
+              data_dir=data_dir,
+              out_dir=out_dir,
+              exper=args['exper'],
+              max_workers=args['num_workers'])
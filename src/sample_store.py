@@ -0,0 +1,297 @@
+import numpy as np
+import fcntl
+import json
+import lzma
+import os
+import zlib
+
+
+# file layout: MAGIC, length of the header (uint64), JSON header,
+# index (one INDEX_DTYPE record per sample), original graph
+# (if the samples are encoded against it), and the encoded samples
+MAGIC = b'POLARIS-SAMPLES\x00'
+INDEX_DTYPE = np.dtype([('offset', '<u8'),
+                        ('nbytes', '<u8'),
+                        ('seed', '<i8'),
+                        ('chain', '<i8'),
+                        ('swaps', '<f8'),
+                        ('runtime', '<f8'),
+                        ('kind', '<i8'),
+                        ('parent', '<i8')])
+# how a sample is encoded (kind of its record): edges of all the slots,
+# slots that differ from the parent graph, or slots written since the
+# parent graph, in order. The parent is the sample with id parent,
+# or the original graph if parent is -1.
+FULL = 0
+DIFF = 1
+LOG = 2
+ENCODINGS = {'full': FULL, 'diff': DIFF, 'log': LOG}
+# fast presets: on sampled graphs, the default ones are 5 times
+# slower for 5% smaller samples
+CODECS = {'none': (bytes, bytes),
+          'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+          'lzma': (lambda data: lzma.compress(data, preset=0), lzma.decompress)}
+
+
+def create_store(file_path: str,
+                 num_samples: int,
+                 num_edges: int,
+                 codec: str='none',
+                 encoding: str='full',
+                 base: np.ndarray=None,
+                 **meta):
+    '''
+    Creates an empty container for num_samples multigraphs with
+    num_edges edges each.
+
+    INPUT
+    ======
+    file_path (str): path of the container.
+    num_samples (int): number of samples of the run.
+    num_edges (int): number of edges of each sample.
+    codec (str): compression of the samples ('none', 'zlib', or 'lzma').
+    encoding (str): 'full' to store all the edges of each sample, 'diff'
+                    to store the slots that differ from the parent graph,
+                    'log' to store the slots written by the chain since
+                    the parent graph. A sample is stored in full when its
+                    delta is not smaller.
+    base (np.ndarray): array of shape (m, 2) with the original graph,
+                       stored once if encoding is not 'full'.
+    meta: other information on the run stored in the header
+          (e.g., graph name, sampler name, actual_swaps).
+    '''
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}.')
+    if encoding not in ENCODINGS:
+        raise ValueError(f'Unknown encoding {encoding}.')
+    blob = b''
+    if encoding != 'full':
+        blob = CODECS[codec][0](np.ascontiguousarray(base, '<i4').tobytes())
+    header = dict(meta)
+    header.update({'num_samples': num_samples, 'num_edges': num_edges,
+                   'codec': codec, 'dtype': '<i4', 'encoding': encoding,
+                   'base_nbytes': len(blob)})
+    header = json.dumps(header).encode()
+    with open(file_path, 'wb') as out_f:
+        out_f.write(MAGIC)
+        out_f.write(np.uint64(len(header)).tobytes())
+        out_f.write(header)
+        out_f.write(np.zeros(num_samples, INDEX_DTYPE).tobytes())
+        out_f.write(blob)
+
+
+def read_header(in_f) -> tuple[dict, int]:
+    '''
+    Header of the container open in in_f and position of its index.
+    '''
+    in_f.seek(0)
+    if in_f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{in_f.name} is not a sample container.')
+    size = int(np.frombuffer(in_f.read(8), '<u8')[0])
+    header = json.loads(in_f.read(size))
+    return header, len(MAGIC) + 8 + size
+
+
+def store_encoding(file_path: str) -> str:
+    '''
+    Encoding of the samples of a container.
+    '''
+    with open(file_path, 'rb') as in_f:
+        return read_header(in_f)[0]['encoding']
+
+
+def log_limit(num_edges: int) -> int:
+    '''
+    Number of slot writes whose log is as large as a full sample.
+    '''
+    return 2 * num_edges // 3
+
+
+def encode_diff(src: np.ndarray,
+                dst: np.ndarray,
+                ref_src: np.ndarray,
+                ref_dst: np.ndarray) -> np.ndarray:
+    '''
+    Slots where (src, dst) differs from (ref_src, ref_dst): number of
+    changed sources and destinations, followed by the gaps between the
+    changed slots and their new value.
+    '''
+    parts = [np.zeros(2, '<i4')]
+    for k, (new, old) in enumerate(((src, ref_src), (dst, ref_dst))):
+        slots = np.flatnonzero(new != old)
+        parts[0][k] = len(slots)
+        # the gaps compress better than the slots
+        parts.append(np.diff(slots, prepend=0))
+        parts.append(new[slots])
+    return np.concatenate(parts).astype('<i4')
+
+
+def apply_diff(edges: np.ndarray, data: np.ndarray):
+    '''
+    Writes the slots encoded by encode_diff in edges.
+    '''
+    pos = 2
+    for k in range(2):
+        size = int(data[k])
+        slots = np.cumsum(data[pos:pos + size])
+        edges[slots, k] = data[pos + size:pos + 2 * size]
+        pos += 2 * size
+
+
+def apply_log(edges: np.ndarray, data: np.ndarray):
+    '''
+    Writes the slots of a log of (slot, source, destination) triples
+    (see graph_state.SlotLog) in edges.
+    '''
+    writes = data.reshape(-1, 3)[::-1]
+    # only the last write of each slot matters
+    _, last = np.unique(writes[:, 0], return_index=True)
+    writes = writes[last]
+    edges[writes[:, 0]] = writes[:, 1:]
+
+
+def write_sample(file_path: str,
+                 idx: int,
+                 src: np.ndarray,
+                 dst: np.ndarray,
+                 seed: int,
+                 swaps: float,
+                 runtime: float,
+                 chain: int=-1,
+                 parent: int=-1,
+                 ref: tuple=None,
+                 log=None):
+    '''
+    Writes the multigraph with edges (src[i], dst[i]) as sample idx
+    of the container. Several processes can write to the same container:
+    the sample is appended under an exclusive lock, and its record
+    of the index is filled in.
+
+    INPUT
+    ======
+    parent (int): id of the parent graph of the sample, -1 for the
+                  original graph.
+    ref (tuple): src and dst of the parent graph, for the 'diff' encoding.
+    log (SlotLog): writes since the parent graph, for the 'log' encoding.
+    '''
+    with open(file_path, 'r+b') as out_f:
+        header, index_pos = read_header(out_f)
+        kind = FULL
+        data = None
+        if header['encoding'] == 'diff' and ref is not None:
+            kind = DIFF
+            data = encode_diff(src, dst, ref[0], ref[1])
+        elif header['encoding'] == 'log' and log is not None and not log.full:
+            kind = LOG
+            data = log.writes().astype('<i4')
+        if data is None or data.nbytes >= 8 * len(src):
+            kind = FULL
+            data = np.empty((len(src), 2), '<i4')
+            data[:, 0] = src
+            data[:, 1] = dst
+        blob = CODECS[header['codec']][0](data.tobytes())
+        record = np.zeros(1, INDEX_DTYPE)
+        record['nbytes'] = len(blob)
+        record['seed'] = seed
+        record['chain'] = chain
+        record['swaps'] = swaps
+        record['runtime'] = runtime
+        record['kind'] = kind
+        record['parent'] = parent
+        fcntl.flock(out_f, fcntl.LOCK_EX)
+        try:
+            record['offset'] = out_f.seek(0, os.SEEK_END)
+            out_f.write(blob)
+            out_f.seek(index_pos + idx * INDEX_DTYPE.itemsize)
+            out_f.write(record.tobytes())
+            out_f.flush()
+        finally:
+            fcntl.flock(out_f, fcntl.LOCK_UN)
+
+
+class SampleStore:
+    '''
+    Reader of a sample container. The header and the index are read
+    when it is opened; each sample is read and decoded only when it is
+    requested, so samples can be read in any order. A delta-encoded
+    sample is rebuilt from its parents; the last sample read is kept,
+    so reading the samples of a chain in order decodes each delta once.
+    '''
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, 'rb') as in_f:
+            self.header, index_pos = read_header(in_f)
+            in_f.seek(index_pos)
+            self.index = np.frombuffer(in_f.read(self.header['num_samples'] * INDEX_DTYPE.itemsize),
+                                       INDEX_DTYPE)
+        self.base_offset = index_pos + len(self.index) * INDEX_DTYPE.itemsize
+        self._base = None
+        self._last = (None, None)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def written(self) -> np.ndarray:
+        '''
+        Ids of the samples written to the container.
+        '''
+        return np.flatnonzero(self.index['offset'] > 0)
+
+    def _decode(self, offset: int, nbytes: int) -> np.ndarray:
+        with open(self.file_path, 'rb') as in_f:
+            in_f.seek(offset)
+            blob = in_f.read(nbytes)
+        data = CODECS[self.header['codec']][1](blob)
+        return np.frombuffer(data, self.header['dtype'])
+
+    def base(self) -> np.ndarray:
+        '''
+        Array of shape (m, 2) with the original graph
+        (only for delta-encoded containers).
+        '''
+        if self._base is None:
+            if self.header['encoding'] == 'full':
+                raise KeyError('The original graph is stored only by delta encodings.')
+            self._base = self._decode(self.base_offset, self.header['base_nbytes']).reshape(-1, 2)
+        return self._base
+
+    def read(self, idx: int) -> np.ndarray:
+        '''
+        Array of shape (m, 2) with the edges of sample idx.
+        '''
+        # deltas from the closest full graph
+        deltas = []
+        i = idx
+        while True:
+            if i == self._last[0]:
+                edges = self._last[1]
+                break
+            if i < 0:
+                edges = self.base()
+                break
+            record = self.index[i]
+            if record['offset'] == 0:
+                raise KeyError(f'Sample {i} was not written.')
+            if record['kind'] == FULL:
+                edges = self._decode(int(record['offset']), int(record['nbytes'])).reshape(-1, 2)
+                break
+            deltas.append(record)
+            i = int(record['parent'])
+        if deltas:
+            edges = edges.copy()
+            for record in reversed(deltas):
+                data = self._decode(int(record['offset']), int(record['nbytes']))
+                if record['kind'] == DIFF:
+                    apply_diff(edges, data)
+                else:
+                    apply_log(edges, data)
+            edges.flags.writeable = False
+        self._last = (idx, edges)
+        return edges
+
+    def edge_list(self, idx: int) -> list[tuple[int, int]]:
+        '''
+        Sample idx as a list of edges, as written by dump_edge_list.
+        '''
+        return [tuple(edge) for edge in self.read(idx).tolist()]
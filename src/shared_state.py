@@ -0,0 +1,123 @@
+import numpy as np
+import io
+import pickle
+from multiprocessing import shared_memory
+
+
+# samplers attached by this process, by name of the shared memory block
+_attached = dict()
+
+
+class _ArrayPickler(pickle.Pickler):
+    '''
+    Pickles an object replacing its arrays with their index in arrays.
+    '''
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = []
+        self.ids = dict()
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray or obj.dtype.hasobject:
+            return None
+        key = id(obj)
+        if key not in self.ids:
+            self.ids[key] = len(self.arrays)
+            self.arrays.append(obj)
+        return self.ids[key]
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    '''
+    Unpickles an object pickled by _ArrayPickler with the given arrays.
+    '''
+
+    def __init__(self, file, arrays):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        return self.arrays[pid]
+
+
+class SharedSampler:
+    '''
+    Sampler published once in shared memory.
+    The arrays of the sampler (edge slots, hash table, label index, ...)
+    are copied in a single shared memory block, and the handle pickles
+    only their layout and the scalar attributes. A worker attaches to
+    the block the first time it reads the handle, and all the tasks it
+    runs get the same sampler, whose arrays are read-only views of the
+    block. The state of a chain must be copied (state.copy()) before
+    changing it.
+    Use as a context manager: the block is released on exit.
+    '''
+
+    def __init__(self, sampler):
+        buf = io.BytesIO()
+        pickler = _ArrayPickler(buf)
+        pickler.dump(sampler)
+        self.payload = buf.getvalue()
+        self.layout = []
+        offset = 0
+        for arr in pickler.arrays:
+            # 64-byte aligned arrays
+            offset = (offset + 63) // 64 * 64
+            self.layout.append((offset, arr.dtype.str, arr.shape))
+            offset += arr.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self.shm.name
+        for arr, (offset, dtype, shape) in zip(pickler.arrays, self.layout):
+            np.ndarray(shape, dtype, self.shm.buf, offset)[...] = arr
+        _attached[self.name] = (self.shm, sampler)
+
+    def __getstate__(self):
+        return {'name': self.name, 'layout': self.layout, 'payload': self.payload}
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Releases the shared memory block. Called by the publisher
+        when the workers are done.
+        '''
+        _attached.pop(self.name, None)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def get(self):
+        '''
+        Sampler of the handle, attached once per process.
+        '''
+        if self.name not in _attached:
+            # workers share the resource tracker of the publisher,
+            # which unlinks the block
+            shm = shared_memory.SharedMemory(name=self.name)
+            arrays = []
+            for offset, dtype, shape in self.layout:
+                arr = np.ndarray(shape, dtype, shm.buf, offset)
+                arr.flags.writeable = False
+                arrays.append(arr)
+            sampler = _ArrayUnpickler(io.BytesIO(self.payload), arrays).load()
+            _attached[self.name] = (shm, sampler)
+        return _attached[self.name][1]
+
+
+def get_sampler(sampler):
+    '''
+    Sampler of a SharedSampler handle, or sampler itself.
+    '''
+    if isinstance(sampler, SharedSampler):
+        return sampler.get()
+    return sampler
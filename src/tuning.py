@@ -0,0 +1,204 @@
+import numpy as np
+import json
+import os
+from scipy import stats
+from tqdm.contrib.concurrent import process_map
+import sys
+sys.path.insert(1,'../')
+import src.utils as ut # type: ignore
+import src.loaders as ld # type: ignore
+import src.random_streams as rs # type: ignore
+import src.shared_state as ss # type: ignore
+import src.graph_stats as gs # type: ignore
+
+
+def pilot_chain(inp):
+    '''
+    Runs a pilot chain from the observed graph and records the
+    degree assortativity of the states it visits.
+
+    INPUT
+    ======
+    sampler (object): sampler to use to move in the state space, or its SharedSampler.
+    seed (int): for reproducibility.
+    idx (int): id of the pilot chain.
+    num_swaps (int): number of steps to perform.
+    increment (int): the degree assortativity is recorded every increment steps.
+    count_mode (str): how the steps are counted (see chain_loop.step_many).
+    batch_size (int): number of steps performed with each call to MCMC_batch.
+
+    OUTPUT
+    ======
+    Degree assortativity of the observed graph and after each increment steps.
+    '''
+    sampler = ss.get_sampler(inp[0])
+    seed = inp[1]
+    idx = inp[2]
+    num_swaps = inp[3]
+    increment = inp[4]
+    count_mode = inp[5]
+    batch_size = inp[6]
+
+    stream = rs.RandomStream(rs.pilot_generator(seed, idx), sampler.draw_block)
+    state = sampler.state.copy()
+    series = [gs.degree_assortativity(sampler, state)]
+    for _ in range(num_swaps // increment):
+        counters = sampler.step_many(state, stream, increment, count_mode=count_mode,
+                                     batch_size=batch_size)
+        series.append(series[-1] + counters['delta_r'])
+    return series
+
+
+def find_burn_in(series: np.ndarray, z: float=2.) -> int:
+    '''
+    series (np.ndarray): array of shape (D, A) with the degree assortativity
+                         of D chains recorded at A equally spaced steps.
+    z (float): width of the stationary band in standard errors.
+
+    OUTPUT
+    ======
+    Index of the first recorded step at which the mean of the chains
+    is within z standard errors of the stationary mean, estimated on
+    the second half of the chains.
+    '''
+    D, A = series.shape
+    tail = series[:, A // 2:]
+    mu = tail.mean()
+    band = z * max(tail.std(), 1e-12) / np.sqrt(D)
+    inside = np.abs(series.mean(0) - mu) <= band
+    return int(np.argmax(inside)) if inside.any() else A
+
+
+def find_spacing(series: np.ndarray,
+                 T: int,
+                 alpha: float) -> int:
+    '''
+    Smallest sampling gap (in recorded steps) such that the lag-1
+    autocorrelation test of check_autocorrelation_lag1 is significant
+    in no more chains than expected by chance, i.e., the (1 - alpha)
+    quantile of Binomial(D, alpha).
+
+    INPUT
+    ======
+    series (np.ndarray): array of shape (D, A) with the degree assortativity
+                         of D chains recorded at A equally spaced steps.
+    T (int): number of draws from each chain used by the test.
+    alpha (float): significance level.
+
+    OUTPUT
+    ======
+    Sampling gap, or -1 if the chains are too short to find it.
+    '''
+    D, A = series.shape
+    max_sig = stats.binom.ppf(1 - alpha, D, alpha)
+    # all the gaps at once
+    passed = np.flatnonzero(ut.sig_autocorrelations_by_gap(series, T, alpha) <= max_sig)
+    return int(passed[0]) + 1 if len(passed) else -1
+
+
+def cache_path(cache_dir: str, graph_name: str, samp_name: str, count_mode: str) -> str:
+    return f'{cache_dir}/tuning__{graph_name}__sampler_{samp_name}__count_{count_mode}.json'
+
+
+def tune_sampler(sampler,
+                 graph_name: str,
+                 samp_name: str,
+                 cache_dir: str,
+                 D: int=10,
+                 T: int=50,
+                 alpha: float=.05,
+                 perc: float=.05,
+                 max_mul_fact: float=100.,
+                 count_mode: str='valid',
+                 seed: int=0,
+                 max_workers: int=4,
+                 batch_size: int=0,
+                 sources: list[str]=None) -> dict:
+    '''
+    Runs D pilot chains from the observed graph and finds the burn-in and
+    the smallest sampling gap that passes the lag-1 autocorrelation test
+    (Algorithm 2 Dutta et al.) on the degree assortativity.
+    The pilot chains are made longer until the burn-in takes at most half of
+    them and the gap is found, or they reach max_mul_fact * num_edges steps.
+    Results are stored in sampler.burn_in and sampler.spacing, and cached
+    in cache_dir for the next runs on the same dataset with the same
+    parameters (including the files of the dataset, see loaders.source_key).
+
+    INPUT
+    ======
+    sampler (object): sampler to tune.
+    graph_name (str): name of the observed graph.
+    samp_name (str): name of the sampler.
+    cache_dir (str): directory of the cache files.
+    D (int): number of pilot chains.
+    T (int): number of draws from each chain used by the test.
+    alpha (float): significance level.
+    perc (float): the candidate gaps are multiples of perc * num_edges steps.
+    max_mul_fact (float): maximum length of the pilot chains, in multiples
+                          of the number of edges.
+    count_mode (str): how the steps are counted (see chain_loop.step_many).
+    seed (int): for reproducibility.
+    max_workers (int): max number of concurrent processes.
+    batch_size (int): number of steps performed with each call to MCMC_batch.
+    sources (list): paths of the files of the dataset (edges and labels).
+                    The cache is rebuilt if any of them changes.
+
+    OUTPUT
+    ======
+    Dictionary with the burn-in, the spacing, and the parameters of the test.
+    '''
+    increment = max(int(sampler.m * perc), 1)
+    params = {'num_edges': sampler.m, 'D': D, 'T': T, 'alpha': alpha,
+              'increment': increment, 'seed': seed, 'max_mul_fact': max_mul_fact,
+              'sources': ld.source_key(sources) if sources is not None else None}
+    fpath = cache_path(cache_dir, graph_name, samp_name, count_mode)
+    if os.path.exists(fpath):
+        with open(fpath) as in_f:
+            tuned = json.load(in_f)
+        if all(tuned.get(k) == v for k, v in params.items()):
+            sampler.burn_in = tuned['burn_in']
+            sampler.spacing = tuned['spacing']
+            sampler.has_converged = tuned['converged']
+            return tuned
+
+    max_swaps = max(int(max_mul_fact * sampler.m), 2 * T * increment)
+    # enough recorded steps to test the smallest gap after a short burn-in
+    num_swaps = min(2 * T * increment, max_swaps)
+    with ss.SharedSampler(sampler) as shared:
+        while True:
+            inputs = [[shared, seed, idx, num_swaps, increment, count_mode, batch_size]
+                      for idx in range(D)]
+            series = np.array(process_map(pilot_chain, inputs, max_workers=max_workers))
+            start = find_burn_in(series)
+            step = -1
+            if start <= series.shape[1] // 2:
+                step = find_spacing(series[:, start:], T, alpha)
+            if step > 0 or num_swaps >= max_swaps:
+                break
+            num_swaps = min(2 * num_swaps, max_swaps)
+
+    converged = step > 0
+    if not converged:
+        # the longest gap the pilot chains can test
+        step = max((series.shape[1] - start - 1) // (T - 1), 1)
+        print(f'Gap not found in {num_swaps} steps, using the longest gap tested.')
+    # a chain is burned in for at least one gap
+    spacing = step * increment
+    burn_in = max(start * increment, spacing)
+
+    tuned = dict(params)
+    tuned['burn_in'] = burn_in
+    tuned['spacing'] = spacing
+    tuned['converged'] = converged
+    tuned['pilot_swaps'] = num_swaps
+    # mean autocorrelation function of the pilot chains after the burn-in,
+    # at lags 0, ..., T recorded steps, for diagnostics
+    acf = ut.autocorrelation_fft(series[:, start:], min(T, series.shape[1] - start - 1))
+    tuned['acf'] = np.round(acf.mean(axis=0), 6).tolist()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(fpath, 'w') as out_f:
+        json.dump(tuned, out_f)
+    sampler.burn_in = burn_in
+    sampler.spacing = spacing
+    sampler.has_converged = converged
+    return tuned
@@ -1,9 +1,13 @@
 import numpy as np
+import sys
 from collections import defaultdict
 import math
+import warnings
 from scipy import stats
-from tqdm.contrib.concurrent import process_map
+from scipy import fft
 # from orderedstructs import SkipList
+sys.path.insert(1,'../')
+from src.assortativity import joint_label_matrix # type: ignore
 
 
 def check_degree_sequences(deg1, deg2):
@@ -33,14 +37,9 @@ def compute_JLM_from_list(edges: list[tuple[int, int]],
     computes the JLM of the corresponding multigraph.
     '''
     num_labels = len(set(node_labels.values()))
-    jlm = np.zeros((num_labels, num_labels), np.int32)
-    for e in edges:
-        l1 = node_labels[e[0]]
-        l2 = node_labels[e[1]]
-        jlm[l1][l2] += 1
-        if l1 != l2:
-            jlm[l2][l1] += 1
-    return jlm
+    edges = np.asarray(edges, np.int64).reshape(-1, 2)
+    lab = label_array(node_labels)
+    return joint_label_matrix(edges[:, 0], edges[:, 1], lab, num_labels).astype(np.int32)
 
 
 def compute_JLM_from_A(A: dict[tuple[int, int], int], 
@@ -50,18 +49,22 @@ def compute_JLM_from_A(A: dict[tuple[int, int], int],
     computes the JLM of the corresponding multigraph.
     '''
     num_labels = len(set(node_labels.values()))
-    jlm = np.zeros((num_labels, num_labels), np.int32)
-    for e in A:
-        if e[0] <= e[1]:
-            l1 = node_labels[e[0]]
-            l2 = node_labels[e[1]]
-            if e[0] != e[1]:
-                jlm[l1][l2] += A[e]
-            if e[0] == e[1]:
-                jlm[l1][l2] += (A[e] / 2)
-            if l1 != l2:
-                jlm[l2][l1] += A[e]
-    return jlm
+    pairs = np.array([e for e in A if e[0] <= e[1]], np.int64).reshape(-1, 2)
+    weights = np.array([A[e] for e in A if e[0] <= e[1]], np.int64)
+    # a self-loop contributes 2 to its entry
+    weights = np.where(pairs[:, 0] == pairs[:, 1], weights // 2, weights)
+    lab = label_array(node_labels)
+    return joint_label_matrix(pairs[:, 0], pairs[:, 1], lab, num_labels, weights).astype(np.int32)
+
+
+def label_array(node_labels: dict[int, int]) -> np.ndarray:
+    '''
+    Given the label of each node,
+    returns the array of labels indexed by node id.
+    '''
+    lab = np.zeros(max(node_labels) + 1 if node_labels else 0, np.int64)
+    lab[list(node_labels.keys())] = list(node_labels.values())
+    return lab
 
 
 def compute_degree_sequence_from_A(A: dict[tuple[int, int], int]):
@@ -197,42 +200,87 @@ def check_autocorrelation_lag1(inp):
     '''
     series = inp[0]
     alpha = inp[1]
-    n = len(series)
-    data = np.asarray(series, dtype=np.float64)
-    xbar = np.mean(data)
-    c0 = np.sum((data - xbar) ** 2)
-    
-    def standard_autocorrelations(h):
-        # line 2 Algorithm 2 Dutta et al.
-        corr = ((data[: n - h] - xbar) * (data[h:] - xbar)).sum() / c0
-        # Eq. 4 Dutta et al.
-        mean = -(n - h) / (n * (n - 1))
-        # numerator Eq. 5 Dutta et al.
-        var = n**4 - (h + 3) * n**3 + 3 * h * n**2
-        var += 2 * h * (h + 1) * n - 4 * h**2
-        # denominator Eq. 5 Dutta et al.
-        var /= ((n + 1) * n**2 * (n - 1)**2)
-        # sigma
-        SE = math.sqrt(var)
-        # line 5 Algorithm 2 Dutta et al.
-        standard_corr = (corr - mean) / SE
-        return standard_corr
-
     # h = lag = 1
-    y = standard_autocorrelations(1)
+    y = standard_autocorrelations(np.asarray(series, dtype=np.float64), 1)
     # One-sided test
     z_critical = stats.norm.ppf(1 - alpha)
-    # print('y', y, 'z_critical', z_critical)
     if y > z_critical:
         return 1
     return 0
 
 
+def standard_autocorrelations(data: np.ndarray, h: int=1) -> np.ndarray:
+    '''
+    Standardized lag-h autocorrelation of each series in the last axis
+    of data (lines 2-5 Algorithm 2 Dutta et al.). Constant series give nan.
+    '''
+    n = data.shape[-1]
+    centered = data - data.mean(axis=-1, keepdims=True)
+    c0 = (centered ** 2).sum(axis=-1)
+    # line 2 Algorithm 2 Dutta et al.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (centered[..., : n - h] * centered[..., h:]).sum(axis=-1) / c0
+    # Eq. 4 Dutta et al.
+    mean = -(n - h) / (n * (n - 1))
+    # numerator Eq. 5 Dutta et al.
+    var = n**4 - (h + 3) * n**3 + 3 * h * n**2
+    var += 2 * h * (h + 1) * n - 4 * h**2
+    # denominator Eq. 5 Dutta et al.
+    var /= ((n + 1) * n**2 * (n - 1)**2)
+    # line 5 Algorithm 2 Dutta et al.
+    return (corr - mean) / math.sqrt(var)
+
+
+def sig_autocorrelations_by_gap(series: np.ndarray,
+                                T: int,
+                                alpha: float) -> np.ndarray:
+    '''
+    Number of chains whose lag-1 autocorrelation test
+    (check_autocorrelation_lag1) is significant, for each gap.
+
+    INPUT
+    ======
+    series (np.ndarray): array of shape (D, A) with the degree assortativity
+                         of D chains recorded at A equally spaced steps.
+    T (int): number of draws from each chain used by the test.
+    alpha (float): significance level.
+
+    OUTPUT
+    ======
+    Array whose element g - 1 is the number of significant tests with
+    the draws T taken every g recorded steps, for each gap g such that
+    the chains are long enough.
+    '''
+    series = np.asarray(series, dtype=np.float64)
+    gaps = np.arange(1, (series.shape[1] - 1) // (T - 1) + 1)
+    # draws of every chain with every gap, shape (D, len(gaps), T)
+    draws = series[:, gaps[:, None] * np.arange(T)]
+    y = standard_autocorrelations(draws, 1)
+    # One-sided test
+    return (y > stats.norm.ppf(1 - alpha)).sum(axis=0)
+
+
+def autocorrelation_fft(series: np.ndarray, max_lag: int=None) -> np.ndarray:
+    '''
+    Autocorrelation function of each series in the last axis of series
+    at lags 0, ..., max_lag (all lags if None), with the estimator of
+    line 2 Algorithm 2 Dutta et al., computed with one FFT.
+    '''
+    series = np.asarray(series, dtype=np.float64)
+    n = series.shape[-1]
+    if max_lag is None:
+        max_lag = n - 1
+    centered = series - series.mean(axis=-1, keepdims=True)
+    # zero padding to 2n avoids the circular correlation
+    size = fft.next_fast_len(2 * n)
+    f = fft.rfft(centered, size, axis=-1)
+    acov = fft.irfft(f * np.conj(f), size, axis=-1)[..., : max_lag + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return acov / acov[..., :1]
+
+
 def get_num_sig_autocorrelations(r_datapoints, alpha):
-    sig = 0
-    for data in r_datapoints:
-        sig += check_autocorrelation_lag1([data, alpha])
-    return sig
+    return int(sig_autocorrelations_by_gap(np.asarray(r_datapoints), len(r_datapoints[0]), alpha)[0])
 
 
 def get_num_sig_autocorrelations_parallel(T: int,
@@ -240,7 +288,7 @@ def get_num_sig_autocorrelations_parallel(T: int,
                                           gap: int,
                                           increment: int,
                                           alpha: float,
-                                          max_workers: int=4) -> int:
+                                          max_workers: int=None) -> int:
     '''
     T (int): number of independent draws from each Markov chain.
     
@@ -250,14 +298,10 @@ def get_num_sig_autocorrelations_parallel(T: int,
     increment (int): the candidate sampling gap is incremented by increment until the test for 
                      significant lag-1 autocorrelation succeeds.
     alpha (float): significance level.
-    max_workers (int): maximum number of parallel computations.
+    max_workers (int): deprecated and ignored, the tests of all the chains are vectorized.
     '''
-    inputs = []
+    if max_workers is not None:
+        warnings.warn('max_workers is deprecated and ignored.', DeprecationWarning, stacklevel=2)
     step = gap // increment
-    print('gap', gap, 'increment', increment)
-    for data in r_datapoints:
-        S_T = [data[i * step] for i in range(T)]
-        inputs.append([S_T, alpha])
-    output = process_map(check_autocorrelation_lag1, inputs, max_workers=max_workers)
-    sig = np.sum(output)
-    return sig
+    draws = np.asarray(r_datapoints, dtype=np.float64)[:, : (T - 1) * step + 1 : step]
+    return int(sig_autocorrelations_by_gap(draws, T, alpha)[0])
@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.utils as ut # type: ignore
+import src.run_evaluation as rev # type: ignore
+from src.run_sweep import build_sampler # type: ignore
+
+
+EDGES = [(0, 1), (1, 2), (2, 0), (0, 3), (3, 4), (4, 1)]
+LABELS = {0: 0, 1: 1, 2: 0, 3: 1, 4: 0}
+# names written before and after the samples had an id
+LEGACY = 'toy__sampler_CM__swaps_10__runtime_0.5__seed_0__actualswaps_False.tsv'
+CURRENT = 'toy__sampler_CM__swaps_10__runtime_0.5__seed_0__sample_3__actualswaps_False.tsv'
+
+
+def write_edges(path, edges):
+    with open(path, 'w') as out_f:
+        for u, v in edges:
+            out_f.write(f'{u}\t{v}\n')
+
+
+def make_out_dir(tmp_path):
+    for name in (LEGACY, CURRENT,
+                 # other sampler, other graph, and tables
+                 'toy__sampler_LA__swaps_10__runtime_0.5__seed_0__sample_0__actualswaps_False.tsv',
+                 'other__sampler_CM__swaps_10__runtime_0.5__seed_0__actualswaps_False.tsv',
+                 'statistics__toy__sampler_CM__swaps_10__seed_0__actualswaps_False.tsv',
+                 'evaluation__toy__sampler_CM.tsv'):
+        write_edges(tmp_path / name, EDGES)
+    return str(tmp_path)
+
+
+def test_find_samples_both_naming_schemes(tmp_path):
+    out_dir = make_out_dir(tmp_path)
+    samples = rev.find_samples(out_dir, 'toy', 'CM')
+    assert sorted(os.path.basename(path) for path, _ in samples) == sorted([LEGACY, CURRENT])
+    assert rev.find_samples(out_dir, 'toy', 'CM', seeds=[1]) == []
+
+
+def test_evaluate_samples_ids(tmp_path):
+    out_dir = make_out_dir(tmp_path)
+    sampler = build_sampler('CM', EDGES, ut.compute_degree_sequence_from_list(EDGES), LABELS)
+    tasks = rev.evaluation_tasks(rev.find_samples(out_dir, 'toy', 'CM'))
+    rows = rev.evaluate_samples([sampler, ['self_loops'], tasks[0]])
+    ids = {row['file']: row['sample'] for row in rows}
+    assert ids == {LEGACY: -1, CURRENT: 3}
+    assert all(row['self_loops'] == 0 for row in rows)